@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from collections import deque
+
+from .Config_Store import config_store
+from .Preset_Store import preset_store
+from .Instrumentation import get_logger, set_log_level
+
+logger = get_logger("LPF_Bulk")
+
+
+OPERATIONS = ("clean", "repair", "inject", "extract")
+
+# 目录输入时读取的文件类型
+PROMPT_EXTENSIONS = (".txt", ".xml")
+
+# 每个工作进程最多同时分到这么多块，读取输入与写出结果不会积压在内存中
+_CHUNKS_PER_WORKER = 2
+
+# 工作进程中的任务（由 _init_worker 设置）
+_WORKER_TASK = None
+
+
+class BulkTask:
+    """
+    一次批处理的操作与参数。只含可序列化的数据，由主进程准备好传给工作进程：
+    注入用的预设在主进程中读取，工作进程不访问配置文件与预设库。
+    """
+
+    def __init__(self, op, header="", targets=None):
+        self.op = op
+        self.header = header
+        # 注入：[(预设名称, artist, style)]，已拼接 artist_add / style_add
+        self.targets = targets or []
+
+    @property
+    def signature(self):
+        """操作与参数的摘要来源，参数变化后所有输入都会重新处理"""
+        return json.dumps([self.op, self.header, self.targets], ensure_ascii=False)
+
+    def run(self, item_id, text):
+        """处理一条输入，返回输出记录的列表（注入时每个预设一条）"""
+        if self.op == "clean":
+            from .LLM_Node import clean_prompt_document
+            doc = clean_prompt_document(text, self.header)
+            return [{"id": item_id, "status": "ok" if doc.root is not None else "no_img", "output": doc.to_string()}]
+
+        if self.op == "repair":
+            from .LLM_Node import repair_xml_tree
+            output, root = repair_xml_tree(text)
+            return [{"id": item_id, "status": "ok" if root is not None else "unrepaired", "output": output}]
+
+        if self.op == "extract":
+            from .Style_Saver_Node import extract_tags
+            artist, style = extract_tags(text)
+            return [{"id": item_id, "status": "ok", "artist": artist, "style": style,
+                     "output": f"<artist>{artist}</artist>\n<style>{style}</style>"}]
+
+        # inject：文档只解析一次，所有预设共用
+        from .Xml_Document import LPFXmlDocument
+        from .LLM_Style_Node import StyleSweep
+        source = LPFXmlDocument.from_string(text)
+        if source.root is None:
+            return [{"id": item_id, "preset": name, "status": "no_img", "output": text} for name, _, _ in self.targets]
+        sweep = StyleSweep(source)
+        records = []
+        for name, artist, style in self.targets:
+            try:
+                records.append({"id": item_id, "preset": name, "status": "ok", "output": sweep.render(artist, style).to_string()})
+            except Exception as e:
+                records.append({"id": item_id, "preset": name, "status": "error", "error": str(e)})
+        return records
+
+
+def content_hash(signature, text):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(signature.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def iter_inputs(paths, field="text"):
+    """
+    逐条读取输入，产出 (id, 文本)：
+    - 目录：其中所有 .txt / .xml 文件（递归，按路径排序），id 为文件路径
+    - .jsonl 文件：每行一个 JSON 对象，文本取 field 字段，id 取 id 字段（缺省为 文件:行号）
+    - 其他文件：整个文件为一条输入
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(PROMPT_EXTENSIONS):
+                        full_path = os.path.join(root, name)
+                        yield full_path, _read_text(full_path)
+        elif path.lower().endswith(".jsonl"):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"{path}:{line_no} 不是合法的 JSON，已跳过。")
+                        continue
+                    text = record.get(field) if isinstance(record, dict) else None
+                    if not isinstance(text, str):
+                        logger.warning(f"{path}:{line_no} 缺少字符串字段 {field}，已跳过。")
+                        continue
+                    yield str(record.get("id", f"{path}:{line_no}")), text
+        else:
+            yield path, _read_text(path)
+
+
+def load_manifest(path):
+    """读取清单（每行 {"id", "hash"}，后写入的为准）；文件不存在时返回空字典"""
+    manifest = {}
+    if not os.path.exists(path):
+        return manifest
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                manifest[entry["id"]] = entry["hash"]
+            except (ValueError, KeyError, TypeError):
+                # 写到一半中断的最后一行
+                continue
+    return manifest
+
+
+def _open_for_append(path):
+    """
+    以追加方式打开 JSONL 文件。上次运行中断时最后一行可能只写了一半，先截掉这一行，
+    否则新的记录会接在它后面，两条记录都无法读取。
+    """
+    try:
+        with open(path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                step = min(65536, position)
+                f.seek(position - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position != end:
+                f.truncate(position)
+    except FileNotFoundError:
+        pass
+    return open(path, 'a', encoding='utf-8')
+
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(task, log_level):
+    global _WORKER_TASK
+    _WORKER_TASK = task
+    set_log_level(log_level)
+
+
+def process_chunk(chunk):
+    """在工作进程中处理一块输入，返回 [(id, 摘要, 输出记录, 是否成功)]"""
+    results = []
+    for item_id, text, digest in chunk:
+        try:
+            records = _WORKER_TASK.run(item_id, text)
+            ok = all(record["status"] != "error" for record in records)
+        except Exception as e:
+            records = [{"id": item_id, "status": "error", "error": str(e)}]
+            ok = False
+        results.append((item_id, digest, records, ok))
+    return results
+
+
+def run_bulk(task, items, output_path, manifest_path, jobs=1, chunk_size=64, force=False, log_level="CRITICAL"):
+    """
+    处理 items 中的 (id, 文本)，结果逐块追加到 output_path（JSONL）。
+    与清单中摘要相同的输入直接跳过；每块结果写出后才记入清单，中断后重新运行会从未完成的部分继续。
+    返回统计 {"processed", "skipped", "errors", "records"}。
+    """
+    manifest = {} if force else load_manifest(manifest_path)
+    stats = {"processed": 0, "skipped": 0, "errors": 0, "records": 0}
+    signature = task.signature
+
+    def pending():
+        for item_id, text in items:
+            digest = content_hash(signature, text)
+            if manifest.get(item_id) == digest:
+                stats["skipped"] += 1
+                continue
+            yield item_id, text, digest
+
+    with _open_for_append(output_path) as out, _open_for_append(manifest_path) as manifest_file:
+        def write(results):
+            for item_id, digest, records, ok in results:
+                for record in records:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["records"] += len(records)
+                stats["processed"] += 1
+                if not ok:
+                    # 出错的输入不记入清单，下次运行重试
+                    stats["errors"] += 1
+            out.flush()
+            for item_id, digest, records, ok in results:
+                if ok:
+                    manifest_file.write(json.dumps({"id": item_id, "hash": digest}, ensure_ascii=False) + "\n")
+            manifest_file.flush()
+
+        chunks = _chunked(pending(), chunk_size)
+        if jobs <= 1:
+            _init_worker(task, log_level)
+            for chunk in chunks:
+                write(process_chunk(chunk))
+            return stats
+
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(task, log_level)) as pool:
+            # 按提交顺序写出，提交的块数有上限，避免一次读入全部输入
+            window = deque()
+            for chunk in chunks:
+                window.append(pool.apply_async(process_chunk, (chunk,)))
+                if len(window) >= jobs * _CHUNKS_PER_WORKER:
+                    write(window.popleft().get())
+            while window:
+                write(window.popleft().get())
+    return stats
+
+
+def build_task(args, config):
+    """按命令行参数准备任务；注入时在此读取预设"""
+    if args.op in ("clean", "repair", "extract"):
+        header = config.gemma_prompt if args.header is None else args.header
+        return BulkTask(args.op, header=header if args.op == "clean" else "")
+
+    from .LLM_Style_Node import LLM_Xml_Style_Sweep, combine_tags
+    selected = LLM_Xml_Style_Sweep.select_presets(config, "\n".join(args.preset), args.search, args.max_presets)
+    if not selected:
+        raise SystemExit("未选择任何预设：请使用 --preset 或 --search 指定。")
+    targets = []
+    for name, preset in selected:
+        targets.append((name,
+                        combine_tags(args.artist_add, preset.get("artist", "").strip()),
+                        combine_tags(args.style_add, preset.get("style", "").strip())))
+    return BulkTask("inject", targets=targets)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="离线批量处理提示词：clean（clean_prompt）、repair（repair_xml_custom）、"
+                    "inject（风格注入）、extract（提取 artist / style）。不需要 ComfyUI，也不访问网络。")
+    parser.add_argument("op", choices=OPERATIONS, help="操作")
+    parser.add_argument("inputs", nargs="+", help="提示词文件、目录（.txt / .xml）或 .jsonl 文件")
+    parser.add_argument("-o", "--output", required=True, help="输出的 JSONL 文件（追加写入）")
+    parser.add_argument("--manifest", default=None, help="清单文件，默认为 <output>.manifest")
+    parser.add_argument("--force", action="store_true", help="忽略清单，重新处理全部输入")
+    parser.add_argument("--field", default="text", help="JSONL 输入中提示词所在的字段")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--chunk-size", type=int, default=64, help="每次分给工作进程的输入条数")
+    parser.add_argument("--config", default=None, help="LPF_config.json 的路径，默认为插件目录中的配置文件")
+    parser.add_argument("--presets-db", default=None, help="inject：预设库 LPF_presets.db 的路径，默认为插件目录中的预设库")
+    parser.add_argument("--header", default=None, help="clean：加在 <img> 前的文字，默认为配置文件中的 gemma_prompt")
+    parser.add_argument("--preset", action="append", default=[], help="inject：预设名称，可重复指定")
+    parser.add_argument("--search", default="", help="inject：检索预设（名称或标签），结果接在 --preset 之后")
+    parser.add_argument("--max-presets", type=int, default=100, help="inject：最多使用的预设数")
+    parser.add_argument("--artist-add", default="", help="inject：拼接在每个预设 artist 前的内容")
+    parser.add_argument("--style-add", default="", help="inject：拼接在每个预设 style 前的内容")
+    parser.add_argument("--log-level", default="CRITICAL",
+                        help="控制台日志级别，默认不输出逐条的日志（每条结果的 status 字段记录了处理状态）")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config_store.path = os.path.abspath(args.config)
+        config_store.invalidate()
+    if args.presets_db:
+        preset_store.path = os.path.abspath(args.presets_db)
+    config = config_store.snapshot()
+    task = build_task(args, config)
+    manifest_path = args.manifest or f"{args.output}.manifest"
+
+    start = time.perf_counter()
+    set_log_level(args.log_level.upper())
+    stats = run_bulk(task, iter_inputs(args.inputs, args.field), args.output, manifest_path,
+                     jobs=max(1, args.jobs), chunk_size=max(1, args.chunk_size), force=args.force,
+                     log_level=args.log_level.upper())
+    elapsed = time.perf_counter() - start
+    rate = stats["processed"] / elapsed if elapsed > 0 else 0.0
+    print(f"处理 {stats['processed']} 条（输出 {stats['records']} 条，出错 {stats['errors']} 条），"
+          f"跳过未变化的 {stats['skipped']} 条，用时 {elapsed:.2f} 秒（{rate:.0f} 条/秒）。", file=sys.stderr)
+    return 1 if stats["errors"] else 0
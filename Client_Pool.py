@@ -0,0 +1,146 @@
+import time
+import atexit
+import threading
+import importlib.util
+from contextlib import contextmanager
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Client_Pool")
+
+
+# 与 openai SDK 的默认值保持一致
+DEFAULT_HTTP_SETTINGS = {
+    "timeout": 600.0,
+    "connect_timeout": 5.0,
+    "max_retries": 2,
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 90.0,
+    "http2": True,
+    "idle_ttl": 600.0,
+}
+
+# HTTP/2 需要额外安装 h2（pip install "httpx[http2]"），缺失时退回 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def resolve_http_settings(config):
+    """合并配置文件中的 http_client 段与默认值"""
+    settings = dict(DEFAULT_HTTP_SETTINGS)
+    user_settings = config.get("http_client", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_HTTP_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"http_client.{name} 配置无效，已使用默认值 {default}。")
+    if settings["http2"] and not HTTP2_AVAILABLE:
+        settings["http2"] = False
+    return settings
+
+
+class _PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class ClientPool:
+    """
+    进程内共享的 OpenAI 客户端池。
+    按 (key, url, 超时/连接参数) 复用客户端，使连续的请求复用同一条 keep-alive / HTTP2 连接；
+    空闲超过 idle_ttl 的客户端会被后台线程关闭。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._reaper = None
+        self._reap_interval = None
+
+    def _build(self, api_key, api_url, settings):
+        # openai SDK 导入较慢，首次发送请求时才加载，不拖慢 ComfyUI 启动
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+
+        timeout = httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"])
+        http_client = DefaultHttpxClient(
+            http2=settings["http2"],
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry"],
+            ),
+        )
+        return OpenAI(
+            api_key=api_key,
+            base_url=api_url,
+            timeout=timeout,
+            max_retries=settings["max_retries"],
+            http_client=http_client,
+        )
+
+    @contextmanager
+    def client(self, api_key, api_url, settings):
+        """借出一个客户端，使用期间不会被回收"""
+        pool_key = (api_key, api_url, tuple(sorted(settings.items())))
+        with self._lock:
+            entry = self._clients.get(pool_key)
+            if entry is None:
+                entry = _PooledClient(self._build(api_key, api_url, settings))
+                self._clients[pool_key] = entry
+                logger.info(f"已创建新的 API 客户端（HTTP/2: {settings['http2']}）。")
+            entry.in_use += 1
+            self._ensure_reaper(settings["idle_ttl"])
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def _ensure_reaper(self, idle_ttl):
+        interval = max(1.0, idle_ttl / 2)
+        if self._reaper is not None and self._reaper.is_alive():
+            self._reap_interval = min(self._reap_interval, interval)
+            return
+        self._reap_interval = interval
+        self._reaper = threading.Thread(target=self._reap_loop, name="LPF_Client_Reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self._reap_interval)
+            with self._lock:
+                if not self._clients:
+                    self._reaper = None
+                    return
+            self.close_idle()
+
+    def close_idle(self, idle_ttl=None):
+        """关闭空闲超时的客户端，返回关闭的数量"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for pool_key, entry in list(self._clients.items()):
+                ttl = idle_ttl if idle_ttl is not None else dict(pool_key[2])["idle_ttl"]
+                if entry.in_use == 0 and now - entry.last_used >= ttl:
+                    expired.append(entry)
+                    del self._clients[pool_key]
+        for entry in expired:
+            try:
+                entry.client.close()
+            except Exception:
+                pass
+        return len(expired)
+
+    def close_all(self):
+        self.close_idle(idle_ttl=0)
+
+
+client_pool = ClientPool()
+atexit.register(client_pool.close_all)
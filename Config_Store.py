@@ -0,0 +1,144 @@
+import os
+import json
+import copy
+import threading
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Config")
+
+
+CONFIG_FILENAME = "LPF_config.json"
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILENAME)
+
+# UI 中的占位文本，出现这些值时视为未填写
+KEY_PLACEHOLDERS = ["sk-...", "读取API失败，请在此填写api key", "", "已从配置文件中读取api key，在此填写将不生效", None]
+URL_PLACEHOLDERS = ["https://xxx.ai/api/v1", "读取API失败，请在此填写api url", "", "已从配置文件中读取api url，在此填写将不生效", None]
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant that provides prompt tags."
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_GEMMA_PROMPT = "You are an assistant designed to generate high-quality anime images with the highest degree of image-text alignment based on xml format textual prompts. <Prompt Start>\n"
+
+# 预定义默认样式
+DEFAULT_STYLES = {
+    "空样式，请在下方文本框中自行书写": {
+        "artist": "",
+        "style": ""
+    }
+}
+
+
+class ConfigSnapshot:
+    """
+    某一时刻 LPF_config.json 的只读视图。
+    派生数据在加载时一次性算好，节点直接取用。
+    """
+
+    def __init__(self, data, error=None):
+        self.data = data
+        self.error = error
+
+        config_key = data.get("api_key")
+        config_url = data.get("api_url")
+        self.api_key = config_key.replace(" ", "") if isinstance(config_key, str) and config_key not in KEY_PLACEHOLDERS else None
+        self.api_url = config_url.replace(" ", "") if isinstance(config_url, str) and config_url not in URL_PLACEHOLDERS else None
+
+        self.system_prompt = data.get("system_prompt", DEFAULT_SYSTEM_PROMPT)
+        self.jailbreaker = data.get("gemini_jailbreaker", "")
+        self.gemma_prompt = data.get("gemma_prompt", DEFAULT_GEMMA_PROMPT)
+        try:
+            self.temperature = float(data.get("temperature", DEFAULT_TEMPERATURE))
+        except (TypeError, ValueError):
+            self.temperature = DEFAULT_TEMPERATURE
+
+        model_list = data.get("model_list", [])
+        self.model_list = model_list if isinstance(model_list, list) else []
+
+        styles = DEFAULT_STYLES.copy()
+        user_styles = data.get("styles", {})
+        if isinstance(user_styles, dict) and user_styles:
+            styles.update(user_styles)
+        self.styles = styles
+        # 下拉框顺序：默认样式在前，其余按配置文件中的顺序
+        self.style_keys = list(styles.keys())
+
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def derived(self, key, builder):
+        """
+        按配置版本缓存派生数据（如节点的 INPUT_TYPES）：配置文件不变时 builder(self) 只调用一次。
+        返回的是共享对象，调用方不要修改。
+        """
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self)
+            return self._derived[key]
+
+
+class ConfigStore:
+    """
+    进程内共享的配置缓存。
+    仅当文件的 mtime 或大小变化时才重新解析；写入方调用 invalidate() 使其失效。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._snapshot = ConfigSnapshot({})
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def snapshot(self):
+        """返回当前配置的快照，必要时重新加载"""
+        signature = self._stat_signature()
+        with self._lock:
+            if signature == self._signature:
+                return self._snapshot
+
+            data = {}
+            error = None
+            if signature is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error loading {os.path.basename(self.path)}: {e}")
+                    data = {}
+                    error = e
+                if not isinstance(data, dict):
+                    data = {}
+
+            self._snapshot = ConfigSnapshot(data, error)
+            self._signature = signature
+            return self._snapshot
+
+    def get(self):
+        """返回原始配置字典（共享对象，请勿修改）"""
+        return self.snapshot().data
+
+    def load_for_update(self):
+        """
+        返回可修改的配置副本，供写入方使用。
+        文件损坏时抛出原始异常，避免用空配置覆盖用户文件。
+        """
+        snapshot = self.snapshot()
+        if snapshot.error is not None:
+            raise snapshot.error
+        return copy.deepcopy(snapshot.data)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+
+config_store = ConfigStore(CONFIG_PATH)
@@ -0,0 +1,119 @@
+from .Instrumentation import get_logger, usage_counts
+from .LLM_Completion import IMG_OPEN, IMG_CLOSE, FENCE
+
+logger = get_logger("LPF_Continuation")
+
+
+DEFAULT_CONTINUATION_SETTINGS = {
+    "enabled": True,
+    "max_rounds": 2,
+    "max_tokens": 4000,
+}
+
+# 不支持预填充的平台：把截断的回复作为上一轮 assistant 消息，再请模型接着写
+CONTINUE_INSTRUCTION = "上一条回复因长度限制被截断。请从中断处继续输出剩余内容，不要重复已输出的内容，不要添加任何说明。"
+
+# 续写开头与已有内容重叠时，最多检查这么多字符
+_MAX_OVERLAP = 400
+
+
+def resolve_continuation_settings(config):
+    """合并配置文件中的 continuation 段与默认值"""
+    settings = dict(DEFAULT_CONTINUATION_SETTINGS)
+    user_settings = config.get("continuation", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_CONTINUATION_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"continuation.{name} 配置无效，已使用默认值 {default}。")
+    settings["max_rounds"] = max(0, settings["max_rounds"])
+    settings["max_tokens"] = max(0, settings["max_tokens"])
+    return settings
+
+
+def truncation_reason(result, structured=False):
+    """回复被截断时返回原因，否则返回 None。结构化输出只能依据 finish_reason 判断"""
+    if result.stopped_early:
+        return None
+    if result.finish_reason == "length":
+        return "finish_reason 为 length"
+    if not structured:
+        content = result.content
+        open_at = content.rfind(IMG_OPEN)
+        if open_at != -1 and content.find(IMG_CLOSE, open_at) == -1:
+            return "<img> 未闭合"
+    return None
+
+
+def supports_prefill(api_url):
+    """OpenRouter 允许以 assistant 消息结尾（预填充），模型直接从该消息末尾接着生成"""
+    return 'openrouter' in api_url
+
+
+def continuation_messages(messages, partial, prefill):
+    if prefill:
+        return messages + [{"role": "assistant", "content": partial}]
+    return messages + [{"role": "assistant", "content": partial}, {"role": "user", "content": CONTINUE_INSTRUCTION}]
+
+
+def stitch(partial, continuation):
+    """
+    把续写内容接在已有回复之后：去掉模型重复输出的重叠部分与多余的代码块开头；
+    模型没有接着写而是从 <img> 重新开始时，以新的回复为准。
+    """
+    open_at = partial.rfind(IMG_OPEN)
+    if open_at != -1 and partial.find(IMG_CLOSE, open_at) == -1 and IMG_OPEN in continuation:
+        start = continuation.find(IMG_OPEN)
+        fence_at = continuation.rfind(FENCE, 0, start)
+        return continuation[fence_at if fence_at != -1 else start:]
+
+    stripped = continuation.lstrip()
+    if stripped.startswith(FENCE) and partial.count(FENCE) % 2 == 1:
+        # 已有回复中的代码块尚未结束，续写却又开了一个
+        newline = stripped.find("\n")
+        continuation = stripped[newline + 1:] if newline != -1 else ""
+
+    for size in range(min(len(partial), len(continuation), _MAX_OVERLAP), 8, -1):
+        if partial.endswith(continuation[:size]):
+            continuation = continuation[size:]
+            break
+    return partial + continuation
+
+
+class CombinedUsage:
+    """多次请求的 token 用量之和，字段与 SDK 的 usage 对象相同"""
+
+    def __init__(self, usages):
+        totals = {}
+        for usage in usages:
+            for name, value in usage_counts(usage).items():
+                totals[name] = totals.get(name, 0) + value
+        self.prompt_tokens = totals.get("prompt_tokens", 0)
+        self.completion_tokens = totals.get("completion_tokens", 0)
+        self.total_tokens = totals.get("total_tokens", self.prompt_tokens + self.completion_tokens)
+        self.prompt_tokens_details = None
+        if "cached_prompt_tokens" in totals:
+            self.prompt_tokens_details = {"cached_tokens": totals["cached_prompt_tokens"]}
+        self.completion_tokens_details = None
+        if "reasoning_tokens" in totals:
+            self.completion_tokens_details = {"reasoning_tokens": totals["reasoning_tokens"]}
+
+
+def tokens_saved(first_usage, continuation_usages):
+    """
+    与整体重新生成相比节省的 token：重新生成需要再付一次原始输入与全部输出，
+    续写需要付每一轮的输入（原始输入 + 已有回复）与新增的输出。两者的新增输出相同，
+    因此节省量 = 首次请求的输入与输出 - 各轮续写的输入。用量未知时返回 None。
+    """
+    first = usage_counts(first_usage)
+    if "prompt_tokens" not in first or "completion_tokens" not in first:
+        return None
+    saved = first["prompt_tokens"] + first["completion_tokens"]
+    for usage in continuation_usages:
+        counts = usage_counts(usage)
+        if "prompt_tokens" not in counts:
+            return None
+        saved -= counts["prompt_tokens"]
+    return saved
@@ -0,0 +1,280 @@
+import time
+import queue
+import threading
+
+from .Config_Store import KEY_PLACEHOLDERS, URL_PLACEHOLDERS
+from .LLM_Completion import CancelEvent
+from .Request_Scheduler import provider_key
+from .Instrumentation import get_logger, metrics, prometheus_label
+
+logger = get_logger("LPF_Router")
+
+
+DEFAULT_FAILOVER_SETTINGS = {
+    "hedge": False,
+    "hedge_after": 0.0,
+    "hedge_quantile": 0.95,
+    "hedge_default": 8.0,
+    "hedge_min": 1.0,
+    "hedge_max": 60.0,
+    "min_samples": 20,
+}
+
+# 首 token 耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0, 24.0, 32.0, 48.0, 64.0, 96.0, 128.0)
+
+# 每次记录前旧样本的衰减系数：约 70 次请求后旧样本的权重减半，阈值随平台状况变化
+_DECAY = 0.99
+
+
+def resolve_failover_settings(config):
+    """合并配置文件中的 failover 段与默认值；endpoints 为主接口之后依次尝试的接口列表"""
+    settings = dict(DEFAULT_FAILOVER_SETTINGS)
+    user_settings = config.get("failover", {})
+    if not isinstance(user_settings, dict):
+        user_settings = {}
+    for name, default in DEFAULT_FAILOVER_SETTINGS.items():
+        value = user_settings.get(name, default)
+        try:
+            settings[name] = type(default)(value)
+        except (TypeError, ValueError):
+            logger.warning(f"failover.{name} 配置无效，已使用默认值 {default}。")
+    settings["hedge_quantile"] = min(0.999, max(0.5, settings["hedge_quantile"]))
+
+    endpoints = user_settings.get("endpoints", [])
+    settings["endpoints"] = [entry for entry in endpoints if isinstance(entry, dict)] if isinstance(endpoints, list) else []
+    return settings
+
+
+class Endpoint:
+    """一个可以发送请求的 (API url, API key, 模型) 组合"""
+
+    def __init__(self, api_key, api_url, model_name):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model_name = model_name
+
+    @property
+    def label(self):
+        return f"{provider_key(self.api_url)}/{self.model_name}"
+
+    def __eq__(self, other):
+        return isinstance(other, Endpoint) and \
+            (self.api_key, self.api_url, self.model_name) == (other.api_key, other.api_url, other.model_name)
+
+    def __hash__(self):
+        return hash((self.api_key, self.api_url, self.model_name))
+
+
+def resolve_endpoints(primary, settings):
+    """主接口在前，其后为配置中的备用接口；备用接口未填写的 url / key / 模型沿用主接口"""
+    endpoints = [primary]
+    for entry in settings["endpoints"]:
+        api_url = entry.get("api_url")
+        api_key = entry.get("api_key")
+        model_name = entry.get("model") or entry.get("model_name")
+        api_url = api_url.replace(" ", "") if isinstance(api_url, str) and api_url not in URL_PLACEHOLDERS else primary.api_url
+        api_key = api_key.replace(" ", "") if isinstance(api_key, str) and api_key not in KEY_PLACEHOLDERS else primary.api_key
+        model_name = model_name if isinstance(model_name, str) and model_name.strip() else primary.model_name
+        endpoint = Endpoint(api_key, api_url, model_name.strip())
+        if endpoint not in endpoints:
+            endpoints.append(endpoint)
+    return endpoints
+
+
+class LatencyHistogram:
+    """带指数衰减的分桶直方图，用于估计某个接口首 token 耗时的分位数"""
+
+    def __init__(self):
+        self.counts = [0.0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.samples = 0
+        # 供 Prometheus 导出的累计值（不衰减）
+        self.cumulative = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts = [count * _DECAY for count in self.counts]
+        i = 0
+        while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1.0
+        self.total = self.total * _DECAY + 1.0
+        self.samples += 1
+        self.cumulative[i] += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """在桶内线性插值；落在最后一个桶之外时返回最大的桶边界"""
+        if self.total <= 0:
+            return None
+        target = q * self.total
+        seen = 0.0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+            if count > 0 and seen + count >= target:
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+            lower = upper
+        return LATENCY_BUCKETS[-1]
+
+
+class RequestCancelled(Exception):
+    """对冲请求中落败的一方在重试前被取消"""
+
+
+class EndpointRouter:
+    """
+    在多个接口之间发送同一请求：
+    普通模式下按顺序故障转移；对冲模式下主接口超过阈值仍未返回首 token 时，向下一个接口再发一次，
+    先完成者胜出，另一方被取消。阈值默认取该接口首 token 耗时直方图的分位数，随运行自动调整。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        metrics.add_collector(self.prometheus_text)
+
+    def observe(self, label, seconds):
+        with self._lock:
+            histogram = self._histograms.get(label)
+            if histogram is None:
+                histogram = self._histograms[label] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def hedge_threshold(self, label, settings):
+        if settings["hedge_after"] > 0:
+            return settings["hedge_after"]
+        with self._lock:
+            histogram = self._histograms.get(label)
+            value = None
+            if histogram is not None and histogram.samples >= settings["min_samples"]:
+                value = histogram.quantile(settings["hedge_quantile"])
+        if value is None:
+            value = settings["hedge_default"]
+        return min(settings["hedge_max"], max(settings["hedge_min"], value))
+
+    def call(self, endpoints, attempt, settings, run=None):
+        """
+        attempt(endpoint, cancel_event, on_first_token) 发送一次请求并返回 CompletionResult。
+        返回 (胜出的接口, 结果)；全部失败时抛出第一个接口的异常。
+        """
+        if settings["hedge"] and len(endpoints) > 1:
+            return self._hedged(endpoints, attempt, settings, run)
+
+        errors = []
+        for i, endpoint in enumerate(endpoints):
+            try:
+                result = attempt(endpoint, None, None)
+            except Exception as e:
+                errors.append(e)
+                if i + 1 < len(endpoints):
+                    logger.warning(f"{endpoint.label} 请求失败（{e}），切换到 {endpoints[i + 1].label}。")
+                    if run is not None:
+                        run.set(failovers=i + 1)
+                continue
+            if result.ttft is not None:
+                self.observe(endpoint.label, result.ttft)
+            return endpoint, result
+        raise errors[0]
+
+    def _hedged(self, endpoints, attempt, settings, run):
+        done = queue.Queue()
+        cancels = []
+        first_tokens = []
+
+        def start(i):
+            endpoint = endpoints[i]
+            cancel_event = CancelEvent()
+            first_token = threading.Event()
+            cancels.append(cancel_event)
+            first_tokens.append(first_token)
+            started = time.perf_counter()
+
+            def on_first_token():
+                first_token.set()
+                self.observe(endpoint.label, time.perf_counter() - started)
+
+            def worker():
+                try:
+                    result = attempt(endpoint, cancel_event, on_first_token)
+                    done.put((i, True, result))
+                except Exception as e:
+                    done.put((i, False, e))
+                finally:
+                    if cancel_event.is_set() and not first_token.is_set():
+                        # 被取消时尚未收到首 token：耗时至少为此值，同样计入直方图
+                        self.observe(endpoint.label, time.perf_counter() - started)
+
+            threading.Thread(target=worker, name=f"LPF_Hedge_{i}", daemon=True).start()
+
+        # lead 为当前等待首 token 的接口；它失败后由下一个接口接替，对冲计时重新开始
+        lead = 0
+        threshold = self.hedge_threshold(endpoints[lead].label, settings)
+        deadline = time.monotonic() + threshold
+        start(lead)
+        next_index = 1
+        pending = 1
+        hedge_armed = True
+        errors = []
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if hedge_armed and next_index < len(endpoints) else None
+            try:
+                i, ok, value = done.get(timeout=timeout)
+            except queue.Empty:
+                # 每次请求最多对冲一次
+                hedge_armed = False
+                if not first_tokens[lead].is_set():
+                    logger.warning(f"{endpoints[lead].label} 超过 {threshold:.1f}s 仍未返回首 token，"
+                                   f"向 {endpoints[next_index].label} 发出对冲请求。")
+                    if run is not None:
+                        run.set(hedged=True, hedge_after=round(threshold, 3))
+                    start(next_index)
+                    next_index += 1
+                    pending += 1
+                continue
+
+            pending -= 1
+            if ok:
+                for j, cancel_event in enumerate(cancels):
+                    if j != i:
+                        cancel_event.set()
+                if i > 0:
+                    logger.info(f"采用 {endpoints[i].label} 的结果。")
+                return endpoints[i], value
+
+            errors.append(value)
+            if next_index < len(endpoints):
+                logger.warning(f"{endpoints[i].label} 请求失败（{value}），切换到 {endpoints[next_index].label}。")
+                if run is not None:
+                    run.set(failovers=len(errors))
+                if i == lead:
+                    lead = next_index
+                    threshold = self.hedge_threshold(endpoints[lead].label, settings)
+                    deadline = time.monotonic() + threshold
+                start(next_index)
+                next_index += 1
+                pending += 1
+            elif pending == 0:
+                raise errors[0]
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP lpf_endpoint_ttft_seconds Time to first token per endpoint (streaming and hedged requests).",
+            "# TYPE lpf_endpoint_ttft_seconds histogram",
+        ]
+        with self._lock:
+            for label, histogram in sorted(self._histograms.items()):
+                labels = f'endpoint="{prometheus_label(label)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.cumulative):
+                    cumulative += count
+                    lines.append(f'lpf_endpoint_ttft_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'lpf_endpoint_ttft_seconds_bucket{{{labels},le="+Inf"}} {histogram.samples}')
+                lines.append(f'lpf_endpoint_ttft_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+                lines.append(f'lpf_endpoint_ttft_seconds_count{{{labels}}} {histogram.samples}')
+        return "\n".join(lines) + "\n"
+
+
+endpoint_router = EndpointRouter()
@@ -0,0 +1,159 @@
+import io
+import time
+import base64
+import weakref
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Image_Encoder")
+
+
+DEFAULT_IMAGE_SETTINGS = {
+    "max_long_side": 0,
+    "format": "JPEG",
+    "quality": 90,
+    "cache_entries": 16,
+}
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# 分块转换时每块的行数，浮点临时缓冲区只占这么多行
+_CONVERT_ROWS = 128
+
+# id(图片张量) -> (弱引用, {index: (张量版本, 摘要)})。IS_CHANGED 与节点执行收到的是同一个张量对象，
+# 同一张图片只哈希一次；张量释放时由弱引用的回调移除。原地修改张量后 torch 的 _version 会变化。
+# 不用 WeakKeyDictionary：它用 == 比较键，torch 张量的 == 是逐元素比较
+_DIGESTS = {}
+
+
+def resolve_image_settings(config):
+    """合并配置文件中的 image_encoding 段与默认值"""
+    settings = dict(DEFAULT_IMAGE_SETTINGS)
+    user_settings = config.get("image_encoding", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_IMAGE_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"image_encoding.{name} 配置无效，已使用默认值 {default}。")
+    settings["format"] = settings["format"].upper().replace("JPG", "JPEG")
+    if settings["format"] not in MIME_TYPES:
+        logger.warning(f"不支持的图片格式 {settings['format']}，已使用 JPEG。")
+        settings["format"] = "JPEG"
+    settings["quality"] = min(100, max(1, settings["quality"]))
+    return settings
+
+
+def _as_array(image_tensor, index):
+    """取出批次中的一张图片；CPU 上的 torch 张量 .numpy() 与原张量共享内存，不复制"""
+    item = image_tensor[index]
+    if hasattr(item, "cpu"):
+        item = item.detach().cpu().numpy()
+    return np.ascontiguousarray(item)
+
+
+def image_digest(image_tensor, index=0):
+    """对实际发送的图片（批次中的第 index 张）做内容哈希；同一个张量对象的结果会被记住"""
+    # 只有 torch 张量带有版本号；其他对象（如 numpy 数组）每次重新哈希
+    version = getattr(image_tensor, "_version", None)
+    key = id(image_tensor)
+    entry = _DIGESTS.get(key)
+    if version is not None and entry is not None and entry[0]() is image_tensor:
+        cached = entry[1].get(index)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    array = _as_array(image_tensor, index)
+    h = hashlib.sha256()
+    h.update(f"{array.shape}{array.dtype}".encode('utf-8'))
+    h.update(array.data)
+    digest = h.hexdigest()
+    if version is not None:
+        if entry is None or entry[0]() is not image_tensor:
+            entry = _DIGESTS[key] = (weakref.ref(image_tensor, lambda _, key=key: _DIGESTS.pop(key, None)), {})
+        entry[1][index] = (version, digest)
+    return digest
+
+
+def to_uint8(array):
+    """
+    [0, 1] 浮点图片转 uint8。
+    按行分块写入预分配的输出，浮点临时缓冲区只有一个块大小，避免整幅图的浮点副本。
+    """
+    if array.dtype == np.uint8:
+        return array
+    out = np.empty(array.shape, dtype=np.uint8)
+    rows = array.shape[0]
+    scratch = np.empty((min(_CONVERT_ROWS, rows),) + array.shape[1:], dtype=np.float32)
+    for start in range(0, rows, _CONVERT_ROWS):
+        block = array[start:start + _CONVERT_ROWS]
+        buf = scratch[:block.shape[0]]
+        np.multiply(block, 255.0, out=buf)
+        np.clip(buf, 0, 255, out=buf)
+        np.copyto(out[start:start + block.shape[0]], buf, casting='unsafe')
+    return out
+
+
+class ImageEncoder:
+    """
+    视觉请求的图片编码：限制长边、按配置的格式与质量压缩，并按图片内容哈希缓存编码结果，
+    同一张图片在多次运行之间不会重复编码。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def encode(self, image_tensor, index, settings, digest=None):
+        """返回 (base64 字符串, MIME 类型)"""
+        if digest is None:
+            digest = image_digest(image_tensor, index)
+        cache_key = (digest, settings["max_long_side"], settings["format"], settings["quality"])
+
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                logger.info("命中图片编码缓存，跳过重新编码。")
+                return cached
+
+        start_time = time.perf_counter()
+        img = Image.fromarray(to_uint8(_as_array(image_tensor, index)))
+        if img.mode not in ("RGB", "L") and settings["format"] == "JPEG":
+            img = img.convert("RGB")
+        original_size = img.size
+
+        max_long_side = settings["max_long_side"]
+        if max_long_side > 0 and max(img.size) > max_long_side:
+            scale = max_long_side / max(img.size)
+            new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            # reducing_gap 先做整数倍盒式缩小，再做双线性插值，大图缩放更快
+            img = img.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+        buffered = io.BytesIO()
+        if settings["format"] == "PNG":
+            img.save(buffered, format="PNG", compress_level=1)
+        else:
+            img.save(buffered, format=settings["format"], quality=settings["quality"])
+        payload = buffered.getvalue()
+        encoded = (base64.b64encode(payload).decode('utf-8'), MIME_TYPES[settings["format"]])
+
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        logger.info(f"图片编码完成：{original_size[0]}x{original_size[1]} -> {img.width}x{img.height} "
+                    f"{settings['format']}，{len(payload) / 1024:.1f} KB（base64 {len(encoded[0]) / 1024:.1f} KB），耗时 {elapsed_ms:.1f} ms。")
+
+        with self._lock:
+            self._cache[cache_key] = encoded
+            while len(self._cache) > max(0, settings["cache_entries"]):
+                self._cache.popitem(last=False)
+        return encoded
+
+
+image_encoder = ImageEncoder()
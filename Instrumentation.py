@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import atexit
+import time
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+
+
+class BColors:
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+METRICS_FILE = os.path.join(LOG_DIR, "metrics.jsonl")
+PROMETHEUS_FILE = os.path.join(LOG_DIR, "metrics.prom")
+
+DEFAULT_LOGGING_SETTINGS = {
+    "level": "INFO",
+    "verbose_reasoning": False,
+    # 指标文件写在插件目录下的 logs/ 中，插件目录可能只读或被多个用户共用，默认不记录
+    "metrics": False,
+    "metrics_max_mb": 8.0,
+    "metrics_backups": 3,
+}
+
+# metrics.prom 由后台线程写入，最多每隔这么久（秒）重写一次
+PROMETHEUS_INTERVAL = 1.0
+
+# 阶段耗时直方图的桶（秒）
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 非 verbose 模式下，长文本（思考内容、完整回复）只输出开头这么多字
+PREVIEW_CHARS = 200
+
+_LOGGER_ROOT = "LPF"
+
+
+class _ConsoleFormatter(logging.Formatter):
+    """保持原有的控制台格式：[节点名]: 内容，警告为黄色、错误为红色"""
+
+    COLORS = {logging.WARNING: BColors.WARNING, logging.ERROR: BColors.FAIL, logging.CRITICAL: BColors.FAIL}
+
+    def format(self, record):
+        tag = record.name.split(".", 1)[-1]
+        message = f"[{tag}]: {record.getMessage()}"
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        color = self.COLORS.get(record.levelno)
+        return f"{color}{message}{BColors.ENDC}" if color else message
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """每次输出时取当前的 sys.stdout（ComfyUI 会替换 stdout 以收集日志）"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def _setup_root_logger():
+    root = logging.getLogger(_LOGGER_ROOT)
+    if not root.handlers:
+        handler = _StdoutHandler()
+        handler.setFormatter(_ConsoleFormatter())
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        # ComfyUI 会配置根 logger，不向上传递以免重复输出
+        root.propagate = False
+    return root
+
+
+def get_logger(tag):
+    """各模块的 logger，tag 即控制台中方括号内的名字"""
+    _setup_root_logger()
+    return logging.getLogger(f"{_LOGGER_ROOT}.{tag}")
+
+
+def set_log_level(level):
+    """直接设置控制台日志级别，不读取配置文件（离线批处理等场景）"""
+    _setup_root_logger().setLevel(level)
+
+
+def resolve_logging_settings(config):
+    """合并配置文件中的 logging 段与默认值"""
+    settings = dict(DEFAULT_LOGGING_SETTINGS)
+    user_settings = config.get("logging", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_LOGGING_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                get_logger("LPF_Metrics").warning(f"logging.{name} 配置无效，已使用默认值 {default}。")
+    settings["level"] = settings["level"].upper()
+    if not isinstance(logging.getLevelName(settings["level"]), int):
+        get_logger("LPF_Metrics").warning(f"未知的日志级别 {settings['level']}，已使用 INFO。")
+        settings["level"] = "INFO"
+    return settings
+
+
+def preview(text, settings):
+    """verbose_reasoning 关闭时截断长文本，只保留开头部分"""
+    text = str(text)
+    if settings["verbose_reasoning"] or len(text) <= PREVIEW_CHARS:
+        return text
+    return f"{text[:PREVIEW_CHARS]} ……（共 {len(text)} 字，已省略。在配置文件中设置 logging.verbose_reasoning 为 true 可输出全部内容）"
+
+
+def _usage_value(obj, *path):
+    """按路径读取 usage 字段，兼容 SDK 对象与 dict"""
+    for name in path:
+        if obj is None:
+            return None
+        obj = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+    return obj
+
+
+def usage_counts(usage):
+    """
+    提取 token 统计。缓存命中的输入 token 在不同平台字段不同：
+    OpenAI / OpenRouter / Gemini 兼容接口为 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens。
+    平台返回缓存命中数时，同时给出未命中（需完整计费）的输入 token 数 uncached_prompt_tokens。
+    """
+    if usage is None:
+        return {}
+    counts = {
+        "prompt_tokens": _usage_value(usage, "prompt_tokens"),
+        "completion_tokens": _usage_value(usage, "completion_tokens"),
+        "total_tokens": _usage_value(usage, "total_tokens"),
+    }
+    cached = _usage_value(usage, "prompt_tokens_details", "cached_tokens")
+    if cached is None:
+        cached = _usage_value(usage, "prompt_cache_hit_tokens")
+    if isinstance(cached, (int, float)):
+        counts["cached_prompt_tokens"] = cached
+        uncached = _usage_value(usage, "prompt_cache_miss_tokens")
+        if uncached is None and isinstance(counts["prompt_tokens"], (int, float)):
+            uncached = max(0, counts["prompt_tokens"] - cached)
+        counts["uncached_prompt_tokens"] = uncached
+    # OpenRouter 对显式 cache_control 标记的模型会返回写入缓存的 token 数
+    cache_write = _usage_value(usage, "prompt_tokens_details", "cache_write_tokens")
+    if cache_write is not None:
+        counts["cache_write_tokens"] = cache_write
+    reasoning = _usage_value(usage, "completion_tokens_details", "reasoning_tokens")
+    if reasoning is not None:
+        counts["reasoning_tokens"] = reasoning
+    return {name: int(value) for name, value in counts.items() if isinstance(value, (int, float))}
+
+
+class RunMetrics:
+    """一次节点执行（或批量中的一项）的阶段耗时与 token 统计"""
+
+    def __init__(self, node):
+        self.node = node
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.fields = {}
+        self.status = "ok"
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        if seconds is not None:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_usage(self, usage):
+        self.tokens.update(usage_counts(usage))
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def to_record(self):
+        record = {
+            "ts": round(self.started, 3),
+            "node": self.node,
+            "status": self.status,
+            "total_s": round(time.perf_counter() - self._start, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+        }
+        if self.tokens:
+            record["tokens"] = self.tokens
+        record.update(self.fields)
+        return record
+
+
+def prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class MetricsRecorder:
+    """
+    汇总各节点的运行指标：每次执行追加一行到滚动的 JSONL 文件（logs/metrics.jsonl），
+    并更新 Prometheus 文本格式的快照（logs/metrics.prom）。
+    节点结束时只在锁内更新计数；快照由后台线程每隔 PROMETHEUS_INTERVAL 秒在锁外重写，批量节点的线程不必排队等待写文件。
+    """
+
+    def __init__(self, metrics_file, prometheus_file):
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self._lock = threading.Lock()
+        self._settings = dict(DEFAULT_LOGGING_SETTINGS)
+        self._handler_key = None
+        self._file_logger = logging.getLogger(f"{_LOGGER_ROOT}_metrics_file")
+        self._file_logger.propagate = False
+        self._file_logger.setLevel(logging.INFO)
+        self._runs = {}      # (node, status) -> 次数
+        self._tokens = {}    # (node, kind) -> token 数
+        self._stages = {}    # (node, stage) -> [各桶计数, sum, count]
+        self._collectors = []  # 其他模块追加到 metrics.prom 的指标
+        self._dirty = False    # 计数在上次写入快照后有变化
+        self._flusher = None
+        self._flush_lock = threading.Lock()  # 只在写快照的线程之间互斥，避免旧的快照覆盖新的
+
+    @property
+    def settings(self):
+        return self._settings
+
+    def configure(self, config):
+        """按配置文件调整日志级别与指标文件，配置未变化时几乎没有开销"""
+        settings = resolve_logging_settings(config)
+        with self._lock:
+            self._settings = settings
+            _setup_root_logger().setLevel(settings["level"])
+            handler_key = (settings["metrics"], settings["metrics_max_mb"], settings["metrics_backups"], self.metrics_file)
+            if handler_key != self._handler_key:
+                for handler in list(self._file_logger.handlers):
+                    self._file_logger.removeHandler(handler)
+                    handler.close()
+                if settings["metrics"]:
+                    os.makedirs(os.path.dirname(self.metrics_file), exist_ok=True)
+                    handler = logging.handlers.RotatingFileHandler(
+                        self.metrics_file,
+                        maxBytes=int(settings["metrics_max_mb"] * 1024 * 1024),
+                        backupCount=max(0, settings["metrics_backups"]),
+                        encoding='utf-8',
+                        delay=True,
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    self._file_logger.addHandler(handler)
+                self._handler_key = handler_key
+        return settings
+
+    def add_collector(self, collector):
+        """collector() 返回 Prometheus 文本格式的指标，写入快照时附加在后面"""
+        self._collectors.append(collector)
+
+    def start(self, node):
+        return RunMetrics(node)
+
+    def finish(self, run, status=None):
+        if status is not None:
+            run.status = status
+        record = run.to_record()
+        with self._lock:
+            key = (run.node, run.status)
+            self._runs[key] = self._runs.get(key, 0) + 1
+            for kind, value in run.tokens.items():
+                key = (run.node, kind)
+                self._tokens[key] = self._tokens.get(key, 0) + value
+            for stage, seconds in run.stages.items():
+                entry = self._stages.setdefault((run.node, stage), [[0] * len(STAGE_BUCKETS), 0.0, 0])
+                for i, bound in enumerate(STAGE_BUCKETS):
+                    if seconds <= bound:
+                        entry[0][i] += 1
+                entry[1] += seconds
+                entry[2] += 1
+            write = self._settings["metrics"]
+            if write:
+                self._dirty = True
+                self._ensure_flusher()
+        if write:
+            # RotatingFileHandler 自带锁，多个线程同时结束时各自追加一行
+            try:
+                self._file_logger.info(json.dumps(record, ensure_ascii=False))
+            except Exception as e:
+                get_logger("LPF_Metrics").warning(f"写入指标文件失败: {e}")
+        get_logger("LPF_Metrics").debug(json.dumps(record, ensure_ascii=False))
+        return record
+
+    def _ensure_flusher(self):
+        # 调用方需持有锁
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name="LPF_Metrics_Flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(PROMETHEUS_INTERVAL)
+            with self._lock:
+                if not self._dirty:
+                    # 一段时间没有新的运行，线程退出，下次结束运行时再启动
+                    self._flusher = None
+                    return
+            self.flush()
+
+    def flush(self):
+        """把累计指标写入 metrics.prom；只在锁内复制计数，生成其余文本与写文件都在锁外"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                text = self.prometheus_text()
+                path = self.prometheus_file
+            try:
+                for collector in self._collectors:
+                    text += collector()
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                get_logger("LPF_Metrics").warning(f"写入指标文件失败: {e}")
+
+    def prometheus_text(self):
+        """Prometheus 文本格式的累计指标，不含 add_collector 登记的指标（调用方需持有锁）"""
+        lines = [
+            "# HELP lpf_runs_total Node executions by status.",
+            "# TYPE lpf_runs_total counter",
+        ]
+        for (node, status), count in sorted(self._runs.items()):
+            lines.append(f'lpf_runs_total{{node="{prometheus_label(node)}",status="{prometheus_label(status)}"}} {count}')
+        lines += [
+            "# HELP lpf_tokens_total Tokens reported by the API, by kind.",
+            "# TYPE lpf_tokens_total counter",
+        ]
+        for (node, kind), value in sorted(self._tokens.items()):
+            lines.append(f'lpf_tokens_total{{node="{prometheus_label(node)}",kind="{prometheus_label(kind)}"}} {value}')
+        lines += [
+            "# HELP lpf_stage_seconds Time spent in each stage.",
+            "# TYPE lpf_stage_seconds histogram",
+        ]
+        for (node, stage), (buckets, total, count) in sorted(self._stages.items()):
+            labels = f'node="{prometheus_label(node)}",stage="{prometheus_label(stage)}"'
+            for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+                lines.append(f'lpf_stage_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'lpf_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'lpf_stage_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'lpf_stage_seconds_count{{{labels}}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRecorder(METRICS_FILE, PROMETHEUS_FILE)
+# 退出前写入最后一次快照
+atexit.register(metrics.flush)
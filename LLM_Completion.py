@@ -0,0 +1,313 @@
+import time
+import socket
+import threading
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Completion")
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+IMG_OPEN = "<img>"
+IMG_CLOSE = "</img>"
+FENCE = "```"
+
+# 拒绝 stream_options 参数的接口（按 base_url 记录），之后的流式请求不再发送该参数
+_NO_STREAM_OPTIONS = set()
+
+
+def _message_reasoning(message):
+    """收集不同平台放在 reasoning / reasoning_content 字段中的思考内容"""
+    reasoning = []
+    for field in ("reasoning", "reasoning_content"):
+        value = getattr(message, field, None)
+        if value:
+            reasoning.append(value)
+    return reasoning
+
+
+class CompletionResult:
+    """一次补全请求的结果，流式与非流式共用，供后续解析"""
+
+    def __init__(self, content="", reasoning=None, think_blocks=None, usage=None, finish_reason=None,
+                 ttft=None, elapsed=None, chunks=0, stopped_early=False):
+        self.content = content or ""
+        self.reasoning = reasoning or []
+        self.think_blocks = think_blocks or []
+        self.usage = usage
+        self.finish_reason = finish_reason
+        self.ttft = ttft
+        self.elapsed = elapsed
+        self.chunks = chunks
+        self.stopped_early = stopped_early
+
+    @classmethod
+    def from_response(cls, response, elapsed=None):
+        choice = response.choices[0]
+        return cls(
+            content=choice.message.content,
+            reasoning=_message_reasoning(choice.message),
+            usage=response.usage,
+            finish_reason=choice.finish_reason,
+            elapsed=elapsed,
+        )
+
+    def tokens_per_second(self):
+        """生成速度；流式提前结束拿不到 usage 时按增量块数估算"""
+        if self.ttft is None or self.elapsed is None:
+            return None
+        generation_time = self.elapsed - self.ttft
+        if generation_time <= 0:
+            return None
+        tokens = self.usage.completion_tokens if self.usage is not None else self.chunks
+        return tokens / generation_time
+
+
+class StreamingResponseParser:
+    """
+    增量解析流式输出：
+    将 <think> 块与正文分离，并在出现完整的 <img>...</img> 后标记文档完成。
+    标签可能被拆在两个增量块之间，因此保留一小段未确定的尾部。
+    """
+
+    def __init__(self):
+        self._visible = []
+        self._think = []
+        self._current_think = None
+        self._pending = ""
+        self._search_text = ""
+        self._img_open_at = -1
+        self._fence_open = False
+        self.reasoning = []
+        self.document_complete = False
+
+    def feed_reasoning(self, text):
+        if text:
+            if not self.reasoning:
+                self.reasoning.append("")
+            self.reasoning[-1] += text
+
+    def feed(self, text):
+        if not text:
+            return
+        data = self._pending + text
+        self._pending = ""
+        while data:
+            tag = THINK_CLOSE if self._current_think is not None else THINK_OPEN
+            idx = data.find(tag)
+            if idx == -1:
+                # 末尾可能是半个标签，留到下一块再判断
+                keep = 0
+                for n in range(min(len(tag) - 1, len(data)), 0, -1):
+                    if tag.startswith(data[-n:]):
+                        keep = n
+                        break
+                self._emit(data[:len(data) - keep])
+                self._pending = data[len(data) - keep:]
+                return
+            self._emit(data[:idx])
+            if self._current_think is None:
+                self._current_think = []
+            else:
+                self._think.append("".join(self._current_think))
+                self._current_think = None
+            data = data[idx + len(tag):]
+
+    def _emit(self, text):
+        if not text:
+            return
+        if self._current_think is not None:
+            self._current_think.append(text)
+            return
+        self._visible.append(text)
+        if self.document_complete:
+            return
+        # 只在新到达的文本附近查找，避免每块都扫描全文
+        start = max(0, len(self._search_text) - len(IMG_CLOSE))
+        self._search_text += text
+        if self._img_open_at == -1:
+            self._img_open_at = self._search_text.find(IMG_OPEN, max(0, start - len(IMG_OPEN)))
+            if self._img_open_at == -1:
+                return
+            self._fence_open = self._search_text.count(FENCE, 0, self._img_open_at) % 2 == 1
+            start = self._img_open_at
+        close_at = self._search_text.find(IMG_CLOSE, start)
+        if close_at != -1:
+            self.document_complete = True
+
+    @property
+    def think_blocks(self):
+        blocks = list(self._think)
+        if self._current_think:
+            blocks.append("".join(self._current_think))
+        return blocks
+
+    def content(self, stopped_early=False):
+        text = "".join(self._visible)
+        if self._current_think is None:
+            text += self._pending
+        if stopped_early and self._fence_open:
+            # 提前截断时补上代码块结尾，保持与完整回复相同的解析路径
+            end = text.rfind(IMG_CLOSE) + len(IMG_CLOSE)
+            text = text[:end] + "\n" + FENCE
+        return text
+
+
+class CancelEvent(threading.Event):
+    """
+    可中途取消的请求标记。set() 时调用登记的回调，关闭仍在等待数据的连接：
+    只在增量块之间检查标记的话，落败的请求要等对方接口返回下一块才会停止，期间一直占用线程与连接。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """登记取消时调用的回调；已经取消时立即调用"""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def discard_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"关闭已取消的请求时出错: {e}")
+
+
+def _abort_stream(stream):
+    """
+    从另一个线程中断正在读取的流。HTTP/1.1 连接只属于这一个请求，直接 shutdown 套接字，阻塞中的读取会立即出错返回；
+    HTTP/2 连接由多个请求共用，不能关闭，只能等到下一块到达时再结束。
+    """
+    response = getattr(stream, "response", None)
+    if response is None or response.http_version != "HTTP/1.1":
+        return
+    network_stream = response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        # 绕过 SSLSocket.shutdown，不改动正在读取的线程所用的 TLS 状态
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+
+
+def _open_stream(client, request_kwargs):
+    """
+    发起流式请求。默认附带 stream_options 以在最后一块中取得 usage；
+    部分 OpenAI 兼容接口不认识该参数并返回 400 / 422，此时去掉它重试一次，并记住该接口。
+    """
+    endpoint = str(client.base_url)
+    if endpoint in _NO_STREAM_OPTIONS:
+        return client.chat.completions.create(stream=True, **request_kwargs)
+    try:
+        return client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **request_kwargs,
+        )
+    except Exception as e:
+        if getattr(e, "status_code", None) not in (400, 422):
+            raise
+        try:
+            stream = client.chat.completions.create(stream=True, **request_kwargs)
+        except Exception:
+            # 去掉参数后仍然失败：原因不在 stream_options，报告原来的错误
+            raise e
+        _NO_STREAM_OPTIONS.add(endpoint)
+        logger.info(f"{endpoint} 不支持 stream_options，之后的流式请求不再发送（用量按增量块数估算）。")
+        return stream
+
+
+def stream_completion(client, request_kwargs, stop_at_img_close=True, cancel_event=None, on_first_token=None):
+    """
+    以流式方式请求补全，边接收边解析。
+    stop_at_img_close 为真时，收到完整的 <img> 文档后立即关闭连接，不再为后续文字付费。
+    cancel_event（CancelEvent）被设置时立即关闭连接并返回已收到的部分。
+    """
+    parser = StreamingResponseParser()
+    usage = None
+    finish_reason = None
+    ttft = None
+    chunks = 0
+    stopped_early = False
+
+    start = time.perf_counter()
+    stream = _open_stream(client, request_kwargs)
+    closed = False
+    close_lock = threading.Lock()
+
+    def abort():
+        with close_lock:
+            # 连接归还连接池之后不能再关闭，否则会中断复用这条连接的其他请求
+            if not closed:
+                _abort_stream(stream)
+
+    if cancel_event is not None:
+        cancel_event.add_callback(abort)
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+            if delta is None:
+                continue
+
+            reasoning_parts = _message_reasoning(delta)
+            content = delta.content
+            if not reasoning_parts and not content:
+                continue
+
+            chunks += 1
+            if ttft is None:
+                ttft = time.perf_counter() - start
+                if on_first_token is not None:
+                    on_first_token()
+            for part in reasoning_parts:
+                parser.feed_reasoning(part)
+            parser.feed(content)
+
+            if stop_at_img_close and parser.document_complete:
+                stopped_early = True
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                break
+    except Exception:
+        # 被取消时连接已被关闭，读取出错是预期的结果
+        if cancel_event is None or not cancel_event.is_set():
+            raise
+    finally:
+        if cancel_event is not None:
+            cancel_event.discard_callback(abort)
+        with close_lock:
+            closed = True
+        stream.close()
+
+    return CompletionResult(
+        content=parser.content(stopped_early=stopped_early),
+        reasoning=parser.reasoning,
+        think_blocks=parser.think_blocks,
+        usage=usage,
+        finish_reason=finish_reason,
+        ttft=ttft,
+        elapsed=time.perf_counter() - start,
+        chunks=chunks,
+        stopped_early=stopped_early,
+    )
@@ -1,32 +1,81 @@
-import io
-import os
-import re
-import json
-import base64
-import difflib
-from openai import OpenAI
-from lxml import etree
-import numpy as np
-from PIL import Image
+import time
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from .Config_Store import config_store, KEY_PLACEHOLDERS, URL_PLACEHOLDERS
+from .Client_Pool import client_pool, resolve_http_settings
+from .Response_Cache import response_cache, resolve_cache_settings, make_cache_key
+from .LLM_Completion import CompletionResult, stream_completion
+from .Request_Scheduler import request_scheduler, resolve_scheduler_settings, estimate_tokens
+from .Endpoint_Router import endpoint_router, resolve_failover_settings, resolve_endpoints, Endpoint, RequestCancelled
+from .Tag_Formatter import resolve_tag_formatter_settings, format_tags, load_tag_index
+from .Tag_Dictionary import tag_dictionaries, resolve_tag_validation_settings, validate_document
+from .Prompt_History import prompt_history, resolve_history_settings, patch_document
+from .Structured_Output import resolve_structured_output_settings, output_format, format_instructions, response_format, parse_json, json_to_xml
+from .Continuation import resolve_continuation_settings, truncation_reason, supports_prefill, continuation_messages, stitch, CombinedUsage, tokens_saved
+from .Prompt_Cache import resolve_prompt_cache_settings, prefix_digest, uses_cache_control, uses_cache_key, build_messages
+from .Prefetch import prefetcher, resolve_prefetch_settings
+from .Xml_Document import LPFXmlDocument, LPF_XML_TYPE, IMG_PATTERN
+from .Response_Parser import scan_response, parse_document
+from .Instrumentation import get_logger, metrics, preview, usage_counts
+
+logger = get_logger("LLM_Prompt_Formatter")
+
+
+def load_config(run=None):
+    """读取配置快照并应用其中的日志设置；run 不为空时记录读取耗时"""
+    start = time.perf_counter()
+    config = config_store.snapshot()
+    metrics.configure(config.data)
+    if run is not None:
+        run.add_stage("config_load", time.perf_counter() - start)
+    return config
 
 
-class BColors:
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m' # Reset all attributes
+def load_api_config():
+    """
+    兼容旧版本的接口（其他插件与脚本仍在导入）：返回 LPF_config.json 的内容。
+    读取共享的配置缓存，返回副本，调用方可以修改。
+    """
+    return dict(config_store.get())
 
-CONFIG_FILENAME = "LPF_config.json"
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILENAME)
 
+def resolve_stream_settings(config):
+    """流式输出设置：stop_at_img_close 为真时，收到 </img> 后立即结束请求"""
+    settings = {"stop_at_img_close": True}
+    user_settings = config.get("streaming", {})
+    if isinstance(user_settings, dict):
+        settings["stop_at_img_close"] = bool(user_settings.get("stop_at_img_close", True))
+    return settings
 
-def load_api_config():
-    if os.path.exists(CONFIG_PATH):
+
+def resolve_batch_settings(config):
+    """批量请求的最大并发数"""
+    max_workers = 4
+    user_settings = config.get("batch", {})
+    if isinstance(user_settings, dict):
         try:
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            max_workers = int(user_settings.get("max_workers", max_workers))
+        except (TypeError, ValueError):
+            logger.warning(f"batch.max_workers 配置无效，已使用默认值 {max_workers}。")
+    return {"max_workers": max(1, max_workers)}
+
+
+def run_concurrently(fn, items, max_workers):
+    """
+    在有界线程池中并发执行 fn(item)，按输入顺序返回 [(成功与否, 结果或异常), ...]。
+    单个条目失败不影响其他条目。
+    """
+    def guarded(item):
+        try:
+            return True, fn(item)
         except Exception as e:
-            print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: Error loading {CONFIG_FILENAME}: {e} {BColors.ENDC}")
-    return {}
+            return False, e
+
+    if len(items) <= 1 or max_workers <= 1:
+        return [guarded(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="LPF_Batch") as executor:
+        return list(executor.map(guarded, items))
 
 
 class LLM_Prompt_Formatter:
@@ -35,10 +84,14 @@ class LLM_Prompt_Formatter:
 
     @classmethod
     def INPUT_TYPES(s):
-        config = load_api_config()
-        model_list = config.get("model_list", [])
-        api_key = config.get("api_key")
-        api_url = config.get("api_url")
+        # ComfyUI 每次加载节点列表、校验工作流都会调用；配置文件不变时直接返回预先构造的结果
+        return config_store.snapshot().derived(f"{s.__name__}.INPUT_TYPES", s.build_input_types)
+
+    @classmethod
+    def build_input_types(s, config):
+        model_list = config.model_list
+        api_key = config.api_key
+        api_url = config.api_url
         default_api_key = "sk-..."
         default_api_url = "https://xxx.ai/api/v1"
         default_user_text="1girl, holding a sword"
@@ -64,8 +117,8 @@ class LLM_Prompt_Formatter:
 
         if not AllReadSuccess:
             default_user_text = "1girl, holding a sword\n[警告]：读取API失败，请检查配置文件。你可以在节点输入相关信息。请注意，你的API会在原图中保存，分享原图可能会导致API泄露。强烈建议使用配置文件，完成配置后按F5刷新页面并重新创建此节点。"
-            print(
-                f"{BColors.WARNING}[LLM_Prompt_Formatter]: 读取API失败，请检查配置文件。你可以在节点输入相关信息。请注意，你的API会在原图中保存，分享原图可能会导致API泄露。强烈建议使用配置文件，完成配置后按F5刷新页面并重新创建此节点。{BColors.ENDC}")
+            logger.warning(
+                f"读取API失败，请检查配置文件。你可以在节点输入相关信息。请注意，你的API会在原图中保存，分享原图可能会导致API泄露。强烈建议使用配置文件，完成配置后按F5刷新页面并重新创建此节点。")
 
         return {
             "required": {
@@ -78,27 +131,30 @@ class LLM_Prompt_Formatter:
             },
             "optional": {
                 "image": ("IMAGE",),
+                "bypass_cache": ("BOOLEAN", {"default": False, "label_on": "Force Refresh", "label_off": "Use Cache"}),
+                "stream": ("BOOLEAN", {"default": False, "label_on": "Stream", "label_off": "Blocking"}),
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING")
-    RETURN_NAMES = ("xml_out", "text_out")
+    RETURN_TYPES = ("STRING", "STRING", LPF_XML_TYPE)
+    RETURN_NAMES = ("xml_out", "text_out", "xml_doc")
     OUTPUT_NODE = True
     FUNCTION = "process_text"
     CATEGORY = "NewBie LLM Formatter"
 
-    def tensor_to_base64(self, image_tensor):
+    def tensor_to_base64(self, image_tensor, index=0):
         """将 ComfyUI 的张量图片转换为 Base64 编码"""
-        # image_tensor shape is [B, H, W, C]
-        i = 255. * image_tensor[0].cpu().numpy()
-        img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+        return self.encode_image(image_tensor, index)[0]
 
-        buffered = io.BytesIO()
-        img.save(buffered, format="JPEG", quality=90)
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    def encode_image(self, image_tensor, index=0, digest=None):
+        """按 image_encoding 配置编码批次中的第 index 张图片，返回 (base64, MIME 类型)"""
+        # image_tensor shape is [B, H, W, C]
+        from .Image_Encoder import image_encoder, resolve_image_settings
+        settings = resolve_image_settings(config_store.get())
+        return image_encoder.encode(image_tensor, index, settings, digest)
 
-    def get_platform_settings(self, api_url, model_name, thinking):
-        """统一处理不同平台的参数构造"""
+    def get_platform_settings(self, api_url, model_name, thinking, verbose=True, prompt_cache_key=None):
+        """统一处理不同平台的参数构造；prompt_cache_key 不为空时一并发送（仅 OpenAI 官方接口）"""
         extra_body = {}
 
         if 'openrouter' in api_url:
@@ -114,7 +170,8 @@ class LLM_Prompt_Formatter:
                 extra_body = {}
             else:
                 if '3' in model_name or '2.5-pro' in model_name:
-                    print(f"{BColors.WARNING}[LLM_Prompt_Formatter]: googleapis平台的{model_name}模型无法彻底关闭思考功能。已将思考模式设置为low。{BColors.ENDC}")
+                    if verbose:
+                        logger.warning(f"googleapis平台的{model_name}模型无法彻底关闭思考功能。已将思考模式设置为low。")
                     extra_body = {"reasoning_effort": "low"}
                 else:
                     extra_body = {"reasoning_effort":"none"}
@@ -123,150 +180,755 @@ class LLM_Prompt_Formatter:
                 extra_body = {"thinking": {"type": "enabled"}}
             else:
                 extra_body = {"thinking": {"type": "disabled"}}
-        else:
-            print(f"{BColors.WARNING}[LLM_Prompt_Formatter]: 思考模式开关暂不支持您使用的API平台。{BColors.ENDC}")
+        elif verbose:
+            logger.warning("思考模式开关暂不支持您使用的API平台。")
+        if prompt_cache_key:
+            extra_body = dict(extra_body, prompt_cache_key=prompt_cache_key)
         return extra_body
 
-    def process_text(self, api_key, api_url, model_name, user_text,thinking,image=None):
-        # 加载配置（优先从 JSON 取，UI 次之）
-
-        config = load_api_config()
-        config_key = config.get("api_key")
-        config_url = config.get("api_url")
-        key_placeholders = ["sk-...", "读取API失败，请在此填写api key", "","已从配置文件中读取api key，在此填写将不生效",None]
-        url_placeholders = ["https://xxx.ai/api/v1","读取API失败，请在此填写api url","","已从配置文件中读取api url，在此填写将不生效",None]
+    def resolve_credentials(self, config, api_key, api_url):
+        """加载 API KEY 与 URL（优先从 JSON 取，UI 次之）"""
+        key_placeholders = KEY_PLACEHOLDERS
+        url_placeholders = URL_PLACEHOLDERS
 
-        if config_key and config_key not in key_placeholders:
-            final_key = config_key
-            final_key = final_key.replace(" ", "")
-            print(f"[LLM_Prompt_Formatter]: 已从配置文件中读取API KEY.")
+        if config.api_key:
+            final_key = config.api_key
+            logger.info("已从配置文件中读取API KEY.")
         else:
             if api_key and api_key not in key_placeholders:
                 final_key = api_key
                 final_key = final_key.replace(" ", "")
-                print(f"{BColors.WARNING}[LLM_Prompt_Formatter]: 已从UI输入中读取API KEY.{BColors.ENDC}")
+                logger.warning("已从UI输入中读取API KEY.")
             else:
-                print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: 配置文件和UI输入中均无有效API KEY.{BColors.ENDC}")
+                logger.error("配置文件和UI输入中均无有效API KEY.")
                 raise RuntimeError(f"LLM_Prompt_Formatter failed: API KEY 缺失！请在 LPF_config.json 中配置")
 
-        if config_url and config_url not in url_placeholders:
-            final_url = config_url
-            final_url = final_url.replace(" ", "")
-            print(f"[LLM_Prompt_Formatter]: 已从配置文件中读取API URL: {final_url}.")
+        if config.api_url:
+            final_url = config.api_url
+            logger.info(f"已从配置文件中读取API URL: {final_url}.")
         else:
             if api_url and api_url not in url_placeholders:
                 final_url = api_url
                 final_url = final_url.replace(" ", "")
-                print(f"[LLM_Prompt_Formatter]: 已从UI输入中读取API URL: {final_url}.")
+                logger.info(f"已从UI输入中读取API URL: {final_url}.")
             else:
-                print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: 配置文件和UI输入中均无有效API URL.{BColors.ENDC}")
+                logger.error("配置文件和UI输入中均无有效API URL.")
                 raise RuntimeError(f"LLM_Prompt_Formatter failed: API URL 缺失！请在 LPF_config.json 中配置")
 
-        system_content = config.get("system_prompt", "You are a helpful assistant that provides prompt tags.")
-        jailbreaker = config.get("gemini_jailbreaker","")
-        gemma_prompt = config.get("gemma_prompt", "You are an assistant designed to generate high-quality anime images with the highest degree of image-text alignment based on xml format textual prompts. <Prompt Start>\n")
+        return final_key, final_url
+
+    def build_system_content(self, config, api_url, model_name, verbose=True):
+        system_content = config.system_prompt
+        jailbreaker = config.jailbreaker
 
         if (not 'googleapis' in api_url) and ('gemini' in model_name.lower()):
-            print(f"[LLM_Prompt_Formatter]: 已启用Gemini强力破甲。")
+            if verbose:
+                logger.info("已启用Gemini强力破甲。")
             system_content = f"{jailbreaker}{system_content}"
+        return system_content
+
+    def compute_cache_key(self, config, api_url, model_name, user_text, thinking, image=None, index=0, digest=None):
+        """与 IS_CHANGED 共用的内容寻址键"""
+        final_url = config.api_url or (api_url or "").replace(" ", "")
+        system_content = self.build_system_content(config, api_url or "", model_name, verbose=False)
+        extra_body = self.get_platform_settings(final_url, model_name, thinking, verbose=False)
+        structured = output_format(final_url, model_name, resolve_structured_output_settings(config.data))
+        if structured:
+            # 结构化输出会改变 system prompt 与请求参数，与 XML 模式的结果分开缓存
+            extra_body = dict(extra_body, structured_output=structured)
+        image_key = None
+        if image is not None:
+            # 图片相关模块依赖 numpy / PIL，只在有图片输入时加载
+            from .Image_Encoder import image_digest, resolve_image_settings
+            # 缩放与压缩参数会改变模型看到的图片，一并计入
+            if digest is None:
+                digest = image_digest(image, index)
+            image_settings = resolve_image_settings(config.data)
+            image_key = f"{digest}:{image_settings['max_long_side']}:{image_settings['format']}:{image_settings['quality']}"
+        return make_cache_key(model_name, system_content, user_text, image_key, thinking, config.temperature, extra_body, config.gemma_prompt)
 
+    @classmethod
+    def IS_CHANGED(s, api_key, api_url, model_name, user_text, thinking, image=None, bypass_cache=False, stream=False):
+        # 强制刷新时返回 NaN（NaN != NaN），ComfyUI 每次都会重新执行
+        if bypass_cache:
+            return float("NaN")
+        config = config_store.snapshot()
+        return s().compute_cache_key(config, api_url, model_name, user_text, thinking, image)
+
+    def process_text(self, api_key, api_url, model_name, user_text,thinking,image=None,bypass_cache=False,stream=False):
+        run = metrics.start("LLM_Prompt_Formatter")
+        config = load_config(run)
+        if image is None and not bypass_cache and resolve_prefetch_settings(config.data)["enabled"]:
+            prefetched = self.await_prefetch(config, api_url, model_name, user_text, thinking, run)
+            if prefetched is not None:
+                return prefetched
+        final_key, final_url = self.resolve_credentials(config, api_key, api_url)
+        return self.format_one(config, final_key, final_url, api_url, model_name, user_text, thinking,
+                               image=image, bypass_cache=bypass_cache, stream=stream, run=run)
+
+    def await_prefetch(self, config, api_url, model_name, user_text, thinking, run):
+        """取入队时预取的结果（键与响应缓存相同）；请求仍在进行时等待它完成"""
+        key = self.compute_cache_key(config, api_url, model_name, user_text, thinking)
+        with run.stage("prefetch_wait"):
+            result = prefetcher.take(key)
+        if result is None:
+            return None
+        logger.info("使用入队时预取的结果。")
+        run.set(model=model_name)
+        metrics.finish(run, "prefetch_hit")
+        return result
+
+    def prefetch(self, config, api_key, api_url, model_name, user_text, thinking, stream):
+        """在后台执行一次与节点相同的请求（含缓存查询），结果由 await_prefetch 取走"""
+        run = metrics.start("LLM_Prompt_Formatter")
+        run.set(prefetch=True)
+        final_key, final_url = self.resolve_credentials(config, api_key, api_url)
+        return self.format_one(config, final_key, final_url, api_url, model_name, user_text, thinking,
+                               stream=stream, verbose=False, run=run, priority=1)
+
+    def format_one(self, config, final_key, final_url, api_url, model_name, user_text, thinking,
+                   image=None, index=0, bypass_cache=False, stream=False, verbose=True, run=None, priority=0):
+        """
+        完成一次格式化请求（含缓存查询），返回 (xml_out, text_out, xml_doc)；各阶段耗时记录在 run 中。
+        请求经由共享的调度器发出，priority 越小越先执行（单个节点为 0，批量与扇出的条目为 1）。
+        """
+        if run is None:
+            run = metrics.start("LLM_Prompt_Formatter")
+        run.set(model=model_name, stream=bool(stream), image=image is not None)
+
+        if image is None:
+            local = self.format_locally(config, user_text, run)
+            if local is not None:
+                return local
+
+        with run.stage("request_build"):
+            system_content = self.build_system_content(config, api_url, model_name, verbose=verbose)
+        gemma_prompt = config.gemma_prompt
+        stop_at_img_close = resolve_stream_settings(config.data)["stop_at_img_close"]
+
+        digest = None
+        if image is not None:
+            from .Image_Encoder import image_digest
+            with run.stage("image_hash"):
+                digest = image_digest(image, index)
+
+        cache_settings = resolve_cache_settings(config.data)
+        cache_key = None
+        if cache_settings["enabled"]:
+            with run.stage("cache_lookup"):
+                cache_key = self.compute_cache_key(config, api_url, model_name, user_text, thinking, image, index, digest)
+                cached = None if bypass_cache else response_cache.get(cache_key, cache_settings)
+            if bypass_cache:
+                logger.info("已跳过响应缓存，强制重新请求。")
+            else:
+                if cached is not None:
+                    logger.info(f"命中响应缓存，跳过 API 请求。缓存统计：{response_cache.stats_text()}")
+                    xml_doc = self.validate_tags(config, LPFXmlDocument.from_string(cached[0]), run)
+                    metrics.finish(run, "cache_hit")
+                    return (xml_doc.to_string(), cached[1], xml_doc)
+                logger.info(f"未命中响应缓存。缓存统计：{response_cache.stats_text()}")
+
+        history_settings = resolve_history_settings(config.data)
+        history_scope = None
+        if history_settings["enabled"]:
+            # 除输入文本外的全部条件（模型、system prompt、图片、思考开关等）相同的结果才可复用
+            history_scope = self.compute_cache_key(config, api_url, model_name, "", thinking, image, index, digest)
+            if not bypass_cache:
+                reused = self.reuse_history(config, history_scope, user_text, history_settings, run)
+                if reused is not None:
+                    return reused
 
         # 调用 OpenAI
         try:
             if not final_key or final_key == "sk-...":
-                print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: API KEY 缺失！请在 LPF_config.json 中配置。{BColors.ENDC}")
+                logger.error("API KEY 缺失！请在 LPF_config.json 中配置。")
                 raise RuntimeError(f"LLM_Prompt_Formatter failed: API KEY 缺失！请在 LPF_config.json 中配置")
 
-            client = OpenAI(api_key=final_key, base_url=final_url)
+            http_settings = resolve_http_settings(config.data)
+            scheduler_settings = resolve_scheduler_settings(config.data)
+            if scheduler_settings["enabled"]:
+                # 重试由调度器统一处理（可感知 Retry-After 并暂停整个平台），SDK 不再自行重试
+                http_settings["max_retries"] = 0
 
             messages_content = [{"type": "text", "text": user_text}]
 
             if image is not None:
-                print(f"[LLM_Prompt_Formatter]: 检测到图片输入，正在转换...")
-                base64_image = self.tensor_to_base64(image)
+                logger.info("检测到图片输入，正在转换...")
+                with run.stage("image_encode"):
+                    base64_image, mime_type = self.encode_image(image, index, digest)
                 messages_content.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                    "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}
                 })
 
-            extra_body = self.get_platform_settings(final_url,model_name,thinking)
+            # 主接口之后是 failover.endpoints 中的备用接口（可为其他平台或模型）
+            failover = resolve_failover_settings(config.data)
+            endpoints = resolve_endpoints(Endpoint(final_key, final_url, model_name), failover)
+            hedge = failover["hedge"] and len(endpoints) > 1
+            requests = {}
+            with run.stage("request_build"):
+                for i, endpoint in enumerate(endpoints):
+                    if i == 0:
+                        endpoint_system = system_content
+                    else:
+                        endpoint_system = self.build_system_content(config, endpoint.api_url, endpoint.model_name, verbose=False)
+                    requests[endpoint] = self.build_request(config, endpoint, endpoint_system, messages_content, thinking,
+                                                            verbose=verbose and i == 0, run=run if i == 0 else None)
+
+            def attempt(endpoint, cancel_event, on_first_token):
+                request_kwargs = requests[endpoint]
+
+                def send():
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RequestCancelled(f"{endpoint.label} 的请求已被对冲请求取代")
+                    # 复用连接池中的客户端，连续运行时不必重新握手
+                    with client_pool.client(endpoint.api_key, endpoint.api_url, http_settings) as client:
+                        # 对冲需要知道何时收到首 token 并能中途取消，因此总是以流式方式请求
+                        if stream or hedge:
+                            return stream_completion(client, request_kwargs, stop_at_img_close=stream and stop_at_img_close,
+                                                     cancel_event=cancel_event, on_first_token=on_first_token)
+                        start_time = time.perf_counter()
+                        response = client.chat.completions.create(**request_kwargs)
+                        return CompletionResult.from_response(response, elapsed=time.perf_counter() - start_time)
+
+                return request_scheduler.submit(
+                    endpoint.api_url, send, scheduler_settings,
+                    estimated_tokens=estimate_tokens(request_kwargs["messages"], scheduler_settings["output_tokens"]),
+                    priority=priority, run=run,
+                    actual_tokens=lambda result: usage_counts(result.usage).get("total_tokens"),
+                )
+
+            winner, result = endpoint_router.call(endpoints, attempt, failover, run=run)
+            run.set(endpoint=winner.label)
+            if winner is not endpoints[0]:
+                logger.warning(f"本次结果来自备用接口 {winner.label}。")
+
+            structured = output_format(winner.api_url, winner.model_name, resolve_structured_output_settings(config.data))
+            result = self.continue_truncated(config, winner, requests[winner], result, http_settings,
+                                             scheduler_settings, priority, run, structured)
+
+            run.add_stage("network", result.elapsed)
+            run.add_stage("ttft", result.ttft)
+            run.record_usage(result.usage)
+            run.set(finish_reason=result.finish_reason, stopped_early=result.stopped_early)
+            self.report_usage(result)
+            with run.stage("parse"):
+                if structured:
+                    xml_content, text_content, xml_doc = self.parse_structured_completion(result, thinking, gemma_prompt)
+                else:
+                    xml_content, text_content, xml_doc = self.parse_completion(result, thinking, gemma_prompt)
+            if cache_key is not None:
+                # 缓存模型的原始结果，标签校验每次按当前配置进行
+                with run.stage("cache_write"):
+                    response_cache.put(cache_key, (xml_content, text_content), cache_settings)
+            if history_scope is not None:
+                with run.stage("history_write"):
+                    try:
+                        prompt_history.put(history_scope, user_text, (xml_content, text_content), history_settings)
+                    except Exception as e:
+                        logger.warning(f"写入提示词历史失败: {e}")
+            xml_doc = self.validate_tags(config, xml_doc, run)
+            metrics.finish(run)
+            return (xml_doc.to_string(), text_content, xml_doc)
 
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": messages_content}
-                ],
-                temperature=0.7,
-                extra_body=extra_body,
-            )
+        except Exception as e:
+            logger.error(f"{str(e)}, 请确认 API 配置是否正确。")
+            run.set(error=str(e))
+            metrics.finish(run, "error")
+            raise RuntimeError(f"LLM_Prompt_Formatter failed: {str(e)}") from e
 
-            usage = response.usage
+    def format_locally(self, config, user_text, run):
+        """
+        tag_formatter 开启且输入为纯标签时，按词表在本地整理出 XML，不调用 LLM。
+        返回 (xml_out, text_out, xml_doc)；输入不适合本地处理时返回 None，由 LLM 处理。
+        """
+        settings = resolve_tag_formatter_settings(config.data)
+        if not settings["enabled"]:
+            return None
+        with run.stage("local_format"):
+            result = format_tags(user_text, settings)
+            if result.xml is not None:
+                xml_doc = clean_prompt_document(result.xml, config.gemma_prompt, xml_part=result.xml)
+        if result.xml is None:
+            logger.info(f"输入不适合本地整理（{result.reason}），交由 LLM 处理。")
+            return None
+        logger.info("输入为纯标签，已在本地完成整理，未调用 LLM。")
+        metrics.finish(run, "local")
+        return (xml_doc.to_string(), "", xml_doc)
+
+    def reuse_history(self, config, scope, user_text, settings, run):
+        """
+        prompt_history 开启时查找标签集合相似的历史结果：标签完全相同（仅顺序、大小写、空白不同）时直接复用，
+        否则在本地把标签差异应用到历史结果上（reuse 模式下原样复用）。返回 (xml_out, text_out, xml_doc)，没有可用结果时返回 None。
+        """
+        with run.stage("history_lookup"):
+            try:
+                match = prompt_history.lookup(scope, user_text, settings)
+            except Exception as e:
+                logger.warning(f"提示词历史不可用，已跳过: {e}")
+                return None
+        if match is None:
+            logger.info(f"提示词历史中没有相似的记录。统计：{prompt_history.stats_text()}")
+            return None
+        if match.changes > settings["max_changes"]:
+            logger.info(f"最相似的历史记录（相似度 {match.similarity:.2f}）有 {match.changes} 处标签改动，"
+                        f"超过 max_changes {settings['max_changes']}，交由 LLM 处理。")
+            return None
+
+        xml_doc = LPFXmlDocument.from_string(match.xml_out)
+        if match.changes and settings["mode"] == "patch":
+            with run.stage("history_patch"):
+                index = load_tag_index(resolve_tag_formatter_settings(config.data))
+                patched, reason = patch_document(xml_doc, match, index)
+            if patched is None:
+                logger.info(f"无法在本地应用与历史记录的标签差异（{reason}），交由 LLM 处理。")
+                return None
+            xml_doc = patched
+            changes = [f"+{tag}" for tag in sorted(match.added)] + [f"-{tag}" for tag in sorted(match.removed)]
+            logger.info(f"命中相似的历史记录（相似度 {match.similarity:.2f}），已在本地应用标签改动：{', '.join(changes)}。"
+                        f"caption 与翻译沿用历史结果。")
+        elif match.changes:
+            logger.info(f"命中相似的历史记录（相似度 {match.similarity:.2f}），已原样复用（reuse 模式）。")
+        else:
+            logger.info("命中标签完全相同的历史记录，跳过 API 请求。")
+
+        xml_doc = self.validate_tags(config, xml_doc, run)
+        run.set(history_similarity=round(match.similarity, 3), history_changes=match.changes)
+        metrics.finish(run, "history_hit")
+        return (xml_doc.to_string(), match.text_out, xml_doc)
+
+    def validate_tags(self, config, xml_doc, run):
+        """tag_validation 开启时按标签词典检查 <img> 中的标签，修正拼写错误或列出未收录的标签"""
+        settings = resolve_tag_validation_settings(config.data)
+        if not settings["enabled"]:
+            return xml_doc
+        with run.stage("tag_validation"):
+            try:
+                # 索引在首次校验时才打开（词表变化后重新构建），不影响插件加载
+                dictionary = tag_dictionaries.get(settings)
+            except Exception as e:
+                logger.warning(f"标签词典不可用，已跳过标签校验: {e}")
+                return xml_doc
+            xml_doc, corrections, unknown = validate_document(xml_doc, dictionary, settings)
+        run.set(tag_corrections=len(corrections), unknown_tags=len(unknown))
+        if corrections:
+            pairs = ", ".join(f"{old} → {new}" for old, new in corrections)
+            if settings["mode"] == "correct":
+                logger.warning(f"已修正 {len(corrections)} 个标签：{pairs}")
+            else:
+                logger.warning(f"{len(corrections)} 个标签可能有误（未修改）：{pairs}")
+        if unknown:
+            logger.warning(f"词典中没有这些标签，请检查：{', '.join(unknown)}")
+        return xml_doc
+
+    def build_request(self, config, endpoint, system_content, messages_content, thinking, verbose=True, run=None):
+        """构造发往某个接口的请求参数；run 不为空时记录提示词缓存信息"""
+        # system prompt 是每次都相同的长前缀：保持逐字节一致，并按平台添加缓存标记
+        prompt_cache = resolve_prompt_cache_settings(config.data)
+        structured_settings = resolve_structured_output_settings(config.data)
+        structured = output_format(endpoint.api_url, endpoint.model_name, structured_settings)
+        if structured:
+            system_content += format_instructions(structured)
+        prefix = prefix_digest(system_content)
+        cache_control = uses_cache_control(endpoint.api_url, endpoint.model_name, prompt_cache)
+        prompt_cache_key = f"lpf-{prefix}" if uses_cache_key(endpoint.api_url, prompt_cache) else None
+        extra_body = self.get_platform_settings(endpoint.api_url, endpoint.model_name, thinking, verbose=verbose,
+                                                prompt_cache_key=prompt_cache_key)
+        messages = build_messages(system_content, messages_content, cache_control, prompt_cache["ttl"])
+        if run is not None:
+            run.set(prompt_prefix=prefix,
+                    prompt_cache="cache_control" if cache_control else "cache_key" if prompt_cache_key else "implicit")
+        if cache_control and verbose:
+            logger.info("已为 system prompt 添加提示词缓存标记（cache_control）。")
+        request_kwargs = dict(
+            model=endpoint.model_name,
+            messages=messages,
+            temperature=config.temperature,
+            extra_body=extra_body,
+        )
+        if structured:
+            request_kwargs["response_format"] = response_format(structured, structured_settings)
+            if run is not None:
+                run.set(structured_output=structured)
+            if verbose:
+                logger.info(f"已启用结构化输出（{structured}），由插件在本地生成 XML。")
+        elif structured_settings["enabled"] and verbose:
+            logger.warning(f"{endpoint.label} 不支持结构化输出，仍使用 XML 格式。")
+        return request_kwargs
+
+    def continue_truncated(self, config, endpoint, request_kwargs, result, http_settings, scheduler_settings,
+                           priority, run, structured):
+        """
+        回复因 max_tokens 截断或 <img> 未闭合时，把已生成的部分交给模型接着写并拼接，
+        不必整体重新生成。返回合并后的结果；未截断或续写失败时原样返回已有结果。
+        """
+        settings = resolve_continuation_settings(config.data)
+        reason = truncation_reason(result, structured)
+        if reason is None:
+            return result
+        if not settings["enabled"] or settings["max_rounds"] == 0:
+            logger.warning(f"大模型的回复不完整（{reason}），未开启自动续写。")
+            return result
+
+        prefill = supports_prefill(endpoint.api_url)
+        budget = settings["max_tokens"]
+        content = result.content
+        reasoning = list(result.reasoning)
+        finish_reason = result.finish_reason
+        usages = []
+        rounds = 0
+        start = time.perf_counter()
+        while reason is not None and rounds < settings["max_rounds"]:
+            rounds += 1
+            logger.warning(f"大模型的回复不完整（{reason}），正在续写（第 {rounds}/{settings['max_rounds']} 轮）...")
+            # 续写的是已生成的文本，不再要求 JSON 格式
+            kwargs = {name: value for name, value in request_kwargs.items() if name != "response_format"}
+            kwargs["messages"] = continuation_messages(request_kwargs["messages"], content, prefill)
+            if budget:
+                kwargs["max_tokens"] = budget
+
+            def send():
+                with client_pool.client(endpoint.api_key, endpoint.api_url, http_settings) as client:
+                    start_time = time.perf_counter()
+                    response = client.chat.completions.create(**kwargs)
+                    return CompletionResult.from_response(response, elapsed=time.perf_counter() - start_time)
+
+            try:
+                part = request_scheduler.submit(
+                    endpoint.api_url, send, scheduler_settings,
+                    estimated_tokens=estimate_tokens(kwargs["messages"], budget or scheduler_settings["output_tokens"]),
+                    priority=priority, run=run,
+                    actual_tokens=lambda result: usage_counts(result.usage).get("total_tokens"),
+                )
+            except Exception as e:
+                logger.error(f"续写失败：{str(e)}，将使用已生成的部分。")
+                break
+            usages.append(part.usage)
+            if not part.content:
+                break
+            content = stitch(content, part.content)
+            reasoning.extend(part.reasoning)
+            finish_reason = part.finish_reason
+            if budget:
+                budget -= usage_counts(part.usage).get("completion_tokens", 0)
+                if budget <= 0:
+                    break
+            reason = truncation_reason(CompletionResult(content=content, finish_reason=finish_reason), structured)
+        run.add_stage("continuation", time.perf_counter() - start)
+
+        combined = CompletionResult(
+            content=content, reasoning=reasoning, think_blocks=result.think_blocks,
+            usage=CombinedUsage([result.usage] + usages) if result.usage is not None else None,
+            finish_reason=finish_reason, ttft=result.ttft, elapsed=result.elapsed, chunks=result.chunks,
+        )
+        continuation_tokens = sum(usage_counts(usage).get("total_tokens", 0) for usage in usages)
+        saved = tokens_saved(result.usage, usages)
+        saved_info = ""
+        if saved is not None:
+            saved_info = f"，与整体重新生成相比约{'节省' if saved >= 0 else '多消耗'} {abs(saved)} tokens"
+        status = "回复已完整" if reason is None else "回复仍不完整"
+        logger.info(f"续写 {rounds} 轮后{status}：续写消耗 {continuation_tokens} tokens{saved_info}。")
+        run.set(continuations=rounds, continuation_tokens=continuation_tokens, tokens_saved=saved)
+        return combined
+
+    def report_usage(self, result):
+        usage = result.usage
+        if usage is not None:
             prompt_tokens = usage.prompt_tokens
             completion_tokens = usage.completion_tokens
             total_tokens = usage.total_tokens
-            token_info = f"Tokens: {prompt_tokens} tokens input + {completion_tokens} tokens output = {total_tokens} tokens used."
-            print(f"[LLM_Prompt_Formatter]: {token_info}")
-
-            full_response = response.choices[0].message.content
-            #print(
-               # f"{BColors.WARNING}[LLM_Prompt_Formatter调试输出]:LLM输出：\n {full_response} {BColors.ENDC}")
-
-            found_thinking=False
-            if  hasattr(response.choices[0].message, 'reasoning') and response.choices[0].message.reasoning:
-                reasoning=response.choices[0].message.reasoning
-                found_thinking=True
-                print(f"{BColors.WARNING}[LLM_Prompt_Formatter]:大模型已进行深度思考，以下是思考内容：\n {reasoning} {BColors.ENDC}")
-
-            if  hasattr(response.choices[0].message, 'reasoning_content') and response.choices[0].message.reasoning_content:
-                reasoning=response.choices[0].message.reasoning_content
-                found_thinking=True
-                print(f"{BColors.WARNING}[LLM_Prompt_Formatter]:大模型已进行深度思考，以下是思考内容：\n {reasoning} {BColors.ENDC}")
-
-            match = re.search(r'<think>(.*?)</think>', full_response, re.DOTALL)
-            if match:
-                found_thinking=True
-                print(f"{BColors.WARNING}[LLM_Prompt_Formatter]:大模型已进行深度思考，以下是思考内容：\n {match.group(1)} {BColors.ENDC}")
-                full_response = re.sub(r'<think>(.*?)</think>', "", full_response, flags=re.DOTALL)
-                full_response = full_response.strip()
-
-            if thinking and not found_thinking:
-                print(
-                    f"{BColors.WARNING}[LLM_Prompt_Formatter]:虽然您开启了思考开关，但是未解析到思考内容。{BColors.ENDC}")
-
-            # # XML 匹配
-            match = re.search(r"```(?:xml)?\s*(.*?)\s*```", full_response, re.DOTALL)
-
-            if match:
-                xml_content = match.group(1).strip()
-                # 剩下的部分作为 text_out
-                text_content = full_response.replace(match.group(0), "").strip()
+            counts = usage_counts(usage)
+            if "cached_prompt_tokens" in counts:
+                input_info = (f"{prompt_tokens} tokens input ({counts['cached_prompt_tokens']} cached + "
+                              f"{counts.get('uncached_prompt_tokens', '?')} uncached)")
             else:
-                print(f"{BColors.WARNING}[LLM_Prompt_Formatter]: 解析代码块失败，正在尝试进一步分离{BColors.ENDC}")
-
-                # 如果没有代码块，检查是否有明显的 XML 标签结构
-                if "<img>" in full_response and "</img>" in full_response: #有完整结构
-                    start = full_response.find("<img>")
-                    end = full_response.rfind("</img>") + 6
-                    xml_content = full_response[start:end]
-                    text_content = full_response[:start] + full_response[end:]
-                elif "<img>" in full_response: #有一半结构
-                    start = full_response.find("<img>")
-                    xml_content = full_response[start:]
-                    text_content = ""
-                    print(f"{BColors.WARNING}[LLM_Prompt_Formatter]: 大模型的回复可能被截断。以下是大模型的回复：\n {full_response} {BColors.ENDC}")
-                else: #完全没有
-                    xml_content = full_response
-                    text_content = ""
-                    print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: 大模型的回复中未检测到<img>标签。以下是大模型的回复：\n {full_response} {BColors.ENDC}")
-
-            xml_content=clean_prompt(xml_content,gemma_prompt)
-            return (xml_content, text_content)
+                input_info = f"{prompt_tokens} tokens input"
+            logger.info(f"Tokens: {input_info} + {completion_tokens} tokens output = {total_tokens} tokens used.")
+        elif result.stopped_early:
+            logger.info(f"已在收到完整 <img> 后提前结束流式输出，平台未返回 token 统计（约 {result.chunks} 个增量块）。")
+
+        if result.ttft is not None:
+            speed = result.tokens_per_second()
+            speed_info = f"，生成速度 {speed:.1f} tokens/s" if speed is not None else ""
+            logger.info(f"流式输出：首 token 耗时 {result.ttft:.2f}s，总耗时 {result.elapsed:.2f}s{speed_info}。")
+
+    def report_thinking(self, reasoning_blocks, thinking):
+        found_thinking=False
+        settings = metrics.settings
+        for reasoning in reasoning_blocks:
+            found_thinking=True
+            logger.warning(f"大模型已进行深度思考，以下是思考内容：\n {preview(reasoning, settings)}")
+
+        if thinking and not found_thinking:
+            logger.warning("虽然您开启了思考开关，但是未解析到思考内容。")
+
+    def parse_structured_completion(self, result, thinking, gemma_prompt):
+        """
+        结构化输出：把 JSON 直接转换为 XML，不经过代码块匹配与修复。
+        回复不是合法 JSON（如被截断，或模型忽略了 response_format）时按普通回复解析。
+        """
+        data = parse_json(result.content)
+        if data is None:
+            reason = "回复被截断（finish_reason: length）" if result.finish_reason == "length" else "回复不是合法的 JSON"
+            logger.warning(f"结构化输出解析失败（{reason}），按普通回复解析。")
+            return self.parse_completion(result, thinking, gemma_prompt)
+        logger.debug(f"LLM输出：\n {result.content}")
+        self.report_thinking(result.reasoning + result.think_blocks, thinking)
+        xml_part, text_content = json_to_xml(data)
+        header = gemma_prompt
+        xml_content = f"{header}\n{xml_part}"
+        # 本地生成的 XML 一定合法，下游需要时才解析
+        return (xml_content, text_content, LPFXmlDocument.from_string(xml_content))
+
+    def parse_completion(self, result, thinking, gemma_prompt):
+        """从补全结果中分离思考内容、XML 与额外文字"""
+        full_response = result.content
+        logger.debug(f"LLM输出：\n {full_response}")
+
+        # 单遍扫描：思考块、代码块、<img> 文档与额外文字一次分离
+        scanned = scan_response(full_response)
+
+        self.report_thinking(result.reasoning + result.think_blocks + scanned.think_blocks, thinking)
+
+        settings = metrics.settings
+
+        if scanned.status != "fenced":
+            logger.warning("解析代码块失败，正在尝试进一步分离")
+        if scanned.status == "truncated":
+            logger.warning(f"大模型的回复可能被截断。以下是大模型的回复：\n {preview(full_response, settings)}")
+        elif scanned.status == "missing":
+            logger.error(f"大模型的回复中未检测到<img>标签。以下是大模型的回复：\n {preview(full_response, settings)}")
+
+        xml_content = scanned.xml_content
+        text_content = scanned.text_content
+        xml_doc=clean_prompt_document(xml_content,gemma_prompt,scanned.img_document)
+        return (xml_doc.to_string(), text_content, xml_doc)
+
+
+
+class LLM_Batch_Prompt_Formatter(LLM_Prompt_Formatter):
+    """
+    批量版本：IMAGE 批次中的每一张图片各发送一次请求，在有界线程池中并发执行，
+    按输入顺序返回列表输出。单张失败时在 status 中报告，不影响其他图片。
+    """
 
-        except Exception as e:
-            print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: {str(e)}, 请确认 API 配置是否正确。{BColors.ENDC}")
-            raise RuntimeError(f"LLM_Prompt_Formatter failed: {str(e)}") from e
+    @classmethod
+    def build_input_types(s, config):
+        inputs = super().build_input_types(config)
+        inputs["required"]["image"] = inputs["optional"].pop("image")
+        return inputs
 
+    RETURN_TYPES = ("STRING", "STRING", "STRING", LPF_XML_TYPE)
+    RETURN_NAMES = ("xml_out", "text_out", "status", "xml_doc")
+    OUTPUT_IS_LIST = (True, True, True, True)
+    FUNCTION = "process_batch"
+
+    @classmethod
+    def IS_CHANGED(s, api_key, api_url, model_name, user_text, thinking, image=None, bypass_cache=False, stream=False):
+        if bypass_cache:
+            return float("NaN")
+        if image is None:
+            return super().IS_CHANGED(api_key, api_url, model_name, user_text, thinking)
+        config = config_store.snapshot()
+        node = s()
+        return "|".join(node.compute_cache_key(config, api_url, model_name, user_text, thinking, image, i)
+                        for i in range(image.shape[0]))
+
+    def process_batch(self, api_key, api_url, model_name, user_text, thinking, image, bypass_cache=False, stream=False):
+        config = load_config()
+        final_key, final_url = self.resolve_credentials(config, api_key, api_url)
+        batch_size = image.shape[0]
+        max_workers = resolve_batch_settings(config.data)["max_workers"]
+        logger.info(f"批量模式：共 {batch_size} 张图片，最大并发 {max_workers}。")
+
+        def run(index):
+            return self.format_one(config, final_key, final_url, api_url, model_name, user_text, thinking,
+                                   image=image, index=index, bypass_cache=bypass_cache, stream=stream,
+                                   verbose=(index == 0), priority=1)
+
+        results = run_concurrently(run, list(range(batch_size)), max_workers)
+
+        xml_outs, text_outs, statuses, xml_docs = [], [], [], []
+        for index, (ok, value) in enumerate(results):
+            if ok:
+                xml_outs.append(value[0])
+                text_outs.append(value[1])
+                xml_docs.append(value[2])
+                statuses.append("ok")
+            else:
+                xml_outs.append("")
+                text_outs.append("")
+                xml_docs.append(LPFXmlDocument(text=""))
+                statuses.append(f"error: {value}")
+                logger.error(f"第 {index + 1}/{batch_size} 张图片处理失败: {value}")
+
+        failed = statuses.count("ok") != batch_size
+        if failed and "ok" not in statuses:
+            raise RuntimeError(f"LLM_Prompt_Formatter failed: 批次中的 {batch_size} 张图片全部处理失败，首个错误: {results[0][1]}")
+        if failed:
+            logger.warning(f"批量完成：成功 {statuses.count('ok')}/{batch_size}。")
+        else:
+            logger.info(f"批量完成：成功 {batch_size}/{batch_size}。")
+        return (xml_outs, text_outs, statuses, xml_docs)
+
+
+def prefetch_on_prompt(json_data):
+    """
+    PromptServer 的入队回调：工作流入队时为其中的 LLM_Prompt_Formatter 在后台提前发出请求，
+    节点执行时直接取结果，LLM 的等待与队列中前面工作流的采样同时进行。
+    只预取输入都是控件值（没有连接上游节点）且没有图片输入的节点。回调在事件循环中执行，只登记不等待。
+    """
+    try:
+        prompt = json_data.get("prompt")
+        if not isinstance(prompt, dict):
+            return json_data
+        config = config_store.snapshot()
+        settings = resolve_prefetch_settings(config.data)
+        if not settings["enabled"]:
+            return json_data
+        formatter = None
+        for node in prompt.values():
+            if not isinstance(node, dict) or node.get("class_type") != "LLM_Prompt_Formatter":
+                continue
+            inputs = node.get("inputs", {})
+            if "image" in inputs or inputs.get("bypass_cache"):
+                continue
+            values = [inputs.get(name) for name in ("api_key", "api_url", "model_name", "user_text", "thinking", "stream")]
+            # 连接上游节点的输入为 [节点 id, 输出序号]，入队时还不知道值
+            if any(isinstance(value, list) for value in values) or any(value is None for value in values[:5]):
+                continue
+            api_key, api_url, model_name, user_text, thinking, stream = values
+            # prompt_id 由 ComfyUI 在回调之后生成，这里预先指定，以便在队列项被删除时取消预取
+            prompt_id = json_data.setdefault("prompt_id", str(uuid.uuid4()))
+            if formatter is None:
+                formatter = LLM_Prompt_Formatter()
+            key = formatter.compute_cache_key(config, api_url, model_name, user_text, thinking)
+            job = partial(formatter.prefetch, config, api_key, api_url, model_name, user_text, bool(thinking), bool(stream))
+            if prefetcher.submit(key, prompt_id, job, settings):
+                logger.info(f"已在后台预取 LLM 请求，进行中与等待中的预取共 {prefetcher.pending()} 个。")
+    except Exception as e:
+        logger.warning(f"预取失败: {e}")
+    return json_data
+
+
+def split_user_texts(user_texts):
+    """把列表输入与多行文本统一拆成条目：每行一条，忽略空行"""
+    entries = []
+    for text in user_texts:
+        for line in str(text).splitlines():
+            line = line.strip()
+            if line:
+                entries.append(line)
+    return entries
+
+
+def dedupe_entries(entries):
+    """
+    确定性去重：按规整化后的文本（合并空白、忽略大小写）判断重复，保留首次出现的条目。
+    返回 (待发送条目, 每个输入对应的待发送条目下标)。
+    """
+    unique = []
+    positions = {}
+    mapping = []
+    for entry in entries:
+        normalized = " ".join(entry.split()).lower()
+        if normalized not in positions:
+            positions[normalized] = len(unique)
+            unique.append(entry)
+        mapping.append(positions[normalized])
+    return unique, mapping
+
+
+class LLM_Prompt_Fanout:
+    """
+    批量提示词扇出：一次输入多条 user_text（每行一条，或连接列表输出），
+    以可配置的并发上限同时请求，按输入顺序返回列表输出。
+    """
+
+    def __init__(self):
+        self.formatter = LLM_Prompt_Formatter()
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return config_store.snapshot().derived(f"{s.__name__}.INPUT_TYPES", s.build_input_types)
+
+    @classmethod
+    def build_input_types(s, config):
+        inputs = LLM_Prompt_Formatter.build_input_types(config)
+        inputs["required"]["user_text"] = ("STRING", {"multiline": True, "default": "1girl, holding a sword\n1boy, riding a horse", "dynamicPrompts": False})
+        inputs["required"]["max_in_flight"] = ("INT", {"default": 4, "min": 1, "max": 64})
+        inputs["required"]["dedupe"] = ("BOOLEAN", {"default": True, "label_on": "Dedupe", "label_off": "Keep Duplicates"})
+        inputs["optional"].pop("image")
+        return inputs
+
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("STRING", "STRING", "STRING", LPF_XML_TYPE)
+    RETURN_NAMES = ("xml_out", "text_out", "status", "xml_doc")
+    OUTPUT_IS_LIST = (True, True, True, True)
+    OUTPUT_NODE = True
+    FUNCTION = "process_many"
+    CATEGORY = "NewBie LLM Formatter"
+
+    @classmethod
+    def IS_CHANGED(s, api_key, api_url, model_name, user_text, thinking, max_in_flight, dedupe, bypass_cache=None, stream=None):
+        if bypass_cache and bypass_cache[0]:
+            return float("NaN")
+        config = config_store.snapshot()
+        formatter = LLM_Prompt_Formatter()
+        return "|".join(formatter.compute_cache_key(config, api_url[0], model_name[0], entry, thinking[0])
+                        for entry in split_user_texts(user_text))
+
+    def process_many(self, api_key, api_url, model_name, user_text, thinking, max_in_flight, dedupe, bypass_cache=None, stream=None):
+        # INPUT_IS_LIST 时每个输入都是列表，标量参数取第一个
+        api_key, api_url, model_name = api_key[0], api_url[0], model_name[0]
+        thinking, max_in_flight, dedupe = thinking[0], max_in_flight[0], dedupe[0]
+        bypass_cache = bool(bypass_cache and bypass_cache[0])
+        stream = bool(stream and stream[0])
+
+        entries = split_user_texts(user_text)
+        if not entries:
+            logger.warning("扇出模式未收到任何有效的 user_text。")
+            return ([], [], [], [])
+
+        if dedupe:
+            unique, mapping = dedupe_entries(entries)
+        else:
+            unique, mapping = entries, list(range(len(entries)))
+
+        config = load_config()
+        final_key, final_url = self.formatter.resolve_credentials(config, api_key, api_url)
+        logger.info(f"扇出模式：共 {len(entries)} 条输入，去重后发送 {len(unique)} 条，最大并发 {max_in_flight}。")
+
+        def run(job):
+            index, text = job
+            return self.formatter.format_one(config, final_key, final_url, api_url, model_name, text, thinking,
+                                             bypass_cache=bypass_cache, stream=stream, verbose=(index == 0),
+                                             priority=1)
+
+        results = run_concurrently(run, list(enumerate(unique)), max_in_flight)
+
+        xml_outs, text_outs, statuses, xml_docs = [], [], [], []
+        for position, unique_index in enumerate(mapping):
+            ok, value = results[unique_index]
+            if ok:
+                xml_outs.append(value[0])
+                text_outs.append(value[1])
+                xml_docs.append(value[2])
+                statuses.append("ok")
+            else:
+                xml_outs.append("")
+                text_outs.append("")
+                xml_docs.append(LPFXmlDocument(text=""))
+                statuses.append(f"error: {value}")
+
+        failures = sum(1 for ok, _ in results if not ok)
+        if failures == len(results):
+            raise RuntimeError(f"LLM_Prompt_Formatter failed: 扇出的 {len(results)} 条请求全部失败，首个错误: {results[0][1]}")
+        if failures:
+            logger.warning(f"扇出完成：成功 {len(results) - failures}/{len(results)} 条请求。")
+        else:
+            logger.info(f"扇出完成：成功 {len(results)}/{len(results)} 条请求。")
+        return (xml_outs, text_outs, statuses, xml_docs)
 
 
 def clean_prompt(xml_content,gemma_prompt):
@@ -274,83 +936,47 @@ def clean_prompt(xml_content,gemma_prompt):
     清洗大模型生成的 XML 提示词
     添加gemma_prompt
     """
+    return clean_prompt_document(xml_content, gemma_prompt).to_string()
+
+
+def clean_prompt_document(xml_content, gemma_prompt, xml_part=None):
+    """
+    与 clean_prompt 相同，但返回 LPFXmlDocument：
+    修复时得到的 lxml 树直接随文档传给下游节点，下游无需再次解析。
+    xml_part 为扫描器已定位好的 <img>...</img> 片段时不再重复查找。
+    """
 
     header = gemma_prompt
 
-    match = re.search(r'(<img>.*?</img>)', xml_content, re.DOTALL | re.IGNORECASE)
+    if xml_part is None:
+        match = IMG_PATTERN.search(xml_content)
+        if match:
+            xml_part = match.group(1)
 
-    if not match:
-        print(f"{BColors.FAIL}[LLM_Prompt_Formatter]: LLM返回结果匹配失败，请检查输出结果，必要时停止工作流。{BColors.ENDC}")
-        xml_content=repair_xml_custom(xml_content) #尝试修复一次
-        return xml_content
+    if xml_part is None:
+        logger.error("LLM返回结果匹配失败，请检查输出结果，必要时停止工作流。")
+        xml_content, root = repair_xml_tree(xml_content) #尝试修复一次
+        # 截断的回复经 recover 补全后仍是 <img> 文档，可以直接交给下游
+        if root is None or not isinstance(root.tag, str) or root.tag.lower() != "img":
+            root = None
+        return LPFXmlDocument(root=root, text=xml_content)
 
     # xml内部的内容
-    xml_part = match.group(1)
-    xml_part=repair_xml_custom(xml_part)
+    xml_part, root = repair_xml_tree(xml_part)
 
     cleaned_content = f"{header}\n{xml_part}"
 
-    return cleaned_content
+    return LPFXmlDocument(header, root, cleaned_content)
 
 
 def repair_xml_custom(xml_string):
     """
     修复 XML 格式错误，不包含 XML 声明。
-    成功修复时打印差异，修复失败时发出警告并返回原串。
+    修复时打印解析错误的位置，修复失败时发出警告并返回原串。
     """
-    if not xml_string.strip():
-        return xml_string
+    return repair_xml_tree(xml_string)[0]
 
-    # 解析器
-    strict_parser = etree.XMLParser(remove_blank_text=True)
-    recover_parser = etree.XMLParser(recover=True, remove_blank_text=True)
 
-    try:
-        # 严格解析
-        etree.fromstring(xml_string.encode('utf-8'), parser=strict_parser)
-        print("[LLM_Prompt_Formatter]:已完成xml格式检查，无错误。")
-        return xml_string
-    except etree.XMLSyntaxError:
-        try:
-            # 修复
-            root = etree.fromstring(xml_string.encode('utf-8'), parser=recover_parser)
-            if root is None:
-                raise ValueError("无法解析出任何有效结构")
-
-            repaired_xml = etree.tostring(
-                root,
-                encoding='unicode',
-                pretty_print=True,
-                xml_declaration=False
-            ).strip()
-
-            # 修复对比
-            print(f"{BColors.WARNING}[LLM_Prompt_Formatter]:检测到xml格式错误，已自动修复。差异如下：{BColors.ENDC}")
-            orig_lines = [line.strip() for line in xml_string.splitlines() if line.strip()]
-            new_lines = [line.strip() for line in repaired_xml.splitlines() if line.strip()]
-            diff = difflib.unified_diff(
-                orig_lines,
-                new_lines,
-                fromfile='Original',
-                tofile='Repaired',
-                lineterm='',
-                n=0
-            )
-
-            has_diff = False
-            for line in diff:
-                if line.startswith(('+', '-')) and not line.startswith(('+++', '---')):
-                    print(line)
-                    has_diff = True
-
-            if not has_diff:
-                print("(仅修复了微小的空白符或内部编码格式)")
-
-            print("-" * 30)
-            return repaired_xml
-
-        except Exception as e:
-            # 修复失败
-            print(f"{BColors.FAIL}[LLM_Prompt_Formatter]:XML 损坏严重，无法修复！必要时请停止工作流。\n错误详情: {e}{BColors.ENDC}")
-            print("-" * 30)
-            return xml_string
\ No newline at end of file
+def repair_xml_tree(xml_string):
+    """与 repair_xml_custom 相同，额外返回解析得到的根节点（失败时为 None）"""
+    return parse_document(xml_string)
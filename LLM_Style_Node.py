@@ -1,42 +1,144 @@
-import os
-import json
 import re
-from lxml import etree
+import uuid
 
+from .Config_Store import config_store
+from .Preset_Store import preset_store
+from .Preset_Catalog import resolve_catalog_settings
+from .Xml_Document import LPFXmlDocument, LPF_XML_TYPE, as_document
+from .Instrumentation import get_logger, metrics
 
-class BColors:
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
+logger = get_logger("XML_Style_Injector")
 
+# 预编译的 XPath，按标签名缓存（lxml 在首次注入时才加载）
+_XPATHS = {}
 
-# 预定义默认样式
-DEFAULT_STYLES = {
-    "空样式，请在下方文本框中自行书写": {
-        "artist": "",
-        "style": ""
-    }
-}
-
-CONFIG_FILENAME = "LPF_config.json"
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILENAME)
+# 扫描模板中的占位符：每个进程随机生成一次，不会与提示词的内容冲突
+_SWEEP_TAGS = ("artist", "style")
+_SWEEP_MARKERS = {tag_name: f"LPF{uuid.uuid4().hex}" for tag_name in _SWEEP_TAGS}
+_SWEEP_MARKER_TAGS = {marker: tag_name for tag_name, marker in _SWEEP_MARKERS.items()}
+_SWEEP_SPLIT = re.compile("(" + "|".join(_SWEEP_MARKERS.values()) + ")")
 
 
 def load_styles_from_config():
-    """读取配置文件并与默认样式合并"""
-    styles = DEFAULT_STYLES.copy()
+    """
+    兼容旧版本的接口（其他插件与脚本仍在导入）：返回全部风格预设 {名称: {"artist", "style"}}，
+    包括默认样式、配置文件与预设库中的预设。读取共享的快照，返回副本，调用方可以修改。
+    """
+    return dict(preset_store.snapshot(config_store.snapshot()).styles)
+
+
+def style_xpath(tag_name):
+    xpath = _XPATHS.get(tag_name)
+    if xpath is None:
+        from lxml import etree
+        xpath = _XPATHS[tag_name] = etree.XPath(f"//{tag_name}")
+    return xpath
+
+
+# 拼接
+def combine_tags(input_val, preset_val):
+    input_val = input_val.strip()
+    if input_val and preset_val:
+        return f"{input_val}, {preset_val}"
+    return input_val if input_val else preset_val
+
+
+# 更新或创建标签
+def upsert_tag(parent, tag_name, text_value):
+    if text_value and text_value.strip():
+        elements = style_xpath(tag_name)(parent)
+        if elements:
+            for el in elements:
+                el.text = text_value
+        else:
+            from lxml import etree
+            # 尝试找 general_tags 容器插入
+            logger.warning(f"未找到<{tag_name}>标签，正在尝试注入<general_tags>")
+            gen_containers = style_xpath("general_tags")(parent)
+            if gen_containers:
+                new_node = etree.SubElement(gen_containers[0], tag_name)
+                new_node.text = text_value
+            else:
+                # 实在没地方插了就插在根节点最后
+                logger.warning("未找到<general_tags>标签")
+                new_node = etree.SubElement(parent, tag_name)
+                new_node.text = text_value
+    else:
+        logger.warning(f"用户未输入<{tag_name}>，不改变标签")
+
+
+def escape_text(value):
+    """与 lxml 序列化元素文本时的转义一致"""
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
 
-    if os.path.exists(CONFIG_PATH):
-        try:
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                user_styles = data.get("styles", {})
-                if isinstance(user_styles, dict) and user_styles:
-                    styles.update(user_styles)
-        except Exception as e:
-            print(f"{BColors.FAIL}[XML_Style_Injector]: 加载配置文件出错: {e}{BColors.ENDC}")
 
-    return styles
+def split_preset_names(presets):
+    """每行一个预设名称，去掉空行与重复的名称，保持顺序"""
+    names = []
+    seen = set()
+    for line in (presets or "").splitlines():
+        name = line.strip()
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+class StyleSweep:
+    """
+    同一文档在多个预设下的注入结果。文档只解析一次；每个预设改写的只有 artist / style 两处，
+    按两者是否写入只有 4 种组合：每种组合复制一次树，用预编译的 XPath 定位（或插入）目标节点并写入占位符，
+    序列化为模板。之后每个预设只需把转义后的标签填进模板，不再复制、查找或序列化整棵树；
+    输出的 LPF_XML 只有在下游需要修改树时才从模板复制出来。
+    """
+
+    TAGS = _SWEEP_TAGS
+
+    def __init__(self, source):
+        self.source = source
+        self._templates = {}
+        self._check = None
+
+    def _template(self, key):
+        template = self._templates.get(key)
+        if template is None:
+            doc = self.source.clone()
+            for tag_name, enabled in zip(self.TAGS, key):
+                if enabled:
+                    upsert_tag(doc.root, tag_name, _SWEEP_MARKERS[tag_name])
+            parts = _SWEEP_SPLIT.split(doc.to_string())
+            # 奇数位置是占位符，换成对应的标签名
+            for i in range(1, len(parts), 2):
+                parts[i] = _SWEEP_MARKER_TAGS[parts[i]]
+            template = self._templates[key] = (doc, parts)
+        return template
+
+    def _validate(self, value):
+        # 含控制字符等 XML 不允许的字符时与单个注入一样报错
+        if self._check is None:
+            from lxml import etree
+            self._check = etree.Element("check")
+        self._check.text = value
+
+    def render(self, target_artist, target_style):
+        """返回注入后的文档；未写入的标签保持原样"""
+        values = {}
+        for tag_name, value in zip(self.TAGS, (target_artist, target_style)):
+            if value and value.strip():
+                self._validate(value)
+                values[tag_name] = value
+        template, parts = self._template(tuple(tag_name in values for tag_name in self.TAGS))
+        escaped = {tag_name: escape_text(value) for tag_name, value in values.items()}
+        text = "".join(escaped[part] if i % 2 else part for i, part in enumerate(parts))
+
+        def build():
+            root = template.clone().root
+            for tag_name, value in values.items():
+                for el in style_xpath(tag_name)(root):
+                    el.text = value
+            return template.header, root
+
+        return LPFXmlDocument.from_builder(text, build)
 
 
 class LLM_Xml_Style_Injector:
@@ -45,14 +147,23 @@ class LLM_Xml_Style_Injector:
 
     @classmethod
     def INPUT_TYPES(s):
-        # 获取最新的 style 表
-        current_styles = load_styles_from_config()
-        style_keys = list(current_styles.keys())
+        # 获取最新的 style 表；配置文件与预设库都不变时直接返回预先构造的结果
+        config = config_store.snapshot()
+        dropdown_limit = resolve_catalog_settings(config.data)["dropdown_limit"]
+        presets = preset_store.snapshot(config)
+        return presets.derived(f"{s.__name__}.INPUT_TYPES", lambda presets: s.build_input_types(presets, dropdown_limit))
+
+    @classmethod
+    def preset_choices(s, presets, dropdown_limit=0):
+        # 预设很多时下拉框只列出前 dropdown_limit 个，其余由前端通过 /lpf/presets 检索后加入
+        return presets.style_keys[:dropdown_limit] if dropdown_limit else presets.style_keys
 
+    @classmethod
+    def build_input_types(s, presets, dropdown_limit=0):
         return {
             "required": {
                 "xml_input": ("STRING", {"forceInput": True}),
-                "preset": (style_keys,),
+                "preset": (s.preset_choices(presets, dropdown_limit),),
             },
             "optional": {
                 "artist_add": ("STRING", {
@@ -73,71 +184,219 @@ class LLM_Xml_Style_Injector:
     FUNCTION = "inject_style"
     CATEGORY = "NewBie LLM Formatter"
 
-    def inject_style(self, xml_input, preset, artist_add, style_add):
-        current_styles = load_styles_from_config()
-        selected_data = current_styles.get(preset, {"artist": "", "style": ""})
+    @classmethod
+    def VALIDATE_INPUTS(s, preset):
+        # 下拉框可能只列出部分预设，由此处代替 ComfyUI 的下拉框取值检查
+        if preset_store.lookup(config_store.snapshot(), preset) is None:
+            return f"预设 '{preset}' 不存在"
+        return True
+
+    def inject_style(self, xml_input, preset, artist_add="", style_add=""):
+        run = metrics.start("XML_Style_Injector")
+        doc, status = self.inject_document(run, LPFXmlDocument.from_string(xml_input), preset, artist_add, style_add)
+        with run.stage("serialize"):
+            text = doc.to_string()
+        metrics.finish(run, status)
+        return (text,)
+
+    def inject_document(self, run, source, preset, artist_add, style_add):
+        """返回 (注入后的文档, 运行状态)；未发现 <img> 或出错时返回原文档"""
+        with run.stage("config_load"):
+            config = config_store.snapshot()
+            metrics.configure(config.data)
+            selected_data = preset_store.lookup(config, preset) or {"artist": "", "style": ""}
 
         preset_artist = selected_data.get("artist", "").strip()
         preset_style = selected_data.get("style", "").strip()
 
-        # 拼接
-        def combine_tags(input_val, preset_val):
-            input_val = input_val.strip()
-            if input_val and preset_val:
-                return f"{input_val}, {preset_val}"
-            return input_val if input_val else preset_val
-
         target_artist = combine_tags(artist_add, preset_artist)
         target_style = combine_tags(style_add, preset_style)
 
-        # 提取 XML
-        match = re.search(r'(<img>.*?</img>)', xml_input, re.DOTALL | re.IGNORECASE)
+        # 提取 XML（LPF_XML 输入已解析，字符串输入在此处解析一次）
+        with run.stage("parse"):
+            root = source.root
+        if root is None:
+            logger.warning("未发现 <img> 标签，跳过注入。")
+            return source, "skipped"
 
-        if not match:
-            print(f"{BColors.WARNING}[XML_Style_Injector]: 未发现 <img> 标签，跳过注入。{BColors.ENDC}")
-            return (xml_input,)
+        try:
+            # 复制一份再修改，上游节点的输出保持不变
+            doc = source.clone()
+            root = doc.root
 
-        header_text = xml_input[:match.start()].strip()
-        xml_content = match.group(1)
+            with run.stage("style_injection"):
+                upsert_tag(root, "artist", target_artist)
+                upsert_tag(root, "style", target_style)
 
-        try:
-            # 解析
-            parser = etree.XMLParser(recover=True, encoding='utf-8')
-            root = etree.fromstring(xml_content.encode('utf-8'), parser=parser)
-
-            # 更新或创建标签
-            def upsert(parent, tag_name, text_value):
-                if text_value and text_value.strip():
-                    elements = parent.xpath(f"//{tag_name}")
-                    if elements:
-                        for el in elements:
-                            el.text = text_value
-                    else:
-                        # 尝试找 general_tags 容器插入
-                        print(f"{BColors.WARNING}[XML_Style_Injector]: 未找到<{tag_name}>标签，正在尝试注入<general_tags>{BColors.ENDC}")
-                        gen_containers = parent.xpath("//general_tags")
-                        if gen_containers:
-                            new_node = etree.SubElement(gen_containers[0], tag_name)
-                            new_node.text = text_value
-                        else:
-                            # 实在没地方插了就插在根节点最后
-                            print(f"{BColors.WARNING}[XML_Style_Injector]: 未找到<general_tags>标签{BColors.ENDC}")
-                            new_node = etree.SubElement(parent, tag_name)
-                            new_node.text = text_value
-                else:
-                    print(f"{BColors.WARNING}[XML_Style_Injector]: 用户未输入<{tag_name}>，不改变标签{BColors.ENDC}")
-                    pass
-
-
-            upsert(root, "artist", target_artist)
-            upsert(root, "style", target_style)
-
-            modified_xml = etree.tostring(root, encoding='unicode', method='xml', pretty_print=True)
-
-            final_output = f"{header_text}\n{modified_xml}" if header_text else modified_xml
-            return (final_output,)
+            return doc, "ok"
 
         except Exception as e:
-            print(f"{BColors.FAIL}[XML_Style_Injector]: XML 解析失败: {e}{BColors.ENDC}")
-            return (xml_input,)
+            logger.error(f"XML 解析失败: {e}")
+            return source, "error"
+
+
+class LLM_Xml_Style_Injector_Doc(LLM_Xml_Style_Injector):
+    """
+    以 LPF_XML 文档为输入输出的风格注入，多个注入节点串联时不必在每一步重新解析与序列化。
+    与 XML Style Injector 分成两个节点，已保存的工作流中原节点的输入与输出保持不变。
+    """
+
+    @classmethod
+    def build_input_types(s, presets, dropdown_limit=0):
+        return {
+            "required": {
+                "xml_doc": (LPF_XML_TYPE,),
+                "preset": (s.preset_choices(presets, dropdown_limit),),
+            },
+            "optional": {
+                "artist_add": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "在此输入要添加的 Artist，将拼接到预设前面"
+                }),
+                "style_add": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "在此输入要添加的 Style，将拼接到预设前面"
+                }),
+                # 长链路中只连接 xml_doc 时可关闭，省去中间节点的序列化
+                "string_output": ("BOOLEAN", {"default": True, "label_on": "Emit String", "label_off": "LPF_XML Only"}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", LPF_XML_TYPE)
+    RETURN_NAMES = ("xml_output", "xml_doc")
+    FUNCTION = "inject_doc"
+
+    def inject_doc(self, xml_doc, preset, artist_add="", style_add="", string_output=True):
+        run = metrics.start("XML_Style_Injector")
+        doc, status = self.inject_document(run, xml_doc, preset, artist_add, style_add)
+        with run.stage("serialize"):
+            text = doc.to_string() if string_output else ""
+        metrics.finish(run, status)
+        return (text, doc)
+
+
+class LLM_Xml_Style_Sweep:
+    """
+    风格预设扫描：同一份提示词依次注入多个预设（逐行列出的预设，以及检索到的预设），
+    按顺序返回列表输出。文档只解析一次，预设增加到数百个时每个输出的耗时基本不变。
+    """
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "presets": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "每行一个预设名称"
+                }),
+                "search": ("STRING", {
+                    "default": "",
+                    "placeholder": "检索预设（名称或标签），结果接在上面的列表之后"
+                }),
+                "max_outputs": ("INT", {"default": 100, "min": 1, "max": 10000}),
+            },
+            "optional": {
+                "xml_input": ("STRING", {"forceInput": True}),
+                "xml_doc": (LPF_XML_TYPE,),
+                "artist_add": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "在此输入要添加的 Artist，将拼接到每个预设前面"
+                }),
+                "style_add": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "placeholder": "在此输入要添加的 Style，将拼接到每个预设前面"
+                }),
+                "string_output": ("BOOLEAN", {"default": True, "label_on": "Emit String", "label_off": "LPF_XML Only"}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", LPF_XML_TYPE, "STRING")
+    RETURN_NAMES = ("xml_output", "xml_doc", "preset")
+    OUTPUT_IS_LIST = (True, True, True)
+    FUNCTION = "sweep"
+    CATEGORY = "NewBie LLM Formatter"
+
+    @classmethod
+    def VALIDATE_INPUTS(s, presets=None):
+        if presets is None:
+            return True
+        config = config_store.snapshot()
+        missing = [name for name in split_preset_names(presets) if preset_store.lookup(config, name) is None]
+        if missing:
+            return f"预设不存在：{', '.join(missing)}"
+        return True
+
+    @staticmethod
+    def select_presets(config, presets, search, max_outputs):
+        """逐行列出的预设在前，检索结果在后（去重），最多 max_outputs 个，返回 [(名称, 预设)]"""
+        names = split_preset_names(presets)
+        if search and search.strip():
+            seen = set(names)
+            _, found = preset_store.snapshot(config).catalog.search(search, 0, max_outputs)
+            names.extend(name for name in found if name not in seen)
+        if len(names) > max_outputs:
+            logger.warning(f"共 {len(names)} 个预设，只输出前 {max_outputs} 个。")
+            names = names[:max_outputs]
+        selected = []
+        for name in names:
+            preset = preset_store.lookup(config, name)
+            if preset is None:
+                logger.warning(f"预设 '{name}' 不存在，已跳过。")
+            else:
+                selected.append((name, preset))
+        return selected
+
+    def sweep(self, presets="", search="", max_outputs=100, xml_input=None, xml_doc=None, artist_add="", style_add="", string_output=True):
+        run = metrics.start("XML_Style_Sweep")
+        with run.stage("config_load"):
+            config = config_store.snapshot()
+            metrics.configure(config.data)
+            selected = self.select_presets(config, presets, search, max_outputs)
+        names = [name for name, _ in selected]
+        run.set(presets=len(names))
+        if not selected:
+            logger.warning("未选择任何预设，跳过注入。")
+            metrics.finish(run, "skipped")
+            return ([], [], [])
+
+        source = as_document(xml_doc, xml_input)
+        if source is None:
+            logger.warning("未连接 xml_input 或 xml_doc，跳过注入。")
+            metrics.finish(run, "skipped")
+            return ([""] * len(names), [LPFXmlDocument(text="")] * len(names), names)
+
+        with run.stage("parse"):
+            root = source.root
+        if root is None:
+            logger.warning("未发现 <img> 标签，跳过注入。")
+            text = source.to_string() if string_output else ""
+            metrics.finish(run, "skipped")
+            return ([text] * len(names), [source] * len(names), names)
 
+        sweep = StyleSweep(source)
+        texts, docs = [], []
+        status = "ok"
+        with run.stage("style_injection"):
+            for name, preset in selected:
+                target_artist = combine_tags(artist_add, preset.get("artist", "").strip())
+                target_style = combine_tags(style_add, preset.get("style", "").strip())
+                try:
+                    doc = sweep.render(target_artist, target_style)
+                except Exception as e:
+                    # 与单个注入相同：出错的预设输出原文档
+                    logger.error(f"预设 '{name}' 注入失败: {e}")
+                    doc = source
+                    status = "error"
+                docs.append(doc)
+                texts.append(doc.to_string() if string_output else "")
+        logger.info(f"已为 {len(names)} 个预设生成注入结果。")
+        metrics.finish(run, status)
+        return (texts, docs, names)
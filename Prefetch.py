@@ -0,0 +1,190 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Prefetch")
+
+
+DEFAULT_PREFETCH_SETTINGS = {
+    "enabled": False,
+    "max_in_flight": 2,
+    "max_pending": 16,
+    "max_age": 600.0,
+}
+
+# 入队回调在 ComfyUI 把工作流放入队列之前执行：预取开始时最多等这么久，等不到说明校验失败或已被删除
+QUEUE_GRACE = 5.0
+
+# 记住最近执行过的缓存键：同样的输入再次入队时 ComfyUI 会直接使用缓存的节点输出，不必预取
+_EXECUTED_KEYS = 256
+
+
+class PrefetchCancelled(Exception):
+    """预取开始前对应的队列项已被删除"""
+
+
+def resolve_prefetch_settings(config):
+    """合并配置文件中的 prefetch 段与默认值"""
+    settings = dict(DEFAULT_PREFETCH_SETTINGS)
+    user_settings = config.get("prefetch", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_PREFETCH_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"prefetch.{name} 配置无效，已使用默认值 {default}。")
+    settings["max_in_flight"] = max(1, settings["max_in_flight"])
+    settings["max_pending"] = max(0, settings["max_pending"])
+    settings["max_age"] = max(1.0, settings["max_age"])
+    return settings
+
+
+class PrefetchJob:
+    def __init__(self, key, prompt_id):
+        self.key = key
+        self.prompt_ids = {prompt_id}
+        self.created = time.monotonic()
+        self.future = None
+
+
+class Prefetcher:
+    """
+    入队时在后台提前发出的请求。按缓存键登记，同一个键只请求一次；节点执行时用同样的键取结果：
+    已完成时直接返回，正在请求时等待它完成，尚未开始时取消预取、由节点自行请求。
+    同时进行的预取不超过 max_in_flight 个，其余最多 max_pending 个排队等待；
+    排队中的预取在开始前确认对应的队列项仍在，队列项被删除后不会再发出请求。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executed = OrderedDict()
+        self._executor = None
+        self._workers = 0
+        # 返回当前队列中（包括正在执行的）prompt_id 集合，由 register_prefetch 设置；为 None 时不检查
+        self.queued_prompt_ids = None
+
+    def _get_executor(self, max_in_flight):
+        if self._executor is None or self._workers != max_in_flight:
+            if self._executor is not None:
+                # 修改了并发上限：旧线程池中的预取照常完成
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="LPF_Prefetch")
+            self._workers = max_in_flight
+        return self._executor
+
+    def _prune(self, max_age):
+        now = time.monotonic()
+        for key, job in list(self._jobs.items()):
+            if job.future.done() and now - job.created > max_age:
+                # 对应的节点没有执行（例如工作流在此之前出错），丢弃结果
+                del self._jobs[key]
+
+    def _cancel_deleted(self):
+        if self.queued_prompt_ids is None:
+            return
+        now = time.monotonic()
+        stale = [job for job in self._jobs.values()
+                 if not job.future.done() and now - job.created > QUEUE_GRACE]
+        if not stale:
+            return
+        queued = self.queued_prompt_ids()
+        for job in stale:
+            if job.prompt_ids.isdisjoint(queued) and job.future.cancel():
+                del self._jobs[job.key]
+                logger.info("队列项已删除，取消尚未开始的预取。")
+
+    def submit(self, key, prompt_id, fn, settings):
+        """登记一次预取，返回是否新开始了预取；同一个键已在预取时只记录 prompt_id"""
+        with self._lock:
+            self._prune(settings["max_age"])
+            self._cancel_deleted()
+            if key in self._executed:
+                return False
+            job = self._jobs.get(key)
+            if job is not None:
+                job.prompt_ids.add(prompt_id)
+                return False
+            waiting = sum(1 for job in self._jobs.values() if not job.future.done())
+            if waiting >= settings["max_in_flight"] + settings["max_pending"]:
+                logger.debug(f"已有 {waiting} 个预取在进行或等待，本次不再预取。")
+                return False
+            job = PrefetchJob(key, prompt_id)
+            job.future = self._get_executor(settings["max_in_flight"]).submit(self._run, job, fn)
+            self._jobs[key] = job
+            return True
+
+    def _still_queued(self, job):
+        if self.queued_prompt_ids is None:
+            return True
+        deadline = job.created + QUEUE_GRACE
+        while True:
+            with self._lock:
+                prompt_ids = set(job.prompt_ids)
+            if not prompt_ids.isdisjoint(self.queued_prompt_ids()):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _run(self, job, fn):
+        if not self._still_queued(job):
+            with self._lock:
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+            logger.info("队列项已删除，跳过预取。")
+            raise PrefetchCancelled("队列项已删除")
+        return fn()
+
+    def take(self, key):
+        """节点执行时取预取的结果，没有可用的结果时返回 None（由节点自行请求）"""
+        with self._lock:
+            self._executed[key] = True
+            self._executed.move_to_end(key)
+            while len(self._executed) > _EXECUTED_KEYS:
+                self._executed.popitem(last=False)
+            job = self._jobs.pop(key, None)
+        if job is None:
+            return None
+        if job.future.cancel():
+            # 还排在其他预取之后，直接请求比等待更快
+            return None
+        try:
+            return job.future.result()
+        except PrefetchCancelled:
+            return None
+        except Exception as e:
+            logger.warning(f"预取失败，重新请求: {e}")
+            return None
+
+    def pending(self):
+        """尚未完成的预取数"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.future.done())
+
+
+def register_prefetch(handler):
+    """在 ComfyUI 的服务器上注册入队回调；不在 ComfyUI 中运行时什么也不做"""
+    try:
+        from server import PromptServer
+    except ImportError:
+        return False
+    server = getattr(PromptServer, "instance", None)
+    if server is None:
+        return False
+
+    def queued_prompt_ids():
+        running, queued = server.prompt_queue.get_current_queue()
+        # 队列项为 (number, prompt_id, prompt, extra_data, outputs_to_execute, ...)
+        return {item[1] for item in list(running) + list(queued)}
+
+    prefetcher.queued_prompt_ids = queued_prompt_ids
+    server.add_on_prompt_handler(handler)
+    return True
+
+
+prefetcher = Prefetcher()
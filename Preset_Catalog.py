@@ -0,0 +1,125 @@
+import re
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Preset_Catalog")
+
+
+DEFAULT_CATALOG_SETTINGS = {
+    "dropdown_limit": 500,
+    "page_size": 50,
+}
+
+# 每页最多返回的预设数
+MAX_PAGE_SIZE = 500
+
+_TERM_SPLIT = re.compile(r"[\s,]+")
+
+
+def resolve_catalog_settings(config):
+    """合并配置文件中的 preset_catalog 段与默认值"""
+    settings = dict(DEFAULT_CATALOG_SETTINGS)
+    user_settings = config.get("preset_catalog", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_CATALOG_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"preset_catalog.{name} 配置无效，已使用默认值 {default}。")
+    settings["dropdown_limit"] = max(0, settings["dropdown_limit"])
+    settings["page_size"] = min(MAX_PAGE_SIZE, max(1, settings["page_size"]))
+    return settings
+
+
+def preset_tokens(name, preset):
+    """预设的可检索词：名称本身，以及 artist / style 中逗号分隔的每个标签（均为小写）"""
+    tokens = {name.strip().lower()}
+    for field in ("artist", "style"):
+        for tag in str(preset.get(field, "")).split(","):
+            tag = tag.strip().lower()
+            if tag:
+                tokens.add(tag)
+    tokens.discard("")
+    return tokens
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PresetCatalog:
+    """
+    预设的检索索引（由 PresetSnapshot 惰性构建，预设变化后重建）。
+    名称与每个 artist / style 标签作为检索词，检索词 → 预设的倒排表之上再建三字母组 → 检索词的倒排表：
+    查询词不短于 3 个字符时由三字母组求交得到候选检索词，再确认子串匹配；更短的查询词直接扫描检索词表。
+    """
+
+    def __init__(self, presets):
+        self.names = presets.style_keys
+        self.styles = presets.styles
+        self._lower_names = [name.lower() for name in self.names]
+        postings = {}
+        for i, name in enumerate(self.names):
+            for token in preset_tokens(name, self.styles[name]):
+                postings.setdefault(token, []).append(i)
+        self._postings = postings
+        self._trigrams = {}
+        for token in postings:
+            for trigram in trigrams(token):
+                self._trigrams.setdefault(trigram, []).append(token)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _matching_tokens(self, term):
+        if len(term) < 3:
+            return [token for token in self._postings if term in token]
+        lists = []
+        for trigram in trigrams(term):
+            tokens = self._trigrams.get(trigram)
+            if tokens is None:
+                return []
+            lists.append(tokens)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for tokens in lists[1:]:
+            candidates.intersection_update(tokens)
+            if not candidates:
+                return []
+        return [token for token in candidates if term in token]
+
+    def _matching_presets(self, term):
+        matches = set()
+        for token in self._matching_tokens(term):
+            matches.update(self._postings[token])
+        return matches
+
+    def search(self, query, offset=0, limit=50):
+        """
+        按空格或逗号分隔的查询词检索（每个词都要在名称或某个标签中以子串出现），返回 (总数, 当前页的名称列表)。
+        名称以查询开头的排在最前，其次为名称包含查询的，其余保持下拉框中的顺序。查询为空时按顺序分页返回全部预设。
+        """
+        query = query.strip().lower()
+        terms = [term for term in _TERM_SPLIT.split(query) if term]
+        if not terms:
+            return len(self.names), self.names[offset:offset + limit]
+        matches = None
+        for term in terms:
+            found = self._matching_presets(term)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return 0, []
+
+        def rank(i):
+            name = self._lower_names[i]
+            if name.startswith(query):
+                return 0, i
+            return (1 if query in name else 2), i
+
+        ordered = sorted(matches, key=rank)
+        return len(ordered), [self.names[i] for i in ordered[offset:offset + limit]]
+
+    def item(self, name):
+        preset = self.styles[name]
+        return {"name": name, "artist": preset.get("artist", ""), "style": preset.get("style", "")}
@@ -0,0 +1,93 @@
+import asyncio
+
+from .Config_Store import config_store
+from .Preset_Store import preset_store
+from .Preset_Catalog import resolve_catalog_settings, MAX_PAGE_SIZE
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Preset_Routes")
+
+
+def _int_param(query, name, default, low, high):
+    try:
+        value = int(query.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    return min(high, max(low, value))
+
+
+def search_presets(query, offset, limit):
+    """GET /lpf/presets：分页检索，返回 {"total", "offset", "limit", "items": [{"name", "artist", "style"}]}"""
+    catalog = preset_store.snapshot(config_store.snapshot()).catalog
+    total, names = catalog.search(query, offset, limit)
+    return {"total": total, "offset": offset, "limit": limit, "items": [catalog.item(name) for name in names]}
+
+
+def lookup_preset(name):
+    """GET /lpf/presets/{name}：按名称取一个预设，不存在时返回 None"""
+    preset = preset_store.lookup(config_store.snapshot(), name)
+    if preset is None:
+        return None
+    return {"name": name, "artist": preset.get("artist", ""), "style": preset.get("style", "")}
+
+
+def upsert_preset(data):
+    """POST /lpf/presets：新增或更新预设库中的一个预设，返回 {"name", "created"}"""
+    if not isinstance(data, dict):
+        raise ValueError("请求体应为 JSON 对象")
+    name = data.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("缺少预设名称 name")
+    artist = data.get("artist", "")
+    style = data.get("style", "")
+    if not isinstance(artist, str) or not isinstance(style, str):
+        raise ValueError("artist 与 style 应为字符串")
+    name = name.strip()
+    created = preset_store.upsert(config_store.snapshot(), name, artist.strip(), style.strip())
+    logger.info(f"已{'新增' if created else '更新'}预设：'{name}'")
+    return {"name": name, "created": created}
+
+
+def register_routes():
+    """在 ComfyUI 的服务器上注册预设检索与编辑接口；不在 ComfyUI 中运行时什么也不做"""
+    try:
+        from aiohttp import web
+        from server import PromptServer
+    except ImportError:
+        return False
+    if getattr(PromptServer, "instance", None) is None:
+        return False
+    routes = PromptServer.instance.routes
+
+    async def run_blocking(fn, *args):
+        # 首次检索需要构建索引，SQLite 读写也可能等待其他进程的锁，不占用事件循环
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    @routes.get("/lpf/presets")
+    async def get_presets(request):
+        settings = resolve_catalog_settings(config_store.get())
+        offset = _int_param(request.query, "offset", 0, 0, 1 << 31)
+        limit = _int_param(request.query, "limit", settings["page_size"], 1, MAX_PAGE_SIZE)
+        result = await run_blocking(search_presets, request.query.get("q", ""), offset, limit)
+        return web.json_response(result)
+
+    @routes.get("/lpf/presets/{name}")
+    async def get_preset(request):
+        result = await run_blocking(lookup_preset, request.match_info["name"])
+        if result is None:
+            return web.json_response({"error": "预设不存在"}, status=404)
+        return web.json_response(result)
+
+    @routes.post("/lpf/presets")
+    async def post_preset(request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.json_response({"error": "请求体不是合法的 JSON"}, status=400)
+        try:
+            result = await run_blocking(upsert_preset, data)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response(result)
+
+    return True
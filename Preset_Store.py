@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+
+from .Config_Store import DEFAULT_STYLES
+from .Instrumentation import get_logger
+from .Preset_Catalog import PresetCatalog
+
+logger = get_logger("LPF_Presets")
+
+
+PRESETS_FILENAME = "LPF_presets.db"
+PRESETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), PRESETS_FILENAME)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    name TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    style TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _read_config_presets(config):
+    config_styles = config.get("styles", {})
+    if not isinstance(config_styles, dict):
+        return {}
+    return {name: {"artist": str(preset.get("artist", "")), "style": str(preset.get("style", ""))}
+            for name, preset in config_styles.items() if isinstance(preset, dict)}
+
+
+def config_presets(config):
+    """配置文件 styles 中格式正确的预设 {名称: {"artist", "style"}}，按配置文件中的顺序；每个配置快照只整理一次"""
+    return config.derived("Preset_Store.config_presets", _read_config_presets)
+
+
+class PresetSnapshot:
+    """
+    某一时刻全部风格预设的只读视图：默认样式、配置文件 styles 中的预设与预设库中保存的预设，
+    同名的预设以预设库为准。
+    """
+
+    def __init__(self, styles):
+        self.styles = styles
+        # 下拉框顺序：默认样式、配置文件中的预设，其后为预设库中按保存顺序排列的其余预设
+        self.style_keys = list(styles.keys())
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, key, builder):
+        """与 ConfigSnapshot.derived 相同：配置文件与预设库都不变时 builder(self) 只调用一次"""
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self)
+            return self._derived[key]
+
+    @property
+    def catalog(self):
+        """检索索引，首次检索时才构建"""
+        return self.derived("catalog", PresetCatalog)
+
+
+class PresetStore:
+    """
+    风格预设库（SQLite，WAL 模式）。保存预设只插入一行，不再改写 LPF_config.json：
+    写入是原子的，多个 ComfyUI 进程同时保存也不会互相覆盖，写到一半崩溃不会损坏配置文件。
+    其他进程写入后 PRAGMA data_version 会变化，据此刷新缓存的预设列表。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_path = None
+        self._writes = 0
+        self._migrated = False
+        # 已经提示过的配置文件与预设库不一致的预设 {(名称, artist, style)}
+        self._conflicts_noted = frozenset()
+        self._snapshot = PresetSnapshot({})
+        self._snapshot_key = None
+
+    def _connect(self):
+        if self._conn is not None and self._conn_path == self.path:
+            return self._conn
+        # sqlite3 在首次读取预设时才加载
+        import sqlite3
+        if self._conn is not None:
+            # 新路径打开失败时不能留下已关闭的连接，否则切换回原路径后会继续使用它
+            self._conn.close()
+            self._conn = None
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # 预设是用户数据，每次提交都落盘
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        self._conn_path = self.path
+        self._migrated = False
+        self._snapshot_key = None
+        return conn
+
+    def _migrate(self, conn, config):
+        """
+        一次性把旧版本保存在配置文件 styles 中的预设导入预设库（多个进程同时启动时只执行一次）。
+        导入之后同名的预设以预设库为准；之后在配置文件中新增的预设不导入，读取时与预设库合并。
+        配置文件缺失或损坏时暂不迁移，下次读取到正常的配置时再进行。
+        """
+        if self._migrated or config.error is not None or not config.data:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_config'").fetchone() is not None:
+                conn.execute("COMMIT")
+                self._migrated = True
+                return
+            now = time.time()
+            rows = [(name, preset["artist"], preset["style"], now) for name, preset in config_presets(config).items()]
+            conn.executemany("INSERT OR IGNORE INTO presets (name, artist, style, created) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_config', ?)", (str(len(rows)),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._migrated = True
+        if rows:
+            logger.info(f"已将配置文件中的 {len(rows)} 个预设导入 {os.path.basename(self.path)}，"
+                        f"之后同名的预设以预设库为准，请通过「编辑预设」对话框修改。")
+
+    def _note_conflicts(self, config, stored):
+        """配置文件中修改过、但预设库中已有同名预设的条目不会生效，给出警告（同样的差异只提示一次）"""
+        conflicts = set()
+        for name, preset in config_presets(config).items():
+            current = stored.get(name)
+            if current is not None and (preset["artist"], preset["style"]) != (current["artist"], current["style"]):
+                conflicts.add((name, preset["artist"], preset["style"]))
+        conflicts = frozenset(conflicts)
+        if conflicts and not conflicts <= self._conflicts_noted:
+            names = "、".join(sorted({name for name, _, _ in conflicts}))
+            logger.warning(f"配置文件 styles 中的预设与预设库 {os.path.basename(self.path)} 不一致，以预设库为准：{names}。"
+                           f"请通过「编辑预设」对话框修改这些预设，或从配置文件中删去它们。")
+        self._conflicts_noted = conflicts
+
+    def snapshot(self, config):
+        """返回与 config（ConfigSnapshot）合并后的预设快照；配置文件与预设库都不变时返回同一个对象"""
+        with self._lock:
+            try:
+                conn = self._connect()
+                self._migrate(conn, config)
+                version = (conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+                if self._snapshot_key is not None and self._snapshot_key[0] is config and self._snapshot_key[1] == version:
+                    return self._snapshot
+                stored = {name: {"artist": artist, "style": style} for name, artist, style
+                          in conn.execute("SELECT name, artist, style FROM presets ORDER BY rowid")}
+                self._note_conflicts(config, stored)
+                # 默认样式与配置文件中的预设在前，同名的以预设库为准
+                styles = dict(DEFAULT_STYLES)
+                styles.update(config_presets(config))
+                styles.update(stored)
+            except Exception as e:
+                logger.error(f"读取预设库 {os.path.basename(self.path)} 失败，仅使用配置文件中的预设: {e}")
+                return PresetSnapshot(dict(config.styles))
+            self._snapshot = PresetSnapshot(styles)
+            self._snapshot_key = (config, version)
+            return self._snapshot
+
+    def lookup(self, config, name):
+        """
+        按名称取一个预设（{"artist", "style"}），不存在时返回 None。
+        按主键查询预设库，不加载整个预设列表；预设库中没有时再查配置文件中的预设与默认样式。
+        """
+        with self._lock:
+            try:
+                conn = self._connect()
+                self._migrate(conn, config)
+                row = conn.execute("SELECT artist, style FROM presets WHERE name = ?", (name,)).fetchone()
+            except Exception as e:
+                logger.error(f"读取预设库 {os.path.basename(self.path)} 失败，仅使用配置文件中的预设: {e}")
+                return config.styles.get(name)
+        if row is not None:
+            return {"artist": row[0], "style": row[1]}
+        return config_presets(config).get(name, DEFAULT_STYLES.get(name))
+
+    def upsert(self, config, name, artist, style):
+        """新增或更新预设库中的预设，返回是否为新增；从配置文件导入的预设同样可以修改"""
+        with self._lock:
+            conn = self._connect()
+            self._migrate(conn, config)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                created = conn.execute("SELECT 1 FROM presets WHERE name = ?", (name,)).fetchone() is None
+                conn.execute("INSERT INTO presets (name, artist, style, created) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT (name) DO UPDATE SET artist = excluded.artist, style = excluded.style",
+                             (name, artist, style, time.time()))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            return created
+
+    def save(self, config, name, artist, style):
+        """保存一个新预设；同名预设已存在（包括刚被其他进程保存的）时返回 False"""
+        with self._lock:
+            conn = self._connect()
+            self._migrate(conn, config)
+            cursor = conn.execute("INSERT OR IGNORE INTO presets (name, artist, style, created) VALUES (?, ?, ?, ?)",
+                                  (name, artist, style, time.time()))
+            self._writes += 1
+            return cursor.rowcount == 1
+
+
+preset_store = PresetStore(PRESETS_PATH)
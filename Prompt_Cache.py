@@ -0,0 +1,78 @@
+import hashlib
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Prompt_Cache")
+
+
+DEFAULT_PROMPT_CACHE_SETTINGS = {
+    "enabled": True,
+    "cache_control": "auto",
+    "ttl": "5m",
+}
+
+CACHE_CONTROL_MODES = ("auto", "always", "never")
+CACHE_TTLS = ("5m", "1h")
+
+# OpenRouter 上需要显式 cache_control 标记才会缓存的模型（其余模型由平台自动缓存前缀）
+_MARKER_MODELS = ("anthropic/", "claude", "gemini")
+
+
+def resolve_prompt_cache_settings(config):
+    """合并配置文件中的 prompt_cache 段与默认值"""
+    settings = dict(DEFAULT_PROMPT_CACHE_SETTINGS)
+    user_settings = config.get("prompt_cache", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_PROMPT_CACHE_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"prompt_cache.{name} 配置无效，已使用默认值 {default}。")
+    settings["cache_control"] = settings["cache_control"].lower()
+    if settings["cache_control"] not in CACHE_CONTROL_MODES:
+        logger.warning(f"未知的 prompt_cache.cache_control 取值 {settings['cache_control']}，已使用 auto。")
+        settings["cache_control"] = "auto"
+    if settings["ttl"] not in CACHE_TTLS:
+        logger.warning(f"不支持的 prompt_cache.ttl 取值 {settings['ttl']}，已使用 5m。")
+        settings["ttl"] = "5m"
+    return settings
+
+
+def prefix_digest(system_content):
+    """system prompt 的短哈希，用于确认多次运行发送的前缀逐字节一致"""
+    return hashlib.sha256(system_content.encode('utf-8')).hexdigest()[:16]
+
+
+def uses_cache_control(api_url, model_name, settings):
+    """是否需要在 system prompt 上添加 cache_control 标记"""
+    mode = settings["cache_control"]
+    if not settings["enabled"] or mode == "never":
+        return False
+    if mode == "always":
+        return True
+    model = model_name.lower()
+    return 'openrouter' in api_url and any(name in model for name in _MARKER_MODELS)
+
+
+def uses_cache_key(api_url, settings):
+    """OpenAI 官方接口支持 prompt_cache_key，相同前缀的请求会被路由到同一缓存"""
+    return settings["enabled"] and 'api.openai.com' in api_url
+
+
+def build_messages(system_content, user_content, cache_control=False, ttl="5m"):
+    """
+    构造请求消息。静态的 system prompt 始终位于最前，输入文本与图片等每次变化的内容放在其后，
+    使平台可以复用前缀缓存。cache_control 为真时以内容块形式发送 system prompt 并标记缓存断点。
+    """
+    if cache_control:
+        marker = {"type": "ephemeral"}
+        if ttl != "5m":
+            marker["ttl"] = ttl
+        system_message = {
+            "role": "system",
+            "content": [{"type": "text", "text": system_content, "cache_control": marker}],
+        }
+    else:
+        system_message = {"role": "system", "content": system_content}
+    return [system_message, {"role": "user", "content": user_content}]
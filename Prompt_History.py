@@ -0,0 +1,396 @@
+import os
+import re
+import time
+import hashlib
+import threading
+
+from .Instrumentation import get_logger
+from .Tag_Formatter import CHARACTER_SECTIONS, GENERAL_SECTIONS, split_tags, parse_token, lookup_key, Tag
+
+logger = get_logger("LPF_Prompt_History")
+
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "history")
+
+DEFAULT_HISTORY_SETTINGS = {
+    "enabled": False,
+    "threshold": 0.8,
+    "mode": "patch",
+    "max_changes": 4,
+    "max_mb": 128.0,
+}
+
+HISTORY_MODES = ("patch", "reuse")
+
+# MinHash 签名长度与 LSH 分段：16 段 × 4 行，Jaccard 0.8 以上的条目几乎必然成为候选（0.5 的约 64%），
+# 候选再按完整标签集合计算 Jaccard 相似度
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# 需要经 parse_token 处理的片段（权重、括号、转义、画师前缀）；其余片段直接归一化
+_SPECIAL = re.compile(r"[():\\]")
+
+# 每次查询最多精确比较的候选条目数
+_MAX_CANDIDATES = 64
+
+# 增删这些分区的标签会改变角色构成，需要交给 LLM 重新生成
+_STRUCTURAL_SECTIONS = ("gender", "count", "character", "copyright")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    tags TEXT NOT NULL,
+    xml_out TEXT NOT NULL,
+    text_out TEXT NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket INTEGER NOT NULL,
+    entry INTEGER NOT NULL,
+    PRIMARY KEY (bucket, entry)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS buckets_entry ON buckets (entry);
+"""
+
+
+def resolve_history_settings(config):
+    """合并配置文件中的 prompt_history 段与默认值"""
+    settings = dict(DEFAULT_HISTORY_SETTINGS)
+    user_settings = config.get("prompt_history", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_HISTORY_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"prompt_history.{name} 配置无效，已使用默认值 {default}。")
+    settings["mode"] = settings["mode"].lower()
+    if settings["mode"] not in HISTORY_MODES:
+        logger.warning(f"未知的 prompt_history.mode 取值 {settings['mode']}，已使用 patch。")
+        settings["mode"] = "patch"
+    settings["threshold"] = min(1.0, max(0.5, settings["threshold"]))
+    settings["max_changes"] = max(0, settings["max_changes"])
+    settings["max_mb"] = max(1.0, settings["max_mb"])
+    return settings
+
+
+def normalize_tags(user_text):
+    """
+    把输入归一化为标签集合：忽略顺序、大小写、多余空白，空格与下划线等价，括号转义统一。
+    每个标签以规范写法保存（带权重时为 (tag:1.2)，显式画师为 artist:name），可用 parse_token 还原。
+    """
+    tags = set()
+    for token in split_tags(user_text):
+        if not _SPECIAL.search(token):
+            tags.add("_".join(token.lower().split()))
+            continue
+        raw, weight, explicit_artist = parse_token(token)
+        key = lookup_key(" ".join(raw.split()))
+        if not key:
+            continue
+        tag = Tag(key, weight).render()
+        tags.add(f"artist:{tag}" if explicit_artist else tag)
+    return frozenset(tags)
+
+
+def tag_key(tag):
+    """不含权重与画师前缀的标签名，用于在 XML 中定位同一个标签"""
+    raw, _, _ = parse_token(tag)
+    return lookup_key(" ".join(raw.split()))
+
+
+_permutations = None
+
+
+def _hash_permutations():
+    """NUM_PERM 组固定的 multiply-shift 哈希参数 (a, b)，由常量种子生成，各进程一致"""
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+        seed = np.frombuffer(hashlib.shake_128(b"LPF prompt history").digest(16 * NUM_PERM), dtype='<u8')
+        _permutations = (seed[:NUM_PERM] | np.uint64(1), seed[NUM_PERM:])
+    return _permutations
+
+
+def minhash(tags):
+    """
+    集合的 MinHash 签名（NUM_PERM 个 32 位值）：每个标签取一次 64 位 BLAKE2 哈希，
+    再用 NUM_PERM 组 multiply-shift 哈希 (a * h + b) >> 32 模拟不同的排列，逐位取最小。
+    与 Python 内置 hash 不同，结果在不同进程间保持一致。
+    """
+    # numpy 只在启用历史记录后才加载
+    import numpy as np
+    a, b = _hash_permutations()
+    hashes = np.frombuffer(b"".join(hashlib.blake2b(tag.encode('utf-8'), digest_size=8).digest() for tag in tags),
+                           dtype='<u8')
+    return ((hashes[:, None] * a + b) >> np.uint64(32)).astype('<u4').min(axis=0)
+
+
+def band_buckets(scope, signature):
+    """每段签名对应的桶编号（64 位有符号整数，可直接作为 SQLite 整数主键）；scope 不同的条目互不为候选"""
+    prefix = scope.encode('utf-8')
+    buckets = []
+    for band in range(BANDS):
+        values = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(prefix + bytes((band,)) + values.tobytes(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def set_digest(scope, tags):
+    return hashlib.sha256("\n".join([scope] + sorted(tags)).encode('utf-8')).hexdigest()
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class HistoryMatch:
+    """相似的历史结果：added / removed 为当前输入相对于历史输入新增与移除的标签"""
+
+    def __init__(self, xml_out, text_out, similarity, added, removed):
+        self.xml_out = xml_out
+        self.text_out = text_out
+        self.similarity = similarity
+        self.added = added
+        self.removed = removed
+
+    @property
+    def changes(self):
+        return len(self.added) + len(self.removed)
+
+
+class PromptHistory:
+    """
+    以往生成结果的持久化历史（SQLite）：按 scope（模型、system prompt、图片等除输入文本外的全部条件）
+    与归一化的标签集合保存 (xml_out, text_out)，并以 MinHash/LSH 桶索引查找 Jaccard 相似度足够高的条目。
+    数据库超过 max_mb 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        self._lock = threading.Lock()
+        self._conn = None
+        self._path = None
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _connect(self):
+        path = os.path.join(self.history_dir, "history.db")
+        if self._conn is not None and self._path == path:
+            return self._conn
+        # sqlite3 只在启用历史记录后才加载，不影响插件注册
+        import sqlite3
+        if self._conn is not None:
+            self._conn.close()
+        os.makedirs(self.history_dir, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        # auto_vacuum 只能在建表之前设置；淘汰后用 incremental_vacuum 归还空闲页，文件大小随之回落
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        self._path = path
+        return conn
+
+    def lookup(self, scope, user_text, settings):
+        """返回 Jaccard 相似度不低于 threshold 的最相似条目（HistoryMatch），没有时返回 None"""
+        tags = normalize_tags(user_text)
+        if not tags:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT id, xml_out, text_out FROM entries WHERE digest = ?",
+                               (set_digest(scope, tags),)).fetchone()
+            if row is not None:
+                self._touch(conn, row[0])
+                self.stats["exact_hits"] += 1
+                return HistoryMatch(row[1], row[2], 1.0, frozenset(), frozenset())
+
+            buckets = band_buckets(scope, minhash(tags))
+            candidates = conn.execute(
+                f"SELECT id, tags FROM entries WHERE scope = ? AND id IN "
+                f"(SELECT entry FROM buckets WHERE bucket IN ({','.join('?' * len(buckets))})) "
+                f"ORDER BY used DESC LIMIT {_MAX_CANDIDATES}",
+                [scope] + buckets,
+            ).fetchall()
+            best = None
+            for entry_id, stored in candidates:
+                stored = frozenset(stored.split("\n"))
+                similarity = jaccard(tags, stored)
+                # 相似度相同时取最近使用的条目（候选已按使用时间排序）
+                if similarity >= settings["threshold"] and (best is None or similarity > best[1]):
+                    best = (entry_id, similarity, stored)
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            entry_id, similarity, stored = best
+            xml_out, text_out = conn.execute("SELECT xml_out, text_out FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            self._touch(conn, entry_id)
+            self.stats["similar_hits"] += 1
+            return HistoryMatch(xml_out, text_out, similarity, tags - stored, stored - tags)
+
+    def _touch(self, conn, entry_id):
+        conn.execute("UPDATE entries SET used = ? WHERE id = ?", (time.time(), entry_id))
+
+    def put(self, scope, user_text, value, settings):
+        """记录一次生成结果；标签集合相同的旧条目会被替换"""
+        tags = normalize_tags(user_text)
+        if not tags:
+            return
+        digest = set_digest(scope, tags)
+        buckets = band_buckets(scope, minhash(tags))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM buckets WHERE entry IN (SELECT id FROM entries WHERE digest = ?)", (digest,))
+                conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                cursor = conn.execute(
+                    "INSERT INTO entries (scope, digest, tags, xml_out, text_out, used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, digest, "\n".join(sorted(tags)), value[0], value[1], time.time()),
+                )
+                conn.executemany("INSERT OR IGNORE INTO buckets (bucket, entry) VALUES (?, ?)",
+                                 [(bucket, cursor.lastrowid) for bucket in buckets])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self.stats["writes"] += 1
+            self._evict(conn, int(settings["max_mb"] * 1024 * 1024))
+
+    def size_bytes(self, conn=None):
+        """数据库中已使用页的总大小（不含空闲页）"""
+        conn = conn or self._connect()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, conn, max_bytes):
+        used = self.size_bytes(conn)
+        if used <= max_bytes:
+            return
+        # 按条目数比例淘汰到上限的 90%，避免每次写入都触发淘汰
+        count = conn.execute("SELECT count(*) FROM entries").fetchone()[0]
+        evict = max(1, int(count * (1 - max_bytes * 0.9 / used)) + 1)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS evicted (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM evicted")
+            conn.execute("INSERT INTO evicted SELECT id FROM entries ORDER BY used LIMIT ?", (evict,))
+            conn.execute("DELETE FROM buckets WHERE entry IN (SELECT id FROM evicted)")
+            conn.execute("DELETE FROM entries WHERE id IN (SELECT id FROM evicted)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA incremental_vacuum")
+        self.stats["evictions"] += evict
+        logger.debug(f"提示词历史超过 {max_bytes // (1024 * 1024)} MB，已淘汰 {evict} 条最久未使用的记录。")
+
+    def stats_text(self):
+        s = self.stats
+        return (f"完全相同 {s['exact_hits']} 次，相似 {s['similar_hits']} 次，未命中 {s['misses']} 次，"
+                f"记录 {s['writes']} 条")
+
+
+def _tag_elements(parent):
+    """parent 下直接包含标签列表的元素：{元素名: 元素}"""
+    return {element.tag: element for element in parent if isinstance(element.tag, str) and not len(element)}
+
+
+def _insert_section(parent, name, order):
+    """按 system prompt 规定的字段顺序插入新的空字段"""
+    from lxml import etree
+    position = order.index(name)
+    element = etree.Element(name)
+    for i, child in enumerate(parent):
+        if child.tag in order and order.index(child.tag) > position:
+            element.tail = parent[i - 1].tail if i else parent.text
+            parent.insert(i, element)
+            return element
+    if len(parent):
+        last = parent[-1]
+        element.tail = last.tail
+        last.tail = parent.text
+    parent.append(element)
+    return element
+
+
+def patch_document(xml_doc, match, index):
+    """
+    把标签差异应用到历史结果的 <img> 上：移除已删去的标签，按词表分区加入新增的标签，
+    只改变权重的标签在原位置替换。<caption> 与翻译沿用历史结果。
+    返回 (修改后的文档, None)；无法在本地应用时返回 (None, 原因)。
+    """
+    root = xml_doc.root
+    if root is None:
+        return None, "历史结果中没有 <img>"
+
+    placements = []
+    for tag in sorted(match.added):
+        raw, weight, explicit_artist = parse_token(tag)
+        name, section = index.lookup(raw)
+        if explicit_artist:
+            section = "artist"
+        if section is None:
+            return None, f"词表中没有新增的标签 {tag}"
+        if section in _STRUCTURAL_SECTIONS:
+            return None, f"新增的标签 {tag} 会改变角色构成"
+        placements.append((tag_key(tag), tag, section))
+    for tag in match.removed:
+        _, section = index.lookup(tag_key(tag))
+        if section in _STRUCTURAL_SECTIONS:
+            return None, f"移除的标签 {tag} 会改变角色构成"
+
+    doc = xml_doc.clone()
+    root = doc.root
+    characters = [element for element in root if isinstance(element.tag, str) and element.tag.startswith("character_")]
+    general = root.find("general_tags")
+
+    removed = {tag_key(tag) for tag in match.removed}
+    replacements = {key: tag for key, tag, _ in placements if key in removed}
+    present = set()
+    for parent in characters + ([general] if general is not None else []):
+        for element in _tag_elements(parent).values():
+            if element.tag in ("n", "caption") or not element.text:
+                continue
+            tokens = []
+            for token in (token.strip() for token in element.text.split(",")):
+                key = tag_key(token) if token else None
+                if key in replacements:
+                    token = replacements.pop(key)
+                elif key in removed:
+                    continue
+                if token:
+                    tokens.append(token)
+                    present.add(key)
+            element.text = ", ".join(tokens)
+
+    for key, tag, section in placements:
+        if key in present:
+            continue  # 已在原位置替换权重，或大模型已经补充过这个标签
+        if section in CHARACTER_SECTIONS:
+            if len(characters) != 1:
+                return None, f"无法确定新增的标签 {tag} 属于哪个角色"
+            parent, order = characters[0], ("n",) + CHARACTER_SECTIONS
+        else:
+            if general is None:
+                return None, "历史结果中没有 <general_tags>"
+            parent, order = general, GENERAL_SECTIONS
+        element = _tag_elements(parent).get(section)
+        if element is None:
+            element = _insert_section(parent, section, order)
+        existing = (element.text or "").strip().rstrip(",").strip()
+        element.text = f"{existing}, {tag}" if existing else tag
+    return doc, None
+
+
+prompt_history = PromptHistory(HISTORY_DIR)
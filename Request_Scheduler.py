@@ -0,0 +1,280 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Scheduler")
+
+
+DEFAULT_SCHEDULER_SETTINGS = {
+    "enabled": True,
+    "max_retries": 4,
+    "backoff_base": 1.0,
+    "backoff_max": 60.0,
+    "output_tokens": 1000,
+}
+
+# 与 openai SDK 一致：超时、锁冲突、限流与服务端错误可以重试
+RETRY_STATUS_CODES = (408, 409, 429)
+
+# 估算输入 token 时每个字符约合的 token 数（中英混合取保守值），图片按固定值计
+_TOKENS_PER_CHAR = 0.5
+_IMAGE_TOKENS = 1500
+
+
+def resolve_scheduler_settings(config):
+    """合并配置文件中的 scheduler 段与默认值；rate_limits 解析为 {平台关键字: (rpm, tpm)}"""
+    settings = dict(DEFAULT_SCHEDULER_SETTINGS)
+    user_settings = config.get("scheduler", {})
+    if not isinstance(user_settings, dict):
+        user_settings = {}
+    for name, default in DEFAULT_SCHEDULER_SETTINGS.items():
+        value = user_settings.get(name, default)
+        try:
+            settings[name] = type(default)(value)
+        except (TypeError, ValueError):
+            logger.warning(f"scheduler.{name} 配置无效，已使用默认值 {default}。")
+    settings["max_retries"] = max(0, settings["max_retries"])
+
+    rate_limits = {}
+    user_limits = user_settings.get("rate_limits", {})
+    if isinstance(user_limits, dict):
+        for provider, limits in user_limits.items():
+            if not isinstance(limits, dict):
+                continue
+            try:
+                rpm = float(limits.get("rpm", 0) or 0)
+                tpm = float(limits.get("tpm", 0) or 0)
+            except (TypeError, ValueError):
+                logger.warning(f"scheduler.rate_limits.{provider} 配置无效，已忽略。")
+                continue
+            rate_limits[provider.lower()] = (max(0.0, rpm), max(0.0, tpm))
+    settings["rate_limits"] = rate_limits
+    return settings
+
+
+def provider_key(api_url):
+    """同一平台（主机名）的请求共用一组限额"""
+    host = urlparse(api_url).netloc.lower()
+    return host or api_url
+
+
+def estimate_tokens(messages, output_tokens):
+    """请求发出前粗略估算本次消耗的 token，返回后按实际用量修正"""
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            else:
+                images += 1
+    return int(chars * _TOKENS_PER_CHAR) + images * _IMAGE_TOKENS + output_tokens
+
+
+class TokenBucket:
+    """令牌桶：每分钟补充 rate 个，容量为一分钟的量；rate 为 0 表示不限制"""
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.level = rate
+        self.updated = time.monotonic()
+
+    def configure(self, rate):
+        if rate != self.rate:
+            self._refill()
+            # 从不限制改为限制时桶是满的，调整限额时保留当前余量
+            self.level = rate if not self.rate else min(self.level, rate)
+            self.rate = rate
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """还需等待多少秒才能取出 amount；单次超过容量时按桶满处理，避免永远等不到"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.rate)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.rate)
+
+    def adjust(self, delta):
+        """按实际用量修正（可以为负，即欠账，之后的请求相应推迟）"""
+        if self.rate:
+            self._refill()
+            self.level = min(self.rate, self.level - delta)
+
+
+class _Provider:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []            # (priority, seq, ticket) 小顶堆
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.paused_until = 0.0    # 收到 Retry-After 后整个平台暂停到此时刻
+        self.limits = None
+
+
+def retry_after_seconds(error):
+    """从 retry-after-ms / retry-after（秒数或 HTTP 日期）响应头中读取等待时间"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    import openai
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+class RequestScheduler:
+    """
+    进程内所有格式化请求共用的调度器。
+    每个平台一组令牌桶（请求数/分钟与 token/分钟），等待中的请求按 (优先级, 到达顺序) 排队，
+    只有队首可以取令牌，因此持续吞吐量维持在平台限额附近，而不是突发后集体 429。
+    遇到 429 时按 Retry-After 暂停整个平台；可重试的错误按带抖动的指数退避重试。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers = {}
+        self._seq = itertools.count()
+
+    def _provider(self, key, settings):
+        with self._lock:
+            provider = self._providers.get(key)
+            if provider is None:
+                provider = self._providers[key] = _Provider()
+        limits = (0.0, 0.0)
+        # 与 get_platform_settings 相同，按关键字匹配平台（如 openrouter、googleapis），取最长的匹配
+        matches = [name for name in settings["rate_limits"] if name in key]
+        if matches:
+            limits = settings["rate_limits"][max(matches, key=len)]
+        with provider.cond:
+            if limits != provider.limits:
+                provider.requests.configure(limits[0])
+                provider.tokens.configure(limits[1])
+                provider.limits = limits
+        return provider
+
+    def _acquire(self, provider, tokens, priority, seq):
+        ticket = object()
+        with provider.cond:
+            heapq.heappush(provider.queue, (priority, seq, ticket))
+            try:
+                while True:
+                    if provider.queue[0][2] is ticket:
+                        wait = max(provider.paused_until - time.monotonic(),
+                                   provider.requests.wait_time(1),
+                                   provider.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            provider.requests.take(1)
+                            provider.tokens.take(tokens)
+                            return
+                        provider.cond.wait(wait)
+                    else:
+                        provider.cond.wait()
+            finally:
+                provider.queue.remove(next(entry for entry in provider.queue if entry[2] is ticket))
+                heapq.heapify(provider.queue)
+                provider.cond.notify_all()
+
+    def _pause(self, provider, seconds):
+        with provider.cond:
+            provider.paused_until = max(provider.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt, settings):
+        """full jitter：在 [0, min(上限, base * 2^attempt)] 中随机取值，避免多个请求同时重试"""
+        return random.uniform(0, min(settings["backoff_max"], settings["backoff_base"] * (2 ** attempt)))
+
+    def submit(self, api_url, fn, settings, estimated_tokens=0, priority=0, run=None, actual_tokens=None):
+        """
+        排队取得配额后执行 fn()，可重试的错误按退避策略重试。
+        actual_tokens(result) 返回实际消耗的 token 数（未知时为 None），用于修正 token 桶。
+        priority 越小越先执行；run 不为空时记录排队耗时与重试次数。
+        """
+        if not settings["enabled"]:
+            return fn()
+
+        key = provider_key(api_url)
+        provider = self._provider(key, settings)
+        # 重试时沿用最初的到达顺序，不必重新排到队尾
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            self._acquire(provider, estimated_tokens, priority, seq)
+            if run is not None:
+                run.add_stage("queue_wait", time.perf_counter() - start)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= settings["max_retries"]:
+                    raise
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None and retry_after > settings["backoff_max"]:
+                    logger.error(f"{key} 要求等待 {retry_after:.0f}s 后重试，超过 scheduler.backoff_max，放弃本次请求。")
+                    raise
+                delay = retry_after if retry_after is not None else self.backoff(attempt, settings)
+                status = getattr(e, "status_code", None)
+                attempt += 1
+                if run is not None:
+                    run.set(retries=attempt)
+                logger.warning(f"{key} 请求失败（{status or type(e).__name__}），{delay:.1f}s 后重试"
+                               f"（第 {attempt}/{settings['max_retries']} 次）。")
+                if status == 429:
+                    # 限流作用于整个平台：暂停该平台的队列，本请求与其他排队的请求一起等待
+                    self._pause(provider, delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            if actual_tokens is not None:
+                used = actual_tokens(result)
+                if used is not None:
+                    with provider.cond:
+                        provider.tokens.adjust(used - estimated_tokens)
+            return result
+
+
+request_scheduler = RequestScheduler()
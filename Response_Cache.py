@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Response_Cache")
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "responses")
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": True,
+    "memory_entries": 256,
+    "disk": True,
+    "disk_max_mb": 64.0,
+}
+
+
+def resolve_cache_settings(config):
+    """合并配置文件中的 response_cache 段与默认值"""
+    settings = dict(DEFAULT_CACHE_SETTINGS)
+    user_settings = config.get("response_cache", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_CACHE_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"response_cache.{name} 配置无效，已使用默认值 {default}。")
+    return settings
+
+
+def make_cache_key(model_name, system_content, user_text, image_digest, thinking, temperature, extra_body, header=""):
+    """对决定输出结果的全部输入做内容寻址哈希（header 为拼接在 xml_out 前的 gemma_prompt）"""
+    payload = json.dumps({
+        "header": header,
+        "model_name": model_name,
+        "system_content": system_content,
+        "user_text": user_text,
+        "image": image_digest,
+        "thinking": bool(thinking),
+        "temperature": temperature,
+        "extra_body": extra_body,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    两级响应缓存：内存 LRU + 磁盘文件（按总大小淘汰最久未使用的条目）。
+    缓存内容为节点最终输出 (xml_out, text_out)。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk_index = None  # key -> (size, mtime)，首次访问磁盘时建立
+        self._disk_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        if self._disk_index is not None:
+            return
+        self._disk_index = {}
+        self._disk_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(shard_dir, name))
+                except OSError:
+                    continue
+                self._disk_index[name[:-5]] = (st.st_size, st.st_mtime)
+                self._disk_bytes += st.st_size
+
+    def _remember(self, key, value, memory_entries):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > max(0, memory_entries):
+            self._memory.popitem(last=False)
+
+    def get(self, key, settings):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+            if settings["disk"]:
+                self._load_disk_index()
+                path = self._path(key)
+                # 其他 ComfyUI 进程写入的条目不在本进程索引中，额外检查一次文件
+                if key in self._disk_index or os.path.exists(path):
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                        value = (data["xml_out"], data["text_out"])
+                        now = time.time()
+                        os.utime(path, (now, now))
+                        if key not in self._disk_index:
+                            size = os.path.getsize(path)
+                            self._disk_index[key] = (size, now)
+                            self._disk_bytes += size
+                        self._disk_index[key] = (self._disk_index[key][0], now)
+                        self._remember(key, value, settings["memory_entries"])
+                        self.stats["disk_hits"] += 1
+                        return value
+                    except Exception as e:
+                        logger.warning(f"读取缓存文件失败，已忽略: {e}")
+                        self._drop_disk_entry(key)
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value, settings):
+        with self._lock:
+            self._remember(key, value, settings["memory_entries"])
+            self.stats["writes"] += 1
+            if not settings["disk"]:
+                return
+
+            self._load_disk_index()
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"xml_out": value[0], "text_out": value[1]}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                size = os.path.getsize(path)
+            except Exception as e:
+                logger.warning(f"写入缓存文件失败: {e}")
+                return
+
+            old = self._disk_index.get(key)
+            if old:
+                self._disk_bytes -= old[0]
+            self._disk_index[key] = (size, time.time())
+            self._disk_bytes += size
+            self._evict(int(settings["disk_max_mb"] * 1024 * 1024))
+
+    def _drop_disk_entry(self, key):
+        entry = self._disk_index.pop(key, None)
+        if entry:
+            self._disk_bytes -= entry[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self, max_bytes):
+        if self._disk_bytes <= max_bytes:
+            return
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = int(max_bytes * 0.9)
+        for key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+            if self._disk_bytes <= target:
+                break
+            self._drop_disk_entry(key)
+
+    def stats_text(self):
+        s = self.stats
+        hits = s["memory_hits"] + s["disk_hits"]
+        return f"命中 {hits} 次（内存 {s['memory_hits']} / 磁盘 {s['disk_hits']}），未命中 {s['misses']} 次"
+
+
+response_cache = ResponseCache(CACHE_DIR)
@@ -0,0 +1,186 @@
+import re
+from bisect import bisect_left
+from .Instrumentation import get_logger
+
+logger = get_logger("LLM_Prompt_Formatter")
+
+
+# 扫描时关心的全部标记：思考块、代码块围栏、<img> 文档边界（<img> 与 IMG_PATTERN 一样不区分大小写）
+_TOKEN_PATTERN = re.compile(r'<think>|</think>|```|(?i:</?img>)')
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+_FENCE = "```"
+_IMG_CLOSE_LEN = len("</img>")
+
+# 修复时最多打印的解析错误条数
+_MAX_REPORTED_ERRORS = 10
+
+
+class ScannedResponse:
+    """
+    scan_response 的结果。status 取值：
+    fenced（代码块中的 XML）、bare（无代码块但有完整 <img>）、truncated（只有 <img> 开头）、missing（没有 <img>）
+    """
+
+    def __init__(self, think_blocks, xml_content, text_content, img_document, status):
+        self.think_blocks = think_blocks
+        self.xml_content = xml_content
+        self.text_content = text_content
+        # xml_content 中第一个完整的 <img>...</img>，没有时为 None
+        self.img_document = img_document
+        self.status = status
+
+
+def _first_after(positions, start, end=None):
+    """positions 有序，返回第一个 >= start（且 < end）的位置，没有时返回 None"""
+    i = bisect_left(positions, start)
+    if i < len(positions) and (end is None or positions[i] < end):
+        return positions[i]
+    return None
+
+
+def scan_response(response):
+    """
+    单遍扫描大模型回复：同时分离 <think> 块、第一个代码块、<img> 文档与其余文字。
+    每个标记只被正则扫描一次；未闭合的 <think> 保留为普通文字，从该位置重新扫描一次其后内容。
+    第一个代码块闭合后结果已经确定，其后的文字（通常是较长的翻译）只需查找 <think>。
+    """
+    pieces = []
+    length = 0
+    think_blocks = []
+    fence_open = None
+    fence = None
+    img_opens = []
+    img_closes = []
+
+    pos = 0
+    allow_think = True
+    think_tag_at = None
+    while True:
+        for token in _TOKEN_PATTERN.finditer(response, pos):
+            tag = token.group(0)
+            if think_tag_at is not None:
+                if tag == _THINK_CLOSE:
+                    think_blocks.append(response[think_tag_at + len(_THINK_OPEN):token.start()])
+                    think_tag_at = None
+                    pos = token.end()
+                continue
+
+            if tag == _THINK_OPEN and not allow_think:
+                continue
+            segment = response[pos:token.start()]
+            pieces.append(segment)
+            length += len(segment)
+            pos = token.end()
+
+            if tag == _THINK_OPEN:
+                think_tag_at = token.start()
+                continue
+            if tag == _FENCE:
+                if fence is None:
+                    if fence_open is None:
+                        fence_open = length
+                    else:
+                        fence = (fence_open, length)
+                        pieces.append(tag)
+                        length += len(tag)
+                        break
+            elif tag[1] == "/":
+                if tag != _THINK_CLOSE:
+                    img_closes.append(length)
+            else:
+                img_opens.append(length)
+            pieces.append(tag)
+            length += len(tag)
+
+        if think_tag_at is None:
+            break
+        # <think> 没有闭合：按普通文字处理，从该标签处继续扫描
+        pos, think_tag_at, allow_think = think_tag_at, None, False
+
+    if fence is not None and allow_think:
+        while True:
+            think_at = response.find(_THINK_OPEN, pos)
+            if think_at == -1:
+                break
+            think_end = response.find(_THINK_CLOSE, think_at + len(_THINK_OPEN))
+            if think_end == -1:
+                break
+            pieces.append(response[pos:think_at])
+            think_blocks.append(response[think_at + len(_THINK_OPEN):think_end])
+            pos = think_end + len(_THINK_CLOSE)
+
+    pieces.append(response[pos:])
+    visible = "".join(pieces)
+
+    if fence is not None:
+        start, end = fence
+        content = visible[start + len(_FENCE):end]
+        if content.startswith("xml"):
+            content = content[3:]
+        xml_content = content.strip()
+        text_content = (visible[:start] + visible[end + len(_FENCE):]).strip()
+        img_document = None
+        img_open = _first_after(img_opens, start, end)
+        if img_open is not None:
+            img_close = _first_after(img_closes, img_open, end)
+            if img_close is not None:
+                img_document = visible[img_open:img_close + _IMG_CLOSE_LEN]
+        return ScannedResponse(think_blocks, xml_content, text_content, img_document, "fenced")
+
+    if img_opens:
+        img_open = img_opens[0]
+        img_close = _first_after(img_closes, img_open)
+        if img_close is not None:
+            last_close = img_closes[-1] + _IMG_CLOSE_LEN
+            xml_content = visible[img_open:last_close]
+            text_content = (visible[:img_open] + visible[last_close:]).strip()
+            img_document = visible[img_open:img_close + _IMG_CLOSE_LEN]
+            return ScannedResponse(think_blocks, xml_content, text_content, img_document, "bare")
+        return ScannedResponse(think_blocks, visible[img_open:], "", None, "truncated")
+
+    return ScannedResponse(think_blocks, visible.strip(), "", None, "missing")
+
+
+def parse_document(xml_string):
+    """
+    只调用一次 lxml：以 recover 模式解析并检查 error_log。
+    没有错误时原样返回字符串；有错误时返回修复后的序列化结果并打印错误位置。
+    返回 (字符串, 根节点)，无法解析时根节点为 None。
+    """
+    if not xml_string.strip():
+        return xml_string, None
+
+    from lxml import etree
+    # 保留空白，得到的树与下游按原文解析的结果一致
+    parser = etree.XMLParser(recover=True)
+    try:
+        root = etree.fromstring(xml_string.encode('utf-8'), parser=parser)
+        failure = "无法解析出任何有效结构"
+    except etree.XMLSyntaxError as e:
+        root = None
+        failure = e
+
+    if root is None:
+        logger.error(f"XML 损坏严重，无法修复！必要时请停止工作流。\n错误详情: {failure}")
+        return xml_string, None
+
+    errors = parser.error_log.filter_from_errors()
+    if not errors:
+        logger.info("已完成xml格式检查，无错误。")
+        return xml_string, root
+
+    logger.warning("检测到xml格式错误，已自动修复。错误如下：")
+    for error in errors[:_MAX_REPORTED_ERRORS]:
+        logger.warning(f"第 {error.line} 行第 {error.column} 列：{error.message}")
+    if len(errors) > _MAX_REPORTED_ERRORS:
+        logger.warning(f"……其余 {len(errors) - _MAX_REPORTED_ERRORS} 条错误已省略")
+
+    # 修复结果与旧版 repair_xml_custom 逐字节一致：去掉空白文本后重新缩进。
+    # 只有格式错误时才多解析一次，返回的树与修复后的字符串对应
+    blank_free = etree.fromstring(xml_string.encode('utf-8'), parser=etree.XMLParser(recover=True, remove_blank_text=True))
+    if blank_free is not None:
+        root = blank_free
+    repaired_xml = etree.tostring(root, encoding='unicode', pretty_print=True).strip()
+    return repaired_xml, root
@@ -0,0 +1,156 @@
+import re
+import json
+from xml.sax.saxutils import escape
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_Structured_Output")
+
+
+DEFAULT_STRUCTURED_OUTPUT_SETTINGS = {
+    "enabled": False,
+    "strict": True,
+}
+
+CHARACTER_FIELDS = ("n", "gender", "appearance", "clothing", "expression", "action", "position")
+GENERAL_FIELDS = ("count", "style", "background", "atmosphere", "quality", "resolution", "artist", "objects", "other")
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+def _string_fields(fields):
+    return {
+        "type": "object",
+        "properties": {name: {"type": "string"} for name in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+# 字段与 <img> 的各个元素一一对应；标签字段为逗号分隔的字符串（比字符串数组少很多引号与逗号 token）
+IMG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "characters": {"type": "array", "items": _string_fields(CHARACTER_FIELDS)},
+        "general_tags": _string_fields(GENERAL_FIELDS),
+        "caption": {"type": "string"},
+        "translation": {"type": "string"},
+    },
+    "required": ["characters", "general_tags", "caption", "translation"],
+    "additionalProperties": False,
+}
+
+# 追加在 system prompt 之后的输出格式说明（固定文本，不影响前缀缓存）
+FORMAT_INSTRUCTIONS = """
+
+# Output Format Override (JSON)
+忽略上文对 XML 代码块与代码块外翻译的要求，只输出一个 JSON 对象，不要使用代码块，不要输出其它文字：
+- `characters`：每个角色一项，字段 `n`、`gender`、`appearance`、`clothing`、`expression`、`action`、`position` 与 `<character_1>` 中的同名元素相同
+- `general_tags`：字段 `count`、`style`、`background`、`atmosphere`、`quality`、`resolution`、`artist`、`objects`、`other` 与 `<general_tags>` 中的同名元素相同
+- `caption`：`<caption>` 的英文描述；`translation`：caption 的中文翻译
+标签字段的值为逗号分隔的标签字符串，标签规范（下划线、括号转义、权重）与上文相同；没有内容的字段填空字符串。"""
+
+# 只支持 json_object 的平台需要在提示词中给出结构示例
+JSON_OBJECT_EXAMPLE = json.dumps({
+    "characters": [{name: "" for name in CHARACTER_FIELDS}],
+    "general_tags": {name: "" for name in GENERAL_FIELDS},
+    "caption": "",
+    "translation": "",
+}, ensure_ascii=False)
+
+
+def resolve_structured_output_settings(config):
+    """合并配置文件中的 structured_output 段与默认值"""
+    settings = dict(DEFAULT_STRUCTURED_OUTPUT_SETTINGS)
+    user_settings = config.get("structured_output", {})
+    if isinstance(user_settings, dict):
+        for name, default in DEFAULT_STRUCTURED_OUTPUT_SETTINGS.items():
+            value = user_settings.get(name, default)
+            try:
+                settings[name] = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning(f"structured_output.{name} 配置无效，已使用默认值 {default}。")
+    return settings
+
+
+def output_format(api_url, model_name, settings):
+    """
+    与 get_platform_settings 相同按 API url 识别平台：
+    OpenAI / OpenRouter / Gemini 支持 json_schema，DeepSeek 只支持 json_object，其余平台仍输出 XML（返回 None）。
+    """
+    if not settings["enabled"]:
+        return None
+    if 'api.openai.com' in api_url or 'openrouter' in api_url or 'googleapis' in api_url:
+        return "json_schema"
+    if 'deepseek' in api_url:
+        return "json_object"
+    return None
+
+
+def format_instructions(fmt):
+    if fmt == "json_object":
+        return f"{FORMAT_INSTRUCTIONS}\n结构示例：{JSON_OBJECT_EXAMPLE}"
+    return FORMAT_INSTRUCTIONS
+
+
+def response_format(fmt, settings):
+    if fmt == "json_schema":
+        return {"type": "json_schema",
+                "json_schema": {"name": "lpf_img", "strict": settings["strict"], "schema": IMG_SCHEMA}}
+    return {"type": "json_object"}
+
+
+def parse_json(content):
+    """解析模型返回的 JSON（兼容被 ```json 代码块包裹的情况），失败时返回 None"""
+    match = _FENCE.match(content)
+    if match:
+        content = match.group(1)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _field(data, name):
+    value = data.get(name) if isinstance(data, dict) else None
+    if isinstance(value, list):
+        value = ", ".join(str(item) for item in value)
+    return value.strip() if isinstance(value, str) else ""
+
+
+def render_img_xml(characters, general, caption):
+    """
+    按 system prompt 规定的结构生成 <img> 文档：characters 为各角色的 {字段: 文本}，general 为 general_tags 的 {字段: 文本}。
+    文本按 XML 转义，空字段省略。
+    """
+    parts = ["<img>\n"]
+    for i, character in enumerate(characters, 1):
+        parts.append(f" <character_{i}>\n")
+        for name in CHARACTER_FIELDS:
+            value = character.get(name)
+            if value:
+                parts.append(f" <{name}>{escape(value)}</{name}>\n")
+        parts.append(f" </character_{i}>\n\n")
+    parts.append(" <general_tags>\n")
+    for name in GENERAL_FIELDS:
+        value = general.get(name)
+        if value:
+            parts.append(f" <{name}>{escape(value)}</{name}>\n")
+    parts.append(" </general_tags>\n\n")
+    parts.append(f" <caption>{escape(caption)}</caption>\n</img>")
+    return "".join(parts)
+
+
+def json_to_xml(data):
+    """把结构化输出转换为 (<img> 文档, 中文翻译)"""
+    characters = []
+    for i, item in enumerate(data.get("characters") or [], 1):
+        if not isinstance(item, dict):
+            continue
+        character = {name: _field(item, name) for name in CHARACTER_FIELDS}
+        character["n"] = character["n"] or f"character_{i}"
+        characters.append(character)
+    general_data = data.get("general_tags")
+    general = {name: _field(general_data, name) for name in GENERAL_FIELDS}
+    return render_img_xml(characters, general, _field(data, "caption")), _field(data, "translation")
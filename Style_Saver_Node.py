@@ -1,16 +1,54 @@
-import json
-import os
 import re
-
-
-class BColors:
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-
-
-CONFIG_FILENAME = "LPF_config.json"
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILENAME)
+import time
+from .Config_Store import config_store
+from .Preset_Store import preset_store
+from .Xml_Document import LPF_XML_TYPE
+from .Instrumentation import get_logger, metrics
+
+logger = get_logger("Style_Saver")
+
+ARTIST_PATTERN = re.compile(r"<(?:artist|artists)>(.*?)</(?:artist|artists)>", re.IGNORECASE | re.DOTALL)
+STYLE_PATTERN = re.compile(r"<(?:style|styles)>(.*?)</(?:style|styles)>", re.IGNORECASE | re.DOTALL)
+
+
+def extract_tags(text_input=None, xml_doc=None):
+    """提取全部 artist / style 标签（逗号分隔、去重并保持顺序），返回 (artist, style) 两个字符串"""
+    if text_input is None and xml_doc is None:
+        raise ValueError("没有可提取的提示词：text_input 与 xml_doc 均为空")
+    root = xml_doc.root if xml_doc is not None else None
+    if root is not None:
+        # 已解析的 LPF_XML 直接遍历树，不再对字符串跑正则
+        all_artists = []
+        all_styles = []
+        for el in root.iter():
+            if not isinstance(el.tag, str):
+                continue
+            tag = el.tag.lower()
+            if tag in ("artist", "artists"):
+                all_artists.append(el.text or "")
+            elif tag in ("style", "styles"):
+                all_styles.append(el.text or "")
+    else:
+        if text_input is None:
+            text_input = xml_doc.to_string()
+        all_artists = ARTIST_PATTERN.findall(text_input)
+        all_styles = STYLE_PATTERN.findall(text_input)
+
+    # 清洗 Artist
+    clean_artists = []
+    for a in all_artists:
+        tags = [t.strip() for t in a.split(',') if t.strip()]
+        clean_artists.extend(tags)
+    final_artist_str = ", ".join(list(dict.fromkeys(clean_artists)))
+
+    # 清洗 Style
+    clean_styles = []
+    for s in all_styles:
+        tags = [t.strip() for t in s.split(',') if t.strip()]
+        clean_styles.extend(tags)
+    final_style_str = ", ".join(list(dict.fromkeys(clean_styles)))
+
+    return final_artist_str, final_style_str
 
 
 class LLM_Style_Saver:
@@ -35,29 +73,26 @@ class LLM_Style_Saver:
     OUTPUT_NODE = True
 
     def save_preset_logic(self, text_input, preset_name, save_trigger):
+        return self.run_saver(preset_name, save_trigger, text_input=text_input)
+
+    def run_saver(self, preset_name, save_trigger, text_input=None, xml_doc=None):
+        run = metrics.start("Style_Saver")
+        metrics.configure(config_store.snapshot().data)
+        try:
+            return self.extract_and_save(run, preset_name, save_trigger, text_input, xml_doc)
+        finally:
+            metrics.finish(run)
+
+    def extract_and_save(self, run, preset_name, save_trigger, text_input=None, xml_doc=None):
+        """提取 artist / style，按需保存为预设；各阶段耗时与结果记录在 run 中"""
         # 提取
-        artist_pattern = r"<(?:artist|artists)>(.*?)</(?:artist|artists)>"
-        style_pattern = r"<(?:style|styles)>(.*?)</(?:style|styles)>"
-
-        all_artists = re.findall(artist_pattern, text_input, re.IGNORECASE | re.DOTALL)
-        all_styles = re.findall(style_pattern, text_input, re.IGNORECASE | re.DOTALL)
-
-        # 清洗 Artist
-        clean_artists = []
-        for a in all_artists:
-            tags = [t.strip() for t in a.split(',') if t.strip()]
-            clean_artists.extend(tags)
-        final_artist_str = ", ".join(list(dict.fromkeys(clean_artists)))
-
-        # 清洗 Style
-        clean_styles = []
-        for s in all_styles:
-            tags = [t.strip() for t in s.split(',') if t.strip()]
-            clean_styles.extend(tags)
-        final_style_str = ", ".join(list(dict.fromkeys(clean_styles)))
+        extract_start = time.perf_counter()
+        final_artist_str, final_style_str = extract_tags(text_input, xml_doc)
 
         # 拼装输出字符串
         extracted_output = f"<artist>{final_artist_str}</artist>\n<style>{final_style_str}</style>"
+        run.add_stage("extract", time.perf_counter() - extract_start)
+        run.status = "extracted"
 
         normalized_name = preset_name.strip()
 
@@ -65,48 +100,63 @@ class LLM_Style_Saver:
         if not save_trigger:
             return (extracted_output,)
 
+        run.status = "skipped"
         if not normalized_name:
-            print(f"{BColors.WARNING}[Style_Saver] 警告：已开启保存但未输入预设名称，未保存。{BColors.ENDC}")
+            logger.warning("警告：已开启保存但未输入预设名称，未保存。")
             return (extracted_output,)
 
         if not final_artist_str and not final_style_str:
-            print(f"{BColors.WARNING}[Style_Saver] 警告：文本中未找到有效标签，未保存。{BColors.ENDC}")
+            logger.warning("警告：文本中未找到有效标签，未保存。")
             return (extracted_output,)
 
-        if not os.path.exists(CONFIG_PATH):
-            print(f"{BColors.FAIL}[Style_Saver] 错误：找不到文件 {CONFIG_PATH}{BColors.ENDC}")
-            return (extracted_output,)
-
-        # 写文件
+        # 写入预设库（只插入一条记录，不改写配置文件）
         try:
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            if "styles" not in data:
-                data["styles"] = {}
+            with run.stage("config_load"):
+                config = config_store.snapshot()
+                existing = preset_store.snapshot(config).styles
 
-            # 重名检查
-            if normalized_name in data["styles"]:
-                print(
-                    f"{BColors.WARNING}[Style_Saver] 提示：预设名称 '{normalized_name}' 已经存在。未保存。{BColors.ENDC}")
+            # 重名检查（包括默认样式与预设库中的预设）
+            if normalized_name in existing:
+                logger.warning(f"提示：预设名称 '{normalized_name}' 已经存在。未保存。")
                 return (extracted_output,)
 
-            # 保存
-            data["styles"][normalized_name] = {
-                "artist": final_artist_str,
-                "style": final_style_str
-            }
-
-            with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # 保存；其他进程可能刚刚保存了同名预设
+            with run.stage("preset_write"):
+                saved = preset_store.save(config, normalized_name, final_artist_str, final_style_str)
+            if not saved:
+                logger.warning(f"提示：预设名称 '{normalized_name}' 已经存在。未保存。")
+                return (extracted_output,)
+            run.status = "saved"
 
-            print(f"[Style_Saver] 成功保存新预设：'{normalized_name}'")
+            logger.info(f"成功保存新预设：'{normalized_name}'")
 
-        except json.JSONDecodeError:
-            print(f"{BColors.FAIL}[Style_Saver] 严重错误：JSON 格式损坏。{BColors.ENDC}")
         except Exception as e:
-            print(f"{BColors.FAIL}[Style_Saver] 未知错误：{e}{BColors.ENDC}")
+            logger.error(f"未知错误：{e}")
+            run.status = "error"
 
         # 4. 无论保存结果如何，都返回提取的内容
         return (extracted_output,)
 
+
+
+class LLM_Style_Saver_Doc(LLM_Style_Saver):
+    """
+    从 LPF_XML 文档中提取并保存风格预设，直接遍历已解析的树，不再对字符串跑正则。
+    与 Style Preset Saver 分成两个节点，已保存的工作流中原节点的输入保持不变。
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "xml_doc": (LPF_XML_TYPE,),
+                "preset_name": ("STRING", {"multiline": False, "default": "", "placeholder": "在这里输入新预设的名称"}),
+                "save_trigger": ("BOOLEAN",
+                                 {"default": False, "label_on": "Save as Styles", "label_off": "Do Not Save"}),
+            },
+        }
+
+    FUNCTION = "save_preset_doc"
+
+    def save_preset_doc(self, xml_doc, preset_name, save_trigger):
+        return self.run_saver(preset_name, save_trigger, xml_doc=xml_doc)
@@ -0,0 +1,385 @@
+import os
+import sys
+import mmap
+import zlib
+import array
+import bisect
+import struct
+import hashlib
+import threading
+
+from .Instrumentation import get_logger
+from .Tag_Formatter import table_paths, read_tag_table, lookup_key, parse_token, Tag
+
+logger = get_logger("LPF_Tag_Dictionary")
+
+
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tags")
+
+DEFAULT_TAG_VALIDATION_SETTINGS = {
+    "enabled": False,
+    "mode": "correct",
+    "max_distance": 2,
+}
+
+VALIDATION_MODES = ("correct", "flag")
+
+# 不是标签列表的元素
+SKIPPED_ELEMENTS = ("n", "caption")
+
+# 对称删除索引只对标签的前若干个字符生成删除变体（SymSpell 的前缀优化），候选项再按完整标签计算编辑距离
+PREFIX_LENGTH = 7
+
+# 文件头：魔数、字节序、条目数、删除变体数、最大编辑距离、前缀长度、字符串区长度
+_MAGIC = b"LPFTAG02"
+_HEADER = struct.Struct("<8sBxxxIIIII")
+_HEADER_SIZE = 40
+# 每个条目 4 个 uint32：字符串偏移、字符串长度、规范标签的条目号（别名指向规范标签）、使用次数
+_ENTRY_INTS = 4
+
+# 未收录的标签的查询结果缓存条数（每个进程）
+_MISS_CACHE_SIZE = 4096
+
+
+def resolve_tag_validation_settings(config):
+    """合并配置文件中的 tag_validation 段与默认值；tables 为用户提供的额外词表路径"""
+    settings = dict(DEFAULT_TAG_VALIDATION_SETTINGS)
+    user_settings = config.get("tag_validation", {})
+    if not isinstance(user_settings, dict):
+        user_settings = {}
+    for name, default in DEFAULT_TAG_VALIDATION_SETTINGS.items():
+        value = user_settings.get(name, default)
+        try:
+            settings[name] = type(default)(value)
+        except (TypeError, ValueError):
+            logger.warning(f"tag_validation.{name} 配置无效，已使用默认值 {default}。")
+    settings["mode"] = settings["mode"].lower()
+    if settings["mode"] not in VALIDATION_MODES:
+        logger.warning(f"未知的 tag_validation.mode 取值 {settings['mode']}，已使用 correct。")
+        settings["mode"] = "correct"
+    settings["max_distance"] = min(3, max(1, settings["max_distance"]))
+
+    tables = user_settings.get("tables", [])
+    if isinstance(tables, str):
+        tables = [tables]
+    settings["tables"] = [path for path in tables if isinstance(path, str) and path.strip()] if isinstance(tables, list) else []
+    # 自带词表只收录常用标签，仅凭它修正会把未收录的正确标签改成相近的常用标签
+    if not settings["tables"]:
+        settings["mode"] = "flag"
+
+    return settings
+
+
+def deletes(word, distance):
+    """word 删除至多 distance 个字符得到的全部变体（含 word 本身）"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))} - variants
+        variants |= frontier
+    return variants
+
+
+def _hash(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def edit_distance(a, b, limit):
+    """限制上界的 Damerau-Levenshtein（相邻换位算一次）距离，超过 limit 时返回 limit + 1"""
+    # 去掉公共前后缀后只剩拼写出错的一小段，再只计算对角线附近宽度为 limit 的带
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a or not b:
+        return max(len(a), len(b))
+
+    over = limit + 1
+    previous2 = None
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= limit else over
+        row_min = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+def max_distance_for(word, max_distance):
+    """短标签（如 v、:d、1boy）只接受很小的改动，避免被改成不相干的标签"""
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 8:
+        return min(1, max_distance)
+    return max_distance
+
+
+def build_index(sources, path, max_distance):
+    """
+    把词表编译为可直接内存映射的索引文件：标签条目表、排序后的标签哈希表与对称删除表
+    （均为 uint64：哈希 << 32 | 条目号，可直接二分查找）以及存放标签文本的字符串区。
+    先写临时文件再替换，多个进程同时构建时互不影响。
+    """
+    entries = {}   # 标签 → [规范标签, 使用次数]
+    for source in sources:
+        for tag, _, post_count, aliases in read_tag_table(source):
+            key = lookup_key(tag)
+            if not key:
+                continue
+            entry = entries.get(key)
+            if entry is None or entry[0] != key:
+                entries[key] = [key, post_count]
+            else:
+                entry[1] = max(entry[1], post_count)
+            for alias in aliases:
+                alias = lookup_key(alias)
+                if alias and alias not in entries:
+                    entries[alias] = [key, 0]
+
+    names = sorted(entries, key=lambda name: name.encode('utf-8'))
+    ids = {name: i for i, name in enumerate(names)}
+    blob = bytearray()
+    table = array.array('I')
+    exact = []
+    removals = set()
+    for i, name in enumerate(names):
+        encoded = name.encode('utf-8')
+        canonical, post_count = entries[name]
+        table.extend((len(blob), len(encoded), ids.get(canonical, i), min(post_count, 0xFFFFFFFF)))
+        blob += encoded
+        exact.append(zlib.crc32(encoded) << 32 | i)
+        removals.update(_hash(variant) << 32 | i for variant in deletes(name[:PREFIX_LENGTH], max_distance))
+    exact = array.array('Q', sorted(exact))
+    removals = array.array('Q', sorted(removals))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, sys.byteorder == "little", len(names), len(removals), max_distance, PREFIX_LENGTH, len(blob)).ljust(_HEADER_SIZE, b"\0"))
+        f.write(table.tobytes())
+        f.write(exact.tobytes())
+        f.write(removals.tobytes())
+        f.write(bytes(blob))
+    os.replace(tmp_path, path)
+    return len(names), len(removals)
+
+
+class TagDictionary:
+    """
+    内存映射的只读标签词典。文件内容由操作系统页缓存共享，多个 ComfyUI 进程打开同一文件时内存占用不随进程数增加；
+    每个进程只保存少量未收录标签的查询结果。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            # 只读映射：页面按需从文件读入，不会在本进程内复制整个索引
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, little, count, removals, max_distance, prefix_length, blob_size = _HEADER.unpack_from(self._mmap, 0)
+        # 条目与删除表按本机字节序写入，直接以 memoryview 读取，不做任何解包或复制
+        if magic != _MAGIC or prefix_length != PREFIX_LENGTH or bool(little) != (sys.byteorder == "little"):
+            self._mmap.close()
+            raise ValueError(f"无法识别的标签索引文件 {path}")
+        self.count = count
+        self.max_distance = max_distance
+        view = memoryview(self._mmap)
+        entries_end = _HEADER_SIZE + count * _ENTRY_INTS * 4
+        exact_end = entries_end + count * 8
+        removals_end = exact_end + removals * 8
+        self._entries = view[_HEADER_SIZE:entries_end].cast('I')
+        self._exact = view[entries_end:exact_end].cast('Q')
+        self._removals = view[exact_end:removals_end].cast('Q')
+        self._blob = view[removals_end:removals_end + blob_size]
+        self._misses = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        for name in ("_entries", "_exact", "_removals", "_blob"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+
+    def _name(self, i):
+        offset = self._entries[i * _ENTRY_INTS]
+        return self._blob[offset:offset + self._entries[i * _ENTRY_INTS + 1]].tobytes()
+
+    def _canonical(self, i):
+        return self._entries[i * _ENTRY_INTS + 2]
+
+    def _post_count(self, i):
+        return self._entries[i * _ENTRY_INTS + 3]
+
+    def find(self, key):
+        """按标签哈希二分查找，返回条目号（未收录时为 None）"""
+        target = key.encode('utf-8')
+        h = zlib.crc32(target)
+        exact = self._exact
+        i = bisect.bisect_left(exact, h << 32)
+        while i < len(exact) and exact[i] >> 32 == h:
+            j = exact[i] & 0xFFFFFFFF
+            if self._name(j) == target:
+                return j
+            i += 1
+        return None
+
+    def lookup(self, tag, max_distance=None):
+        """
+        返回 (规范标签, 编辑距离)：收录的标签距离为 0（别名返回规范标签），
+        未收录时返回编辑距离最小、使用次数最多的近似标签，找不到时为 (None, None)。
+        """
+        key = lookup_key(tag)
+        i = self.find(key)
+        if i is not None:
+            return self._name(self._canonical(i)).decode('utf-8'), 0
+
+        limit = max_distance_for(key, min(self.max_distance, max_distance or self.max_distance))
+        with self._lock:
+            cached = self._misses.get((key, limit))
+        if cached is not None:
+            return cached
+
+        # 按删除层数逐层查找：第 k 层已能找到全部距离不超过 k 的标签，找到后不必再查更深的层
+        best = None
+        seen = set()
+        removals = self._removals
+        variants = {key[:PREFIX_LENGTH]}
+        for level in range(limit + 1 if limit > 0 else 0):
+            for variant in variants:
+                h = _hash(variant)
+                j = bisect.bisect_left(removals, h << 32)
+                while j < len(removals) and removals[j] >> 32 == h:
+                    candidate = removals[j] & 0xFFFFFFFF
+                    j += 1
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    name = self._name(candidate).decode('utf-8')
+                    distance = edit_distance(key, name, limit)
+                    if distance > limit:
+                        continue
+                    canonical = self._canonical(candidate)
+                    rank = (distance, -self._post_count(canonical), name)
+                    if best is None or rank < best[0]:
+                        best = (rank, canonical)
+            if best is not None and best[0][0] <= level:
+                break
+            variants = {variant[:i] + variant[i + 1:] for variant in variants for i in range(len(variant))}
+        result = (None, None) if best is None else (self._name(best[1]).decode('utf-8'), best[0][0])
+        with self._lock:
+            if len(self._misses) >= _MISS_CACHE_SIZE:
+                self._misses.clear()
+            self._misses[(key, limit)] = result
+        return result
+
+
+class TagDictionaryStore:
+    """按词表与参数定位（必要时构建）索引文件，首次校验时才打开"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._signature = None
+        self._dictionary = None
+
+    def get(self, settings):
+        sources = []
+        for path in table_paths(settings["tables"]):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                logger.warning(f"找不到词表 {path}，已跳过。")
+                continue
+            sources.append((path, stat.st_mtime_ns, stat.st_size))
+        signature = (tuple(sources), settings["max_distance"], self.index_dir)
+        with self._lock:
+            if signature == self._signature:
+                return self._dictionary
+            digest = hashlib.sha256(repr(signature[:2] + (PREFIX_LENGTH, _MAGIC)).encode('utf-8')).hexdigest()[:16]
+            path = os.path.join(self.index_dir, f"{digest}.idx")
+            if not os.path.exists(path):
+                logger.info("正在根据词表构建标签索引（只在词表变化后进行一次）...")
+                count, removals = build_index([source[0] for source in sources], path, settings["max_distance"])
+                logger.info(f"标签索引已构建：{count} 个标签与别名，{removals} 个删除变体。")
+                self._cleanup(keep=path)
+            # 旧词典可能仍在其他线程中使用，不主动关闭，由垃圾回收释放映射
+            self._dictionary = TagDictionary(path)
+            self._signature = signature
+            return self._dictionary
+
+    def _cleanup(self, keep):
+        """删除旧词表留下的索引文件（其他进程仍映射着的文件在 POSIX 上可以安全删除）"""
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if name.endswith(".idx") and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def validate_document(xml_doc, dictionary, settings):
+    """
+    检查 <img> 中每个标签字段里的标签是否收录在词典中。
+    correct 模式下把拼写错误与别名替换为规范标签（保留权重与括号转义），flag 模式只报告。
+    返回 (文档, 修正列表 [(原标签, 新标签)], 未收录的标签列表)；有修改时返回修改后的副本。
+    """
+    root = xml_doc.root
+    if root is None:
+        return xml_doc, [], []
+    corrections = []
+    unknown = []
+    changes = {}
+    for position, element in enumerate(root.iter()):
+        if not isinstance(element.tag, str) or element.tag in SKIPPED_ELEMENTS or len(element) or not element.text:
+            continue
+        tokens = [token.strip() for token in element.text.split(",")]
+        changed = False
+        for i, token in enumerate(tokens):
+            if not token:
+                continue
+            raw, weight, explicit_artist = parse_token(token)
+            if not raw:
+                continue
+            name, distance = dictionary.lookup(raw, settings["max_distance"])
+            if name is None:
+                unknown.append(token)
+                continue
+            if distance == 0 and name == lookup_key(raw):
+                continue
+            replacement = Tag(name, weight).render()
+            if explicit_artist:
+                replacement = f"artist:{replacement}"
+            corrections.append((token, replacement))
+            if settings["mode"] == "correct":
+                tokens[i] = replacement
+                changed = True
+        if changed:
+            changes[position] = ", ".join(token for token in tokens if token)
+
+    if not changes:
+        return xml_doc, corrections, unknown
+    doc = xml_doc.clone()
+    for position, element in enumerate(doc.root.iter()):
+        if position in changes:
+            element.text = changes[position]
+    return doc, corrections, unknown
+
+
+tag_dictionaries = TagDictionaryStore(INDEX_DIR)
@@ -0,0 +1,370 @@
+import os
+import re
+import csv
+import threading
+
+from .Instrumentation import get_logger
+from .Structured_Output import render_img_xml
+
+logger = get_logger("LPF_Tag_Formatter")
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLED_TABLE = os.path.join(PACKAGE_DIR, "tags", "lpf_tags.csv")
+
+DEFAULT_TAG_FORMATTER_SETTINGS = {
+    "enabled": False,
+    "min_known_ratio": 0.8,
+    "quality": "very_aesthetic, masterpiece, no_text",
+    "resolution": "max_high_resolution",
+    "default_style": "anime_style,realistic_shading",
+    "default_artist": "rella,maccha_(mochancc),tidsean,wlop,ciloranko,atdan,year 2024",
+}
+
+CHARACTER_SECTIONS = ("gender", "appearance", "clothing", "expression", "action", "position")
+GENERAL_SECTIONS = ("count", "style", "background", "atmosphere", "quality", "resolution", "artist", "objects", "other")
+SECTIONS = CHARACTER_SECTIONS + GENERAL_SECTIONS + ("character", "copyright")
+
+# a1111-sd-webui-tagcomplete 等使用的 Danbooru 分类编号
+DANBOORU_CATEGORIES = {"0": "other", "1": "artist", "3": "copyright", "4": "character", "5": "other"}
+
+# 词表中没有（或只归入 other）的通用标签按后缀/前缀粗分
+_SUFFIX_RULES = (
+    (("_hair", "_eyes", "_ears", "_tail", "_horns", "_wings", "_breasts", "_skin", "_pupils", "_bangs", "_braid"), "appearance"),
+    (("_dress", "_skirt", "_shirt", "_jacket", "_coat", "_uniform", "_thighhighs", "_socks", "_pantyhose", "_shoes",
+      "_boots", "_gloves", "_hat", "_sleeves", "_ribbon", "_bow", "_swimsuit", "_bikini", "_kimono", "_hair_ornament"), "clothing"),
+    (("_background", "_sky"), "background"),
+)
+_PREFIX_RULES = (
+    (("holding_", "looking_", "hand_on_", "hands_on_", "arms_", "leaning_"), "action"),
+)
+
+# 不同人数的标签：输入里出现这些时需要把特征分配给多个角色，交给 LLM 处理
+_MULTI_CHARACTER = re.compile(r"^(?:[2-9]|\d{2,}|6\+)(?:girls|boys|others)$|^multiple_(?:girls|boys|others)$")
+
+_CJK = re.compile(r"[぀-ヿ㐀-鿿가-힯＀-￯]")
+_WEIGHT = re.compile(r"^\((.+):(\d+(?:\.\d+)?)\)$")
+_BARE_WEIGHT = re.compile(r"^(.+):(\d+(?:\.\d+)?)$")
+_ESCAPED_PAREN = re.compile(r"\\([()])")
+_WORD = re.compile(r"[a-z]{2}")
+
+_index_lock = threading.Lock()
+_index_cache = {}
+
+
+def resolve_tag_formatter_settings(config):
+    """合并配置文件中的 tag_formatter 段与默认值；tables 为用户提供的额外词表路径"""
+    settings = dict(DEFAULT_TAG_FORMATTER_SETTINGS)
+    user_settings = config.get("tag_formatter", {})
+    if not isinstance(user_settings, dict):
+        user_settings = {}
+    for name, default in DEFAULT_TAG_FORMATTER_SETTINGS.items():
+        value = user_settings.get(name, default)
+        try:
+            settings[name] = type(default)(value)
+        except (TypeError, ValueError):
+            logger.warning(f"tag_formatter.{name} 配置无效，已使用默认值 {default}。")
+    settings["min_known_ratio"] = min(1.0, max(0.0, settings["min_known_ratio"]))
+
+    tables = user_settings.get("tables", [])
+    if isinstance(tables, str):
+        tables = [tables]
+    settings["tables"] = [path for path in tables if isinstance(path, str) and path.strip()] if isinstance(tables, list) else []
+    return settings
+
+
+def table_paths(tables):
+    """自带词表在前，其后为用户词表（相对路径以插件目录为基准）"""
+    paths = [BUNDLED_TABLE]
+    for path in tables:
+        path = os.path.expanduser(path.strip())
+        paths.append(path if os.path.isabs(path) else os.path.join(PACKAGE_DIR, path))
+    return paths
+
+
+def lookup_key(tag):
+    """词表与输入统一为小写、下划线、不转义括号的形式"""
+    return _ESCAPED_PAREN.sub(r"\1", tag.strip().lower().replace(" ", "_"))
+
+
+class TagIndex:
+    """标签 → 分区的索引，别名指向规范标签名"""
+
+    def __init__(self):
+        self.sections = {}
+        self.aliases = {}
+
+    def add(self, tag, section, aliases=()):
+        key = lookup_key(tag)
+        if not key:
+            return
+        # 后加载的词表覆盖先加载的，但笼统的 other 不覆盖已有的具体分区（如 Danbooru 通用标签）
+        if section != "other" or self.sections.get(key, "other") == "other":
+            self.sections[key] = section
+        for alias in aliases:
+            alias = lookup_key(alias)
+            if alias and alias != key and alias not in self.sections:
+                self.aliases.setdefault(alias, key)
+
+    def lookup(self, tag):
+        """返回 (规范标签名, 分区)；未收录时分区为 None"""
+        key = lookup_key(tag)
+        key = self.aliases.get(key, key)
+        section = self.sections.get(key)
+        if section in (None, "other"):
+            guessed = _guess_section(key)
+            if guessed is not None:
+                section = guessed
+        return key, section
+
+    def load_csv(self, path):
+        count = 0
+        for tag, section, _, aliases in read_tag_table(path):
+            self.add(tag, section, aliases)
+            count += 1
+        return count
+
+
+def read_tag_table(path):
+    """
+    逐行读取 CSV 词表：tag,category[,post_count[,"alias1,alias2"]]，产出 (tag, 分区, 使用次数, 别名)。
+    category 为分区名，或 Danbooru 分类编号（a1111 tagcomplete 的 danbooru.csv 可直接使用）。
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith("#") or row[0] == "tag":
+                continue
+            category = row[1].strip().lower()
+            section = DANBOORU_CATEGORIES.get(category, category)
+            if section not in SECTIONS:
+                continue
+            try:
+                post_count = int(row[2]) if len(row) > 2 and row[2].strip() else 0
+            except ValueError:
+                post_count = 0
+            aliases = [alias for alias in row[3].split(",") if alias.strip()] if len(row) > 3 else []
+            yield row[0], section, post_count, aliases
+
+
+def _guess_section(key):
+    for suffixes, section in _SUFFIX_RULES:
+        if key.endswith(suffixes):
+            return section
+    for prefixes, section in _PREFIX_RULES:
+        if key.startswith(prefixes):
+            return section
+    return None
+
+
+def load_tag_index(settings):
+    """按词表路径与修改时间缓存索引，词表更新后自动重新加载"""
+    signature = []
+    for path in table_paths(settings["tables"]):
+        try:
+            signature.append((path, os.path.getmtime(path)))
+        except OSError:
+            logger.warning(f"找不到词表 {path}，已跳过。")
+    signature = tuple(signature)
+    with _index_lock:
+        index = _index_cache.get(signature)
+        if index is not None:
+            return index
+        index = TagIndex()
+        for path, _ in signature:
+            try:
+                count = index.load_csv(path)
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                logger.warning(f"读取词表 {path} 失败: {e}")
+                continue
+            logger.debug(f"已加载词表 {path}（{count} 个标签）")
+        _index_cache.clear()
+        _index_cache[signature] = index
+        return index
+
+
+class Tag:
+    """输入中的一个标签：name 为规范名（未转义），weight 为权重字符串（无权重时为 None）"""
+
+    def __init__(self, name, weight=None):
+        self.name = name
+        self.weight = weight
+
+    def render(self):
+        """标签名内的括号转义；权重括号包裹整个标签，不转义"""
+        name = self.name.replace("(", r"\(").replace(")", r"\)")
+        if self.weight is not None:
+            return f"({name}:{self.weight})"
+        return name
+
+    def words(self):
+        """供 caption 使用的自然语言形式；颜文字类标签（如 >_<）返回空串"""
+        if not _WORD.search(self.name):
+            return ""
+        return self.name.replace("_", " ")
+
+
+def split_tags(text):
+    """按逗号与换行拆分；包在同一对括号里的多个标签也随之拆开，残留的括号由 parse_token 处理"""
+    return [part.strip() for part in re.split(r"[,\n]", text) if part.strip()]
+
+
+def parse_token(token):
+    """
+    解析一个输入片段，返回 (标签原文, 权重, 是否显式指定画师)。
+    (tag:1.2) 保留权重；拆分组合后残留的未配对括号与已转义的括号一并处理。
+    """
+    token = token.strip()
+    weight = None
+    match = _WEIGHT.match(token)
+    if match:
+        token, weight = match.group(1).strip(), match.group(2)
+    else:
+        # 组合拆解后残留的左右括号：(red eyes, blue hair:1.2) → "(red eyes" 与 "blue hair:1.2)"
+        unescaped = _ESCAPED_PAREN.sub("", token)
+        if unescaped.count("(") > unescaped.count(")") and token.startswith("("):
+            token = token[1:].strip()
+        elif unescaped.count(")") > unescaped.count("(") and token.endswith(")") and not token.endswith(r"\)"):
+            token = token[:-1].strip()
+            match = _BARE_WEIGHT.match(token)
+            if match:
+                token, weight = match.group(1).strip(), match.group(2)
+        elif token.startswith("(") and token.endswith(")") and not token.endswith(r"\)"):
+            # 无权重的强调括号
+            token = token[1:-1].strip()
+    explicit_artist = False
+    if token.lower().startswith("artist:"):
+        token = token[len("artist:"):].strip()
+        explicit_artist = True
+    return token, weight, explicit_artist
+
+
+class LocalFormatResult:
+    """成功时 xml 为 <img> 文档；无法本地处理时 xml 为 None，reason 为回退到 LLM 的原因"""
+
+    def __init__(self, xml=None, reason=None):
+        self.xml = xml
+        self.reason = reason
+
+
+def classify(user_text, settings, index):
+    """
+    把纯标签输入分入各个分区，返回 ({分区: [Tag]}, None)；
+    输入不是纯标签或包含多个角色时返回 (None, 原因)。
+    """
+    if _CJK.search(user_text):
+        return None, "输入包含中日韩文字"
+    tokens = split_tags(user_text)
+    if not tokens:
+        return None, "输入为空"
+
+    sections = {name: [] for name in SECTIONS}
+    seen = set()
+    known = 0
+    for token in tokens:
+        raw, weight, explicit_artist = parse_token(token)
+        if not raw:
+            continue
+        name, section = index.lookup(raw)
+        if explicit_artist:
+            section = "artist"
+        if section is None:
+            if len(raw.replace("_", " ").split()) > 3 or raw.endswith((".", "!", "?")):
+                return None, f"“{raw}”像是句子而不是标签"
+            section = "other"
+        else:
+            known += 1
+        if name in seen:
+            continue
+        seen.add(name)
+        sections[section].append(Tag(name, weight))
+
+    total = len(seen)
+    ratio = known / total if total else 0.0
+    if ratio < settings["min_known_ratio"]:
+        return None, f"词表只识别了 {known}/{total} 个标签（低于 min_known_ratio {settings['min_known_ratio']}）"
+    if len(sections["gender"]) > 1 or len(sections["character"]) > 1 or \
+            any(_MULTI_CHARACTER.match(tag.name) for tag in sections["count"]):
+        return None, "输入包含多个角色"
+    return sections, None
+
+
+def _join(tags):
+    return ", ".join(tag.render() for tag in tags)
+
+
+def _phrase(tags):
+    words = [words for words in (tag.words() for tag in tags) if words]
+    if len(words) <= 1:
+        return "".join(words)
+    return ", ".join(words[:-1]) + " and " + words[-1]
+
+
+_SUBJECTS = {"1girl": ("A girl", "She"), "1boy": ("A boy", "He"), "1other": ("A character", "They")}
+
+
+def build_caption(sections):
+    """按固定模板把标签组织成英文描述（不提及画风与画质）"""
+    gender = sections["gender"][0].name if sections["gender"] else None
+    subject, pronoun = _SUBJECTS.get(gender, (None, None))
+    if subject is None and (sections["appearance"] or sections["clothing"] or sections["character"]):
+        subject, pronoun = "A character", "They"
+    verb = "are" if pronoun == "They" else "is"
+
+    sentences = []
+    if subject is not None:
+        sentence = subject
+        if sections["character"]:
+            sentence += f", {sections['character'][0].words()},"
+        if sections["appearance"]:
+            sentence += f" with {_phrase(sections['appearance'])}"
+        if sections["clothing"]:
+            sentence += f", wearing {_phrase(sections['clothing'])}"
+        sentences.append(sentence + ".")
+        details = []
+        if sections["action"]:
+            details.append(_phrase(sections["action"]))
+        if sections["expression"]:
+            details.append(f"with a {_phrase(sections['expression'])} expression")
+        if sections["position"]:
+            details.append(f"framed as {_phrase(sections['position'])}")
+        if details:
+            sentences.append(f"{pronoun} {verb} " + ", ".join(details) + ".")
+    if sections["objects"]:
+        sentences.append(f"The scene includes {_phrase(sections['objects'])}.")
+    if sections["background"]:
+        sentences.append(f"The background shows {_phrase(sections['background'])}.")
+    if sections["atmosphere"]:
+        sentences.append(f"The mood is {_phrase(sections['atmosphere'])}.")
+    return " ".join(sentences)
+
+
+def build_xml(sections, settings):
+    """按 system prompt 规定的 <img> 结构生成 XML；空的分区省略，quality / resolution / style / artist 按规则填充"""
+    characters = []
+    if any(sections[section] for section in CHARACTER_SECTIONS + ("character",)):
+        character = {section: _join(sections[section]) for section in CHARACTER_SECTIONS}
+        character["n"] = sections["character"][0].render() if sections["character"] else "character_1"
+        characters.append(character)
+
+    general = {section: _join(sections[section]) for section in GENERAL_SECTIONS}
+    if not general["count"] and sections["gender"]:
+        general["count"] = _join(sections["gender"])
+    if sections["copyright"]:
+        general["other"] = ", ".join(filter(None, [_join(sections["copyright"]), general["other"]]))
+    # quality 与 resolution 为固定值，用户额外给出的同类标签附在其后；style / artist 未指定时使用默认值
+    for section in ("quality", "resolution"):
+        fixed = [tag.strip() for tag in settings[section].split(",") if tag.strip()]
+        extra = [tag for tag in sections[section] if tag.name not in fixed]
+        general[section] = ", ".join(filter(None, [", ".join(fixed), _join(extra)]))
+    general["style"] = general["style"] or settings["default_style"]
+    general["artist"] = general["artist"] or settings["default_artist"]
+    return render_img_xml(characters, general, build_caption(sections))
+
+
+def format_tags(user_text, settings):
+    """尝试在本地把纯标签输入整理为 <img> XML，不调用 LLM"""
+    index = load_tag_index(settings)
+    sections, reason = classify(user_text, settings, index)
+    if sections is None:
+        return LocalFormatResult(reason=reason)
+    return LocalFormatResult(xml=build_xml(sections, settings))
@@ -0,0 +1,102 @@
+import re
+import copy
+import threading
+
+from .Instrumentation import get_logger
+
+logger = get_logger("LPF_XML")
+
+
+# 节点之间传递的自定义 ComfyUI 类型
+LPF_XML_TYPE = "LPF_XML"
+
+IMG_PATTERN = re.compile(r'(<img>.*?</img>)', re.DOTALL | re.IGNORECASE)
+
+
+def parse_img_root(xml_content):
+    """以 recover 模式解析 <img> 文档，失败时返回 None"""
+    from lxml import etree
+    parser = etree.XMLParser(recover=True, encoding='utf-8')
+    return etree.fromstring(xml_content.encode('utf-8'), parser=parser)
+
+
+class LPFXmlDocument:
+    """
+    在节点之间传递的已解析提示词：header（gemma_prompt 等前缀文字）+ <img> 的 lxml 树。
+    解析与序列化都是惰性的：从字符串构造时首次访问 root 才解析，
+    修改树之后首次需要字符串时才序列化，长链路中只解析一次、序列化一次。
+    """
+
+    def __init__(self, header="", root=None, text=None):
+        self.header = header or ""
+        self._root = root
+        self._text = text
+        self._source = None
+        self._builder = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_string(cls, text):
+        """包装已有的字符串，不立即解析"""
+        doc = cls(text=text)
+        doc._source = text
+        return doc
+
+    @classmethod
+    def from_builder(cls, text, builder):
+        """
+        已知序列化结果的文档：to_string() 直接返回 text，首次访问 root 时才调用 builder() 构造树，
+        下游只使用字符串时不必为每个输出复制一棵树
+        """
+        doc = cls(text=text)
+        doc._builder = builder
+        return doc
+
+    @property
+    def root(self):
+        """<img> 根节点；文本中没有 <img> 或无法解析时为 None。请勿直接修改，先 clone()"""
+        with self._lock:
+            if self._source is not None:
+                source, self._source = self._source, None
+                match = IMG_PATTERN.search(source)
+                if match:
+                    self.header = source[:match.start()]
+                    try:
+                        self._root = parse_img_root(match.group(1))
+                    except Exception as e:
+                        logger.error(f"XML 解析失败: {e}")
+                        self._root = None
+            if self._builder is not None:
+                builder, self._builder = self._builder, None
+                self.header, self._root = builder()
+            return self._root
+
+    def clone(self):
+        """返回可修改的副本（深拷贝树），原文档保持不变以免影响 ComfyUI 缓存的输出"""
+        root = self.root
+        return LPFXmlDocument(self.header.strip(), copy.deepcopy(root) if root is not None else None)
+
+    def to_string(self):
+        """按需序列化为字符串，结果会被缓存"""
+        with self._lock:
+            if self._text is None:
+                if self._root is None:
+                    self._text = self.header
+                else:
+                    from lxml import etree
+                    xml = etree.tostring(self._root, encoding='unicode', method='xml', pretty_print=True)
+                    header = self.header.strip()
+                    self._text = f"{header}\n{xml}" if header else xml
+            return self._text
+
+    def __str__(self):
+        return self.to_string()
+
+
+def as_document(xml_doc=None, xml_string=None):
+    """节点输入的统一入口：优先使用 LPF_XML，其次包装字符串"""
+    if xml_doc is not None:
+        return xml_doc
+    if xml_string is not None:
+        return LPFXmlDocument.from_string(xml_string)
+    return None
@@ -1,17 +1,35 @@
-from .LLM_Node import LLM_Prompt_Formatter
-from .LLM_Style_Node import LLM_Xml_Style_Injector
-from .Style_Saver_Node import LLM_Style_Saver
+from .LLM_Node import LLM_Prompt_Formatter, LLM_Batch_Prompt_Formatter, LLM_Prompt_Fanout, prefetch_on_prompt
+from .LLM_Style_Node import LLM_Xml_Style_Injector, LLM_Xml_Style_Injector_Doc, LLM_Xml_Style_Sweep
+from .Style_Saver_Node import LLM_Style_Saver, LLM_Style_Saver_Doc
+from .Preset_Routes import register_routes
+from .Prefetch import register_prefetch
 
 NODE_CLASS_MAPPINGS = {
     "LLM_Prompt_Formatter": LLM_Prompt_Formatter,
+    "LLM_Batch_Prompt_Formatter": LLM_Batch_Prompt_Formatter,
+    "LLM_Prompt_Fanout": LLM_Prompt_Fanout,
     "LLM_Xml_Style_Injector": LLM_Xml_Style_Injector,
-    "LLM_Style_Saver": LLM_Style_Saver
+    "LLM_Xml_Style_Injector_Doc": LLM_Xml_Style_Injector_Doc,
+    "LLM_Xml_Style_Sweep": LLM_Xml_Style_Sweep,
+    "LLM_Style_Saver": LLM_Style_Saver,
+    "LLM_Style_Saver_Doc": LLM_Style_Saver_Doc
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "LLM_Prompt_Formatter": "LLM Xml Prompt Formatter",
+    "LLM_Batch_Prompt_Formatter": "LLM Xml Prompt Formatter (Batch)",
+    "LLM_Prompt_Fanout": "LLM Xml Prompt Formatter (Fan-out)",
     "LLM_Xml_Style_Injector": "XML Style Injector",
-    "LLM_Style_Saver": "Style Preset Saver"
+    "LLM_Xml_Style_Injector_Doc": "XML Style Injector (LPF_XML)",
+    "LLM_Xml_Style_Sweep": "XML Style Injector (Sweep)",
+    "LLM_Style_Saver": "Style Preset Saver",
+    "LLM_Style_Saver_Doc": "Style Preset Saver (LPF_XML)"
 }
 
-__all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS"]
+# 前端扩展：预设检索与编辑（web/lpf_presets.js）
+WEB_DIRECTORY = "./web"
+
+register_routes()
+register_prefetch(prefetch_on_prompt)
+
+__all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS", "WEB_DIRECTORY"]
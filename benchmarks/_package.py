@@ -0,0 +1,20 @@
+import os
+import sys
+import types
+import importlib
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "lpf_bench_package"
+
+
+def load_module(name):
+    """
+    在 ComfyUI 之外导入插件中的模块（如 "LLM_Node"）。
+    插件目录名不一定是合法的包名，且模块之间使用相对导入，
+    因此注册一个不执行 __init__.py 的空包，再按子模块导入。
+    """
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
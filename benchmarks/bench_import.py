@@ -0,0 +1,114 @@
+"""
+导入耗时基准：在全新的 Python 进程中按 ComfyUI 的方式加载插件（执行 __init__.py），
+测量注册节点与首次调用 INPUT_TYPES 的耗时，并列出此时已被加载的重量级依赖。
+
+用法：python benchmarks/bench_import.py [--repeat 5] [--importtime]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from _package import PACKAGE_DIR
+
+# 节点注册时不应加载的依赖（首次执行节点时才需要）
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "lxml", "numpy", "PIL")
+
+PROBE = r"""
+import os, sys, json, time, importlib.util
+package_dir = sys.argv[1]
+heavy = sys.argv[2].split(",")
+preloaded = [name for name in heavy if name in sys.modules]
+
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("lpf_import_probe", os.path.join(package_dir, "__init__.py"),
+                                              submodule_search_locations=[package_dir])
+module = importlib.util.module_from_spec(spec)
+sys.modules["lpf_import_probe"] = module
+spec.loader.exec_module(module)
+import_s = time.perf_counter() - start
+
+start = time.perf_counter()
+for node in module.NODE_CLASS_MAPPINGS.values():
+    node.INPUT_TYPES()
+first_input_types_s = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range(100):
+    for node in module.NODE_CLASS_MAPPINGS.values():
+        node.INPUT_TYPES()
+repeat_input_types_s = (time.perf_counter() - start) / 100
+
+print(json.dumps({
+    "import_s": import_s,
+    "first_input_types_s": first_input_types_s,
+    "repeat_input_types_s": repeat_input_types_s,
+    "heavy_loaded": [name for name in heavy if name in sys.modules and name not in preloaded],
+}))
+"""
+
+
+def probe_once(importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", PROBE, PACKAGE_DIR, ",".join(HEAVY_MODULES)]
+    # 节点注册时的控制台输出（如配置缺失的警告）不计入结果
+    completed = subprocess.run(cmd, capture_output=True, text=True, cwd=PACKAGE_DIR, timeout=120)
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入失败：\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if importtime:
+        result["importtime"] = completed.stderr
+    return result
+
+
+def top_imports(importtime_log, limit):
+    """-X importtime 输出中累计耗时最长的模块"""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # 表头
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(cumulative / 1000, 2), "self_ms": round(self_us / 1000, 2)}
+            for cumulative, self_us, name in rows[:limit]]
+
+
+def run(repeat):
+    samples = [probe_once() for _ in range(repeat)]
+    ms = lambda key: round(statistics.median(sample[key] for sample in samples) * 1000, 3)
+    return {
+        "repeat": repeat,
+        "import_ms": ms("import_s"),
+        "first_input_types_ms": ms("first_input_types_s"),
+        "repeat_input_types_ms": ms("repeat_input_types_s"),
+        "heavy_loaded_at_registration": samples[-1]["heavy_loaded"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="额外输出 -X importtime 中最慢的模块")
+    args = parser.parse_args(argv)
+
+    result = run(args.repeat)
+    print(f"注册节点（执行 __init__.py）: {result['import_ms']} ms（中位数，{args.repeat} 次）")
+    print(f"首次 INPUT_TYPES（全部节点）: {result['first_input_types_ms']} ms")
+    print(f"再次 INPUT_TYPES（全部节点）: {result['repeat_input_types_ms']} ms")
+    heavy = result["heavy_loaded_at_registration"]
+    print(f"注册时加载的重量级依赖: {', '.join(heavy) if heavy else '无'}")
+    if args.importtime:
+        log = probe_once(importtime=True)["importtime"]
+        for row in top_imports(log, 15):
+            print(f"  {row['cumulative_ms']:>9.2f} ms  {row['module']}")
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
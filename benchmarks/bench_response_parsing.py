@@ -0,0 +1,203 @@
+"""
+回复解析基准：对比单遍扫描器（Response_Parser）与旧版正则级联的耗时与输出。
+
+用法：python benchmarks/bench_response_parsing.py [--repeat 200]
+"""
+import io
+import re
+import sys
+import time
+import difflib
+import argparse
+import contextlib
+
+from lxml import etree
+
+from _package import load_module
+
+HEADER = "You are an assistant designed to generate anime images based on xml format textual prompts.  <Prompt Start>"
+
+IMG_DOCUMENT = """<img>
+  <character_1>
+  <n>A</n>
+  <gender>1girl</gender>
+  <appearance>loli, blonde_hair:1.2, hair_between_eyes, short_hair, ahoge, twintails, short_tail, sidelocks, low_twintails, hairclip</appearance>
+  <clothing>short_kimono, white_socks, frilled_socks, converse, sash, red_sash, fingerless_gloves, haori, shorts_under_skirt, leg_belt</clothing>
+  <expression>serious, focused</expression>
+  <action>wearing_headset, commanding, pointing_at_hologram</action>
+  <position>left_side</position>
+  </character_1>
+
+  <character_2>
+  <n>B</n>
+  <gender>1girl</gender>
+  <appearance>white_hair, high_ponytail, sidelocks</appearance>
+  <clothing>white_serafuku, short_sleeves, short_skirt, shirt_tucked_in, knee_pads, elbow_pads, fingerless_gloves, white_legwear, kneehighs, high-top_hiking_sneakers, shorts_under_skirt, tactical_vest, helmet</clothing>
+  <expression>determined, focused</expression>
+  <action>holding_sniper_rifle, aiming, in_combat_stance</action>
+  <position>right_side</position>
+  </character_2>
+
+  <general_tags>
+  <count>2girls</count>
+  <style>anime_style, oil_painting_style</style>
+  <background>sci-fi_command_center, holographic_displays, tactical_map, futuristic_technology</background>
+  <atmosphere>tense, strategic</atmosphere>
+  <lighting>dramatic_lighting, neon_glow</lighting>
+  <quality>very_aesthetic, masterpiece, no_text</quality>
+  <resolution>max_high_resolution</resolution>
+  <artist>rella,maccha_\\(mochancc\\),tidsean,wlop,ciloranko,atdan,year 2024</artist>
+  <objects>headset, sniper_rifle, tactical_gear, holograms</objects>
+  </general_tags>
+
+  <caption>In a futuristic sci-fi command center with glowing holographic displays and tactical maps, two girls are shown in different roles.</caption>
+</img>"""
+
+TRANSLATION = "画面描绘了一个未来科幻风格的指挥中心，充满全息显示屏和战术地图的蓝光投影。两个场景通过戏剧性的霓虹灯光效完美融合。"
+THINKING = "<think>用户想要两个角色分别位于画面左右两侧，先整理外观标签，再补充背景与光照。" * 20 + "</think>"
+
+
+def build_corpus():
+    """真实格式的回复与常见的损坏形式"""
+    fenced = f"```xml\n{IMG_DOCUMENT}\n```\n\n{TRANSLATION}"
+    malformed = IMG_DOCUMENT.replace("</expression>", "", 1).replace("</character_2>", "") \
+        .replace("tactical_map", "tactical_map & radar")
+    return {
+        "fenced": fenced,
+        "think_fenced": f"{THINKING}\n{fenced}",
+        "bare": f"以下是提示词：\n{IMG_DOCUMENT}\n{TRANSLATION}",
+        "malformed_fenced": f"```xml\n{malformed}\n```\n{TRANSLATION}",
+        "malformed_bare": f"{malformed}\n{TRANSLATION}",
+        "truncated": f"```xml\n{IMG_DOCUMENT[:len(IMG_DOCUMENT) // 2]}",
+        "missing": f"抱歉，我无法完成这个请求。{TRANSLATION}",
+        "long_text": f"```xml\n{IMG_DOCUMENT}\n```\n" + TRANSLATION * 200,
+    }
+
+
+# ---- 旧版实现（1.2.0 的 process_text 解析部分、clean_prompt 与 repair_xml_custom），仅用于对比 ----
+
+def legacy_repair_xml_custom(xml_string):
+    if not xml_string.strip():
+        return xml_string
+
+    strict_parser = etree.XMLParser(remove_blank_text=True)
+    recover_parser = etree.XMLParser(recover=True, remove_blank_text=True)
+
+    try:
+        etree.fromstring(xml_string.encode('utf-8'), parser=strict_parser)
+        print("[LLM_Prompt_Formatter]:已完成xml格式检查，无错误。")
+        return xml_string
+    except etree.XMLSyntaxError:
+        try:
+            root = etree.fromstring(xml_string.encode('utf-8'), parser=recover_parser)
+            if root is None:
+                raise ValueError("无法解析出任何有效结构")
+
+            repaired_xml = etree.tostring(
+                root,
+                encoding='unicode',
+                pretty_print=True,
+                xml_declaration=False
+            ).strip()
+
+            orig_lines = [line.strip() for line in xml_string.splitlines() if line.strip()]
+            new_lines = [line.strip() for line in repaired_xml.splitlines() if line.strip()]
+            diff = difflib.unified_diff(orig_lines, new_lines, fromfile='Original', tofile='Repaired', lineterm='', n=0)
+            for line in diff:
+                if line.startswith(('+', '-')) and not line.startswith(('+++', '---')):
+                    print(line)
+            return repaired_xml
+
+        except Exception as e:
+            print(f"XML 损坏严重，无法修复！错误详情: {e}")
+            return xml_string
+
+
+def legacy_clean_prompt(xml_content, gemma_prompt):
+    match = re.search(r'(<img>.*?</img>)', xml_content, re.DOTALL | re.IGNORECASE)
+    if not match:
+        return legacy_repair_xml_custom(xml_content)
+    xml_part = legacy_repair_xml_custom(match.group(1))
+    return f"{gemma_prompt}\n{xml_part}"
+
+
+def legacy_parse(full_response, gemma_prompt):
+    match = re.search(r'<think>(.*?)</think>', full_response, re.DOTALL)
+    if match:
+        print(match.group(1))
+        full_response = re.sub(r'<think>(.*?)</think>', "", full_response, flags=re.DOTALL)
+        full_response = full_response.strip()
+
+    match = re.search(r"```(?:xml)?\s*(.*?)\s*```", full_response, re.DOTALL)
+    if match:
+        xml_content = match.group(1).strip()
+        text_content = full_response.replace(match.group(0), "").strip()
+    else:
+        if "<img>" in full_response and "</img>" in full_response:
+            start = full_response.find("<img>")
+            end = full_response.rfind("</img>") + 6
+            xml_content = full_response[start:end]
+            text_content = full_response[:start] + full_response[end:]
+        elif "<img>" in full_response:
+            start = full_response.find("<img>")
+            xml_content = full_response[start:]
+            text_content = ""
+        else:
+            xml_content = full_response
+            text_content = ""
+
+    return (legacy_clean_prompt(xml_content, gemma_prompt), text_content)
+
+
+def time_call(fn, repeat):
+    """返回每次调用的平均耗时（微秒）；控制台输出被丢弃，避免打印本身影响计时"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        elapsed = time.perf_counter() - start
+    return elapsed / repeat * 1e6
+
+
+def run(repeat):
+    LLM_Node = load_module("LLM_Node")
+    LLM_Completion = load_module("LLM_Completion")
+    formatter = LLM_Node.LLM_Prompt_Formatter()
+
+    def current_parse(response):
+        result = LLM_Completion.CompletionResult(content=response)
+        return formatter.parse_completion(result, False, HEADER)[:2]
+
+    rows = []
+    for name, response in build_corpus().items():
+        legacy_us = time_call(lambda: legacy_parse(response, HEADER), repeat)
+        current_us = time_call(lambda: current_parse(response), repeat)
+        with contextlib.redirect_stdout(io.StringIO()):
+            same_text = legacy_parse(response, HEADER)[1].strip() == current_parse(response)[1]
+        rows.append({
+            "case": name,
+            "bytes": len(response.encode('utf-8')),
+            "legacy_us": round(legacy_us, 1),
+            "current_us": round(current_us, 1),
+            "speedup": round(legacy_us / current_us, 2) if current_us else None,
+            "same_text_out": same_text,
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rows = run(args.repeat)
+    print(f"{'case':<18}{'bytes':>8}{'legacy µs':>12}{'current µs':>12}{'speedup':>9}  text_out")
+    for row in rows:
+        print(f"{row['case']:<18}{row['bytes']:>8}{row['legacy_us']:>12}{row['current_us']:>12}{row['speedup']:>9}  "
+              f"{'same' if row['same_text_out'] else 'differs'}")
+    return rows
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,351 @@
+"""
+本地模拟的 OpenAI 兼容 chat/completions 服务，用于离线基准测试与手动调试。
+
+可配置首包延迟、流式分块、reasoning 字段、截断与损坏的 XML（可续写）、system prompt 前缀缓存，以及 429 限流。
+请求带有 response_format（json_schema / json_object）时返回相同内容的 JSON。
+单独运行：python benchmarks/mock_server.py --port 8765 --latency 0.5
+然后在节点中把 API url 设为 http://127.0.0.1:8765/v1（API key 任意）。
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_XML = """<img>
+  <character_1>
+  <n>A</n>
+  <gender>1girl</gender>
+  <appearance>blonde_hair, short_hair, ahoge, twintails, sidelocks, hairclip</appearance>
+  <clothing>short_kimono, white_socks, sash, red_sash, fingerless_gloves, haori</clothing>
+  <expression>serious, focused</expression>
+  <action>wearing_headset, commanding, pointing_at_hologram</action>
+  <position>center</position>
+  </character_1>
+
+  <general_tags>
+  <count>1girl</count>
+  <style>anime_style, oil_painting_style</style>
+  <background>sci-fi_command_center, holographic_displays, tactical_map</background>
+  <atmosphere>tense, strategic</atmosphere>
+  <lighting>dramatic_lighting, neon_glow</lighting>
+  <quality>very_aesthetic, masterpiece, no_text</quality>
+  <resolution>max_high_resolution</resolution>
+  <artist>rella, wlop, ciloranko</artist>
+  <objects>headset, tactical_gear, holograms</objects>
+  </general_tags>
+
+  <caption>A blonde girl in a short kimono commands a battle from a futuristic command center full of holograms.</caption>
+</img>"""
+
+DEFAULT_TRANSLATION = "画面描绘了一个未来科幻风格的指挥中心，一位金发少女戴着耳机，正在专注地指挥战斗。"
+
+# 请求带有 response_format 时返回的结构化输出（与 DEFAULT_XML 内容相同）
+DEFAULT_JSON = {
+    "characters": [{
+        "n": "A",
+        "gender": "1girl",
+        "appearance": "blonde_hair, short_hair, ahoge, twintails, sidelocks, hairclip",
+        "clothing": "short_kimono, white_socks, sash, red_sash, fingerless_gloves, haori",
+        "expression": "serious, focused",
+        "action": "wearing_headset, commanding, pointing_at_hologram",
+        "position": "center",
+    }],
+    "general_tags": {
+        "count": "1girl",
+        "style": "anime_style, oil_painting_style",
+        "background": "sci-fi_command_center, holographic_displays, tactical_map",
+        "atmosphere": "tense, strategic",
+        "quality": "very_aesthetic, masterpiece, no_text",
+        "resolution": "max_high_resolution",
+        "artist": "rella, wlop, ciloranko",
+        "objects": "headset, tactical_gear, holograms",
+        "other": "dramatic_lighting, neon_glow",
+    },
+    "caption": "A blonde girl in a short kimono commands a battle from a futuristic command center full of holograms.",
+    "translation": "画面描绘了一个未来科幻风格的指挥中心，一位金发少女戴着耳机，正在专注地指挥战斗。",
+}
+
+DEFAULT_REASONING = "用户描述了一位指挥官少女，先整理外观与服装标签，再补充背景、光照与画质标签。"
+
+
+class Scenario:
+    """模拟回复的行为，可在两次请求之间修改"""
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, chunk_size=16, reasoning=False, reasoning_field="reasoning_content",
+                 truncate=False, malformed=False, fenced=True, usage=True, prefix_cache=False, cached_latency=None,
+                 errors=0, error_status=429, retry_after=None, continue_chars=None, reject_stream_options=False):
+        self.latency = latency              # 收到请求到返回第一个字节的延迟（秒）
+        self.chunk_delay = chunk_delay      # 流式输出时每块之间的延迟（秒）
+        self.chunk_size = chunk_size        # 流式输出每块的字符数
+        self.reasoning = reasoning          # 是否返回思考内容
+        self.reasoning_field = reasoning_field
+        self.truncate = truncate            # 在 <img> 中间截断，finish_reason 为 length
+        self.malformed = malformed          # 返回缺少闭合标签的 XML
+        self.fenced = fenced                # 是否用 ```xml 代码块包裹
+        self.usage = usage
+        self.prefix_cache = prefix_cache    # 模拟平台的前缀缓存：再次收到相同的 system prompt 时返回 cached_tokens
+        self.cached_latency = cached_latency  # 命中前缀缓存时的首包延迟，None 表示与 latency 相同
+        self.errors = errors                # 前 errors 个请求返回 error_status 错误
+        self.error_status = error_status
+        self.retry_after = retry_after      # 错误响应的 Retry-After 头（秒），None 表示不发送
+        self.continue_chars = continue_chars  # 续写请求每次最多返回的字符数（再次以 length 结束），None 表示一次写完
+        self.reject_stream_options = reject_stream_options  # 模拟不认识 stream_options 参数的接口，返回 400
+
+    def full_text(self, structured=False):
+        """未截断时的完整回复"""
+        if structured:
+            return json.dumps(DEFAULT_JSON, ensure_ascii=False)
+        xml = DEFAULT_XML
+        if self.malformed:
+            xml = xml.replace("</expression>", "", 1).replace("tactical_map", "tactical_map & radar")
+        if self.fenced:
+            text = f"```xml\n{xml}\n```\n{DEFAULT_TRANSLATION}"
+        else:
+            text = f"{xml}\n{DEFAULT_TRANSLATION}"
+        return text
+
+    def content(self, structured=False, partial=None):
+        """
+        返回 (回复, finish_reason)。partial 为请求中已有的 assistant 回复（续写请求）时，
+        从完整回复中 partial 之后的位置接着返回。
+        """
+        if partial:
+            # 续写请求不带 response_format，按已有回复判断原本的格式
+            structured = partial.startswith("{")
+        text = self.full_text(structured)
+        if partial:
+            rest = text[len(partial):] if text.startswith(partial) else text
+            if self.continue_chars is not None and len(rest) > self.continue_chars:
+                return rest[:self.continue_chars], "length"
+            return rest, "stop"
+        if self.truncate:
+            cut = len(text) // 2 if structured else text.find("<general_tags>")
+            return text[:cut], "length"
+        return text, "stop"
+
+
+def assistant_text(body):
+    """续写请求中已有的 assistant 回复（预填充或作为上一轮对话），没有时返回 None"""
+    for message in reversed(body.get("messages") or []):
+        if message.get("role") == "assistant":
+            return message.get("content") or ""
+    return None
+
+
+def system_text(body):
+    """请求中 system 消息的文本（字符串或内容块两种形式）"""
+    for message in body.get("messages") or []:
+        if message.get("role") == "system":
+            content = message.get("content")
+            if isinstance(content, list):
+                return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content or ""
+    return ""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与正文分两次写出，关闭 Nagle 以免延迟确认给每次请求额外增加约 40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        started = time.perf_counter()
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        scenario = server.scenario
+        system = system_text(body)
+        with server.lock:
+            server.requests.append(body)
+            failing = scenario.errors > 0
+            if failing:
+                scenario.errors -= 1
+            prefix_hit = scenario.prefix_cache and system in server.prefixes
+            server.prefixes.add(system)
+
+        if failing:
+            self._error(scenario, started)
+            return
+        if scenario.reject_stream_options and "stream_options" in body:
+            self._error(scenario, started, status=400)
+            return
+
+        latency = scenario.cached_latency if prefix_hit and scenario.cached_latency is not None else scenario.latency
+        if latency > 0:
+            time.sleep(latency)
+
+        response_format = body.get("response_format") or {}
+        content, finish_reason = scenario.content(structured=response_format.get("type") in ("json_schema", "json_object"),
+                                                  partial=assistant_text(body))
+        reasoning = DEFAULT_REASONING if scenario.reasoning else None
+        model = body.get("model", "mock")
+        if scenario.prefix_cache:
+            system_tokens = len(system) // 4
+            usage = {"prompt_tokens": system_tokens + 200,
+                     "prompt_tokens_details": {"cached_tokens": system_tokens if prefix_hit else 0}}
+        else:
+            usage = {"prompt_tokens": 1200}
+        usage["completion_tokens"] = max(1, len(content) // 4)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        try:
+            if body.get("stream"):
+                self._stream(scenario, model, content, reasoning, usage, body, finish_reason)
+            else:
+                message = {"role": "assistant", "content": content}
+                if reasoning:
+                    message[scenario.reasoning_field] = reasoning
+                payload = {
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                }
+                if scenario.usage:
+                    payload["usage"] = usage
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端收到完整 <img> 后提前关闭了流
+            pass
+        finally:
+            with server.lock:
+                server.handler_seconds.append(time.perf_counter() - started)
+
+    def _error(self, scenario, started, status=None):
+        status = status or scenario.error_status
+        data = json.dumps({"error": {"message": f"mock error {status}", "type": "mock_error",
+                                     "code": status}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if scenario.retry_after is not None:
+            self.send_header("Retry-After", str(scenario.retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.handler_seconds.append(time.perf_counter() - started)
+
+    def _stream(self, scenario, model, content, reasoning, usage, body, finish_reason):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta, finish_reason=None, chunk_usage=None):
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []}
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        size = max(1, scenario.chunk_size)
+        if reasoning:
+            for i in range(0, len(reasoning), size):
+                send({scenario.reasoning_field: reasoning[i:i + size]})
+                if scenario.chunk_delay > 0:
+                    time.sleep(scenario.chunk_delay)
+        for i in range(0, len(content), size):
+            send({"content": content[i:i + size]})
+            if scenario.chunk_delay > 0:
+                time.sleep(scenario.chunk_delay)
+        send({}, finish_reason=finish_reason)
+        if scenario.usage and (body.get("stream_options") or {}).get("include_usage"):
+            send(None, chunk_usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class MockServer:
+    """在后台线程中运行的模拟服务；base_url 可直接作为节点的 API url"""
+
+    def __init__(self, host="127.0.0.1", port=0, scenario=None):
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.scenario = scenario or Scenario()
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = []
+        self.httpd.prefixes = set()
+        self.httpd.handler_seconds = []
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def scenario(self):
+        return self.httpd.scenario
+
+    @scenario.setter
+    def scenario(self, value):
+        self.httpd.scenario = value
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def handler_seconds(self):
+        return self.httpd.handler_seconds
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--reasoning", action="store_true")
+    parser.add_argument("--truncate", action="store_true")
+    parser.add_argument("--malformed", action="store_true")
+    parser.add_argument("--no-fence", action="store_true")
+    parser.add_argument("--prefix-cache", action="store_true")
+    parser.add_argument("--cached-latency", type=float, default=None)
+    parser.add_argument("--errors", type=int, default=0, help="前 N 个请求返回错误")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+
+    scenario = Scenario(latency=args.latency, chunk_delay=args.chunk_delay, chunk_size=args.chunk_size,
+                        reasoning=args.reasoning, truncate=args.truncate, malformed=args.malformed,
+                        fenced=not args.no_fence, prefix_cache=args.prefix_cache, cached_latency=args.cached_latency,
+                        errors=args.errors, error_status=args.error_status, retry_after=args.retry_after)
+    server = MockServer(args.host, args.port, scenario)
+    print(f"模拟服务已启动：{server.base_url}（Ctrl+C 退出）")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+"""
+离线基准测试：在本地模拟服务上测量插件自身的开销（不含真实平台的延迟），结果写入 JSON，便于版本之间对比。
+
+用法：
+    python benchmarks/run_benchmarks.py                    # 完整运行，写入 benchmarks/results.json
+    python benchmarks/run_benchmarks.py --quick -o out.json
+    python benchmarks/run_benchmarks.py --only process_text,xml
+
+测试项：
+    process_text      LLM_Prompt_Formatter.process_text 端到端（阻塞 / 流式 × 正常、思考、截断、损坏 XML，以及缓存命中）
+    prompt_cache      system prompt 前缀缓存：冷/热请求耗时、命中的输入 token 比例与前缀是否逐字节一致
+    import            在新进程中注册节点（执行 __init__.py）与调用 INPUT_TYPES 的耗时（bench_import）
+    tensor_to_base64  不同分辨率的图片编码
+    xml               clean_prompt / repair_xml_custom 吞吐量
+    parsing           新旧回复解析对比（bench_response_parsing）
+    styles            大预设文件下的 inject_style 与 save_preset_logic
+    tag_validation    标签词典：构建索引的耗时与文件大小，精确查询 / 拼写纠正 / 未收录标签的单次耗时
+    prompt_history    相似提示词历史：写入耗时、数据库大小，完全相同 / 改动一个标签 / 无相似条目的单次查询耗时
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import random
+import string
+import statistics
+import contextlib
+import subprocess
+
+from _package import PACKAGE_DIR, load_module
+from mock_server import MockServer, Scenario, DEFAULT_XML
+import bench_response_parsing
+import bench_import
+
+ALL_SUITES = ("import", "process_text", "prompt_cache", "tensor_to_base64", "xml", "parsing", "styles", "tag_validation",
+              "prompt_history")
+
+
+def summarize(samples):
+    """毫秒统计"""
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(round(len(ms) * 0.95)) - 1)]
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "median_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(p95, 3),
+        "min_ms": round(ms[0], 3),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """节点会向控制台输出大量信息，计时期间丢弃"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class BenchEnvironment:
+    """
+    隔离的运行环境：临时配置文件、预设库与缓存目录，不触碰用户的 LPF_config.json、LPF_presets.db 与 cache/。
+    """
+
+    def __init__(self, config_overrides=None):
+        self.tmp_dir = tempfile.mkdtemp(prefix="lpf_bench_")
+        with open(os.path.join(PACKAGE_DIR, "LPF_config.json.example"), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        # 端到端测量从指标记录中读取各阶段耗时；指标文件写在临时目录中
+        self.config["logging"] = dict(self.config.get("logging", {}), metrics=True)
+        self.config.update(config_overrides or {})
+        self.config_path = os.path.join(self.tmp_dir, "LPF_config.json")
+        self.write_config()
+
+        self.Config_Store = load_module("Config_Store")
+        self.Response_Cache = load_module("Response_Cache")
+        self._saved = (self.Config_Store.config_store.path, self.Response_Cache.response_cache.cache_dir)
+        self.Config_Store.config_store.path = self.config_path
+        self.Config_Store.config_store.invalidate()
+        self.Response_Cache.response_cache.cache_dir = os.path.join(self.tmp_dir, "responses")
+        self.Tag_Dictionary = load_module("Tag_Dictionary")
+        self._saved_index_dir = self.Tag_Dictionary.tag_dictionaries.index_dir
+        self.Tag_Dictionary.tag_dictionaries.index_dir = os.path.join(self.tmp_dir, "tags")
+        self.Prompt_History = load_module("Prompt_History")
+        self._saved_history_dir = self.Prompt_History.prompt_history.history_dir
+        self.Prompt_History.prompt_history.history_dir = os.path.join(self.tmp_dir, "history")
+        self.Preset_Store = load_module("Preset_Store")
+        self._saved_presets_path = self.Preset_Store.preset_store.path
+        self.Preset_Store.preset_store.path = os.path.join(self.tmp_dir, "LPF_presets.db")
+        self.Instrumentation = load_module("Instrumentation")
+        metrics = self.Instrumentation.metrics
+        self._saved_metrics = (metrics.metrics_file, metrics.prometheus_file)
+        metrics.metrics_file = os.path.join(self.tmp_dir, "metrics.jsonl")
+        metrics.prometheus_file = os.path.join(self.tmp_dir, "metrics.prom")
+
+    def write_config(self):
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            json.dump(self.config, f, indent=2, ensure_ascii=False)
+
+    def update_config(self, **values):
+        self.config.update(values)
+        self.write_config()
+        self.Config_Store.config_store.invalidate()
+
+    def close(self):
+        self.Config_Store.config_store.path, self.Response_Cache.response_cache.cache_dir = self._saved
+        self.Config_Store.config_store.invalidate()
+        self.Tag_Dictionary.tag_dictionaries.index_dir = self._saved_index_dir
+        self.Prompt_History.prompt_history.history_dir = self._saved_history_dir
+        self.Preset_Store.preset_store.path = self._saved_presets_path
+        metrics = self.Instrumentation.metrics
+        # 先停止记录并写入尚未写出的快照，之后不会再有文件写到插件目录中
+        metrics.configure({"logging": {"metrics": False}})
+        metrics.flush()
+        metrics.metrics_file, metrics.prometheus_file = self._saved_metrics
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def bench_process_text(env, iterations, latency):
+    LLM_Node = load_module("LLM_Node")
+    formatter = LLM_Node.LLM_Prompt_Formatter()
+    scenarios = {
+        "plain": Scenario(latency=latency),
+        "reasoning": Scenario(latency=latency, reasoning=True),
+        "truncated": Scenario(latency=latency, truncate=True),
+        "malformed": Scenario(latency=latency, malformed=True),
+    }
+    results = []
+    with MockServer() as server:
+        for stream in (False, True):
+            for name, scenario in scenarios.items():
+                server.scenario = scenario
+                wall = []
+                overhead = []
+                with quiet():
+                    for i in range(iterations + 1):
+                        served = len(server.handler_seconds)
+                        start = time.perf_counter()
+                        formatter.process_text("sk-bench", server.base_url, "mock-model", f"1girl, commander {i}",
+                                               False, bypass_cache=True, stream=stream)
+                        elapsed = time.perf_counter() - start
+                        # 流式提前结束时服务端可能稍后才记录耗时
+                        deadline = time.perf_counter() + 1.0
+                        while len(server.handler_seconds) <= served and time.perf_counter() < deadline:
+                            time.sleep(0.001)
+                        if i == 0:
+                            continue  # 第一次包含建立连接与导入开销
+                        wall.append(elapsed)
+                        server_time = server.handler_seconds[served] if len(server.handler_seconds) > served else 0.0
+                        overhead.append(max(0.0, elapsed - server_time))
+                results.append({
+                    "scenario": name,
+                    "mode": "stream" if stream else "blocking",
+                    "server_latency_s": latency,
+                    "wall": summarize(wall),
+                    "overhead": summarize(overhead),
+                })
+
+        # 缓存命中：相同输入第二次起直接返回
+        server.scenario = scenarios["plain"]
+        samples = []
+        with quiet():
+            formatter.process_text("sk-bench", server.base_url, "mock-model", "1girl, cached", False)
+            for _ in range(iterations):
+                start = time.perf_counter()
+                formatter.process_text("sk-bench", server.base_url, "mock-model", "1girl, cached", False)
+                samples.append(time.perf_counter() - start)
+        results.append({"scenario": "cache_hit", "mode": "blocking", "server_latency_s": latency,
+                        "wall": summarize(samples), "overhead": summarize(samples)})
+    return results
+
+
+def last_metrics_record(env):
+    path = os.path.join(env.tmp_dir, "metrics.jsonl")
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.readlines()[-1])
+
+
+def bench_prompt_cache(env, iterations, latency):
+    """
+    模拟平台对重复的 system prompt 命中前缀缓存（首包延迟降为四分之一）。
+    冷请求每次使用不同的 system prompt，热请求重复同一个，输入文本每次都不同。
+    """
+    LLM_Node = load_module("LLM_Node")
+    formatter = LLM_Node.LLM_Prompt_Formatter()
+    base_prompt = env.config.get("system_prompt", "")
+    scenario = Scenario(latency=latency, prefix_cache=True, cached_latency=latency / 4)
+    results = []
+    with MockServer(scenario=scenario) as server:
+        for cache_control in ("never", "always"):
+            env.update_config(prompt_cache={"cache_control": cache_control})
+            samples = {"cold": [], "warm": []}
+            cached_ratio = []
+            prefixes = set()
+            with quiet():
+                for kind in ("cold", "warm"):
+                    for i in range(iterations + 1):
+                        suffix = f"\n<!-- cold {cache_control} {i} -->" if kind == "cold" else ""
+                        env.update_config(system_prompt=base_prompt + suffix)
+                        start = time.perf_counter()
+                        formatter.process_text("sk-bench", server.base_url, "mock-model", f"1girl, {kind} {i}",
+                                               False, bypass_cache=True)
+                        elapsed = time.perf_counter() - start
+                        if i == 0:
+                            continue  # 冷：建立连接；热：写入前缀缓存
+                        samples[kind].append(elapsed)
+                        if kind == "warm":
+                            record = last_metrics_record(env)
+                            tokens = record.get("tokens", {})
+                            prefixes.add(record.get("prompt_prefix"))
+                            if tokens.get("prompt_tokens"):
+                                cached_ratio.append(tokens.get("cached_prompt_tokens", 0) / tokens["prompt_tokens"])
+            system = server.requests[-1]["messages"][0]["content"]
+            results.append({
+                "cache_control": cache_control,
+                "marker_sent": isinstance(system, list) and "cache_control" in system[0],
+                "cold": summarize(samples["cold"]),
+                "warm": summarize(samples["warm"]),
+                "warm_cached_input_ratio": round(statistics.fmean(cached_ratio), 3) if cached_ratio else None,
+                "warm_prefix_stable": len(prefixes) == 1,
+            })
+    env.update_config(prompt_cache={}, system_prompt=base_prompt)
+    return results
+
+
+def make_image(size, seed):
+    """ComfyUI 的 IMAGE 为 [B, H, W, C] 的 float32 张量；没有 torch 时用 numpy 数组代替"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    array = rng.random((1, size, size, 3), dtype=np.float32)
+    try:
+        import torch
+        return torch.from_numpy(array)
+    except ImportError:
+        return array
+
+
+def bench_tensor_to_base64(env, iterations, sizes):
+    LLM_Node = load_module("LLM_Node")
+    formatter = LLM_Node.LLM_Prompt_Formatter()
+    results = []
+    for cached in (False, True):
+        env.update_config(image_encoding={"cache_entries": 16 if cached else 0})
+        for size in sizes:
+            image = make_image(size, size)
+            samples = []
+            with quiet():
+                formatter.tensor_to_base64(image)
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    encoded = formatter.tensor_to_base64(image)
+                    samples.append(time.perf_counter() - start)
+            results.append({"resolution": f"{size}x{size}", "encoder_cache": cached,
+                            "base64_kb": round(len(encoded) / 1024, 1), "time": summarize(samples)})
+    env.update_config(image_encoding={})
+    return results
+
+
+def throughput(fn, min_seconds):
+    """反复调用直到超过 min_seconds，返回每秒次数"""
+    count = 0
+    with quiet():
+        start = time.perf_counter()
+        while True:
+            fn()
+            count += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+    return round(count / elapsed, 1)
+
+
+def bench_xml(env, min_seconds):
+    LLM_Node = load_module("LLM_Node")
+    corpus = bench_response_parsing.build_corpus()
+    header = bench_response_parsing.HEADER
+    documents = {
+        "well_formed": bench_response_parsing.IMG_DOCUMENT,
+        "malformed": corpus["malformed_bare"],
+        "truncated": corpus["truncated"].replace("```xml\n", ""),
+    }
+    results = []
+    for name, document in documents.items():
+        results.append({
+            "document": name,
+            "bytes": len(document.encode('utf-8')),
+            "clean_prompt_per_s": throughput(lambda: LLM_Node.clean_prompt(document, header), min_seconds),
+            "repair_xml_custom_per_s": throughput(lambda: LLM_Node.repair_xml_custom(document), min_seconds),
+        })
+    return results
+
+
+def bench_styles(env, iterations, preset_counts):
+    LLM_Style_Node = load_module("LLM_Style_Node")
+    Style_Saver_Node = load_module("Style_Saver_Node")
+    LLM_Node = load_module("LLM_Node")
+    injector = LLM_Style_Node.LLM_Xml_Style_Injector()
+    sweeper = LLM_Style_Node.LLM_Xml_Style_Sweep()
+    saver = Style_Saver_Node.LLM_Style_Saver()
+    with quiet():
+        xml_input = LLM_Node.clean_prompt(bench_response_parsing.IMG_DOCUMENT, bench_response_parsing.HEADER)
+    base_styles = dict(env.config.get("styles", {}))
+
+    results = []
+    for count in preset_counts:
+        styles = dict(base_styles)
+        for i in range(count):
+            styles[f"bench_preset_{i:06d}"] = {
+                "artist": f"artist_{i}, artist_{i + 1}, artist_{i + 2}",
+                "style": f"style_{i}, soft_lighting, detailed_background",
+            }
+        # 配置文件中的 styles 只在首次导入预设库时读取：每个规模使用新的预设库，由导入写入全部预设
+        env.Preset_Store.preset_store.path = os.path.join(env.tmp_dir, f"LPF_presets_{count}.db")
+        env.update_config(styles=styles)
+        preset = f"bench_preset_{count - 1:06d}"
+        file_kb = round(os.path.getsize(env.config_path) / 1024, 1)
+
+        inject = []
+        extract = []
+        save = []
+        # 扫描模式：一次注入最多 500 个预设，记录平均每个输出的耗时
+        sweep_count = min(count, 500)
+        sweep_names = "\n".join(f"bench_preset_{i:06d}" for i in range(sweep_count))
+        sweep = []
+        with quiet():
+            for i in range(iterations):
+                start = time.perf_counter()
+                injector.inject_style(xml_input=xml_input, preset=preset, artist_add="extra_artist", style_add="")
+                inject.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                saver.save_preset_logic(xml_input, "", False)
+                extract.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                saver.save_preset_logic(xml_input, f"bench_saved_{count}_{i}", True)
+                save.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                sweeper.sweep(sweep_names, "", sweep_count, xml_input=xml_input, artist_add="extra_artist")
+                sweep.append((time.perf_counter() - start) / sweep_count)
+
+        results.append({
+            "presets": count,
+            "config_kb": file_kb,
+            "inject_style": summarize(inject),
+            "sweep_outputs": sweep_count,
+            "sweep_per_output": summarize(sweep),
+            "save_preset_logic_extract_only": summarize(extract),
+            "save_preset_logic_save": summarize(save),
+        })
+    env.Preset_Store.preset_store.path = os.path.join(env.tmp_dir, "LPF_presets.db")
+    env.update_config(styles=base_styles)
+    return results
+
+
+def write_tag_table(path, count, seed=0):
+    """生成 danbooru.csv 格式的合成词表（随机词组成的标签），返回其中的标签"""
+    rng = random.Random(seed)
+    tags = set()
+    while len(tags) < count:
+        words = ("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) for _ in range(rng.randint(1, 3)))
+        tags.add("_".join(words))
+    tags = sorted(tags)
+    with open(path, 'w', encoding='utf-8') as f:
+        for tag in tags:
+            f.write(f"{tag},{rng.choice((0, 1, 4))},{rng.randint(1, 100000)},\n")
+    return tags
+
+
+def bench_tag_validation(env, iterations, table_sizes):
+    Tag_Dictionary = load_module("Tag_Dictionary")
+    rng = random.Random(1)
+    results = []
+    for size in table_sizes:
+        table = os.path.join(env.tmp_dir, f"bench_tags_{size}.csv")
+        tags = write_tag_table(table, size)
+        settings = Tag_Dictionary.resolve_tag_validation_settings({"tag_validation": {"enabled": True, "tables": [table]}})
+        with quiet():
+            start = time.perf_counter()
+            dictionary = Tag_Dictionary.tag_dictionaries.get(settings)
+            build_s = time.perf_counter() - start
+
+        samples = rng.sample(tags, min(len(tags), iterations * 20))
+        typos = []
+        for tag in samples:
+            i = rng.randrange(len(tag))
+            typos.append(tag[:i] + rng.choice(string.ascii_lowercase) + tag[i + 1:])
+        misses = ["".join(rng.choices(string.ascii_lowercase, k=10)) for _ in samples]
+
+        def per_lookup_us(words):
+            dictionary._misses.clear()
+            start = time.perf_counter()
+            for word in words:
+                dictionary.lookup(word, settings["max_distance"])
+            return round((time.perf_counter() - start) / len(words) * 1e6, 2)
+
+        results.append({
+            "tags": size,
+            "build_s": round(build_s, 3),
+            "index_kb": round(os.path.getsize(dictionary.path) / 1024, 1),
+            "exact_us": per_lookup_us(samples),
+            "typo_us": per_lookup_us(typos),
+            "miss_us": per_lookup_us(misses),
+        })
+    return results
+
+
+def bench_prompt_history(env, iterations, entry_counts):
+    Prompt_History = load_module("Prompt_History")
+    rng = random.Random(2)
+    vocabulary = write_tag_table(os.path.join(env.tmp_dir, "bench_history_tags.csv"), 5000, seed=2)
+    settings = Prompt_History.resolve_history_settings({"prompt_history": {"enabled": True, "max_mb": 4096}})
+    xml_out = DEFAULT_XML
+    results = []
+    for count in entry_counts:
+        history = Prompt_History.PromptHistory(os.path.join(env.tmp_dir, f"history_{count}"))
+        prompts = [", ".join(rng.sample(vocabulary, rng.randint(12, 30))) for _ in range(count)]
+        start = time.perf_counter()
+        for i, prompt in enumerate(prompts):
+            history.put(f"scope{i % 4}", prompt, (xml_out, "translation"), settings)
+        put_s = time.perf_counter() - start
+
+        picks = rng.sample(range(count), min(count, iterations * 20))
+        exact = [(f"scope{i % 4}", ", ".join(reversed(prompts[i].split(", ")))) for i in picks]
+        # 替换一个标签并调整顺序，模拟迭代时的常见改动
+        similar = []
+        for i in picks:
+            tags = prompts[i].split(", ")
+            tags[rng.randrange(len(tags))] = rng.choice(vocabulary)
+            rng.shuffle(tags)
+            similar.append((f"scope{i % 4}", ", ".join(tags)))
+        misses = [(f"scope{i % 4}", ", ".join(rng.sample(vocabulary, 20))) for i in picks]
+
+        def per_lookup(queries):
+            hits = 0
+            start = time.perf_counter()
+            for scope, prompt in queries:
+                hits += history.lookup(scope, prompt, settings) is not None
+            return round((time.perf_counter() - start) / len(queries) * 1e6, 1), round(hits / len(queries), 3)
+
+        exact_us, exact_rate = per_lookup(exact)
+        similar_us, similar_rate = per_lookup(similar)
+        miss_us, miss_rate = per_lookup(misses)
+        results.append({
+            "entries": count,
+            "put_us": round(put_s / count * 1e6, 1),
+            "db_mb": round(history.size_bytes() / 1024 / 1024, 2),
+            "exact_us": exact_us, "exact_hit_rate": exact_rate,
+            "similar_us": similar_us, "similar_hit_rate": similar_rate,
+            "miss_us": miss_us, "false_hit_rate": miss_rate,
+        })
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def package_version():
+    try:
+        import tomllib
+        with open(os.path.join(PACKAGE_DIR, "pyproject.toml"), 'rb') as f:
+            return tomllib.load(f)["project"]["version"]
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.json"))
+    parser.add_argument("--only", default=",".join(ALL_SUITES), help="逗号分隔的测试项")
+    parser.add_argument("--quick", action="store_true", help="减少迭代次数，用于快速检查")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务的首包延迟（秒）")
+    args = parser.parse_args(argv)
+
+    suites = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(suites) - set(ALL_SUITES)
+    if unknown:
+        parser.error(f"未知的测试项：{', '.join(sorted(unknown))}")
+
+    iterations = 5 if args.quick else 30
+    report = {
+        "meta": {
+            "package_version": package_version(),
+            "git_revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": {},
+    }
+
+    env = BenchEnvironment()
+    try:
+        for suite in suites:
+            print(f"[LPF_Benchmark]: 正在运行 {suite} ...")
+            if suite == "import":
+                result = bench_import.run(3 if args.quick else 10)
+            elif suite == "process_text":
+                result = bench_process_text(env, iterations, args.latency)
+            elif suite == "prompt_cache":
+                result = bench_prompt_cache(env, iterations, max(args.latency, 0.02))
+            elif suite == "tensor_to_base64":
+                result = bench_tensor_to_base64(env, iterations, (512, 1024) if args.quick else (512, 1024, 2048))
+            elif suite == "xml":
+                result = bench_xml(env, 0.2 if args.quick else 1.0)
+            elif suite == "parsing":
+                result = bench_response_parsing.run(20 if args.quick else 200)
+            elif suite == "tag_validation":
+                result = bench_tag_validation(env, iterations, (10000,) if args.quick else (10000, 100000))
+            elif suite == "prompt_history":
+                result = bench_prompt_history(env, iterations, (10000,) if args.quick else (10000, 100000))
+            else:
+                result = bench_styles(env, iterations, (100, 1000) if args.quick else (100, 1000, 10000))
+            report["results"][suite] = result
+    finally:
+        env.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[LPF_Benchmark]: 结果已写入 {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,29 @@
+"""
+离线批量处理提示词存档（不需要 ComfyUI，也不访问网络）。
+
+用法：
+    python lpf_bulk.py clean prompts/ -o cleaned.jsonl
+    python lpf_bulk.py inject archive.jsonl -o injected.jsonl --preset 飘渺杰作光影集 --artist-add "daito"
+    python lpf_bulk.py extract prompts/ -o tags.jsonl -j 8
+
+完整参数见 python lpf_bulk.py --help。
+"""
+import os
+import sys
+import types
+import importlib
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_NAME = "lpf_bulk_package"
+
+# 插件目录名不一定是合法的包名，且模块之间使用相对导入：注册一个不执行 __init__.py 的空包，再按子模块导入。
+# 放在模块顶层，以 spawn 方式启动的工作进程重新导入本文件时同样会注册。
+if PACKAGE_NAME not in sys.modules:
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules[PACKAGE_NAME] = package
+
+Bulk_Processor = importlib.import_module(f"{PACKAGE_NAME}.Bulk_Processor")
+
+if __name__ == "__main__":
+    sys.exit(Bulk_Processor.main())
@@ -0,0 +1,24 @@
+"""
+测试在 ComfyUI 之外导入插件模块（与 benchmarks 相同的方式），
+并通过 BenchEnvironment 把配置文件、缓存目录、预设库与指标文件放在临时目录中，不触碰插件目录。
+每个测试都自动使用隔离的环境，包括没有显式请求 env 的测试。
+"""
+import os
+import sys
+
+import pytest
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+from run_benchmarks import BenchEnvironment  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def env():
+    environment = BenchEnvironment()
+    try:
+        yield environment
+    finally:
+        environment.close()
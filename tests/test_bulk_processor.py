@@ -0,0 +1,138 @@
+"""离线批处理（Bulk_Processor）：清单跳过未变化的输入、中断后继续、--force 重新处理"""
+import json
+
+import pytest
+
+from _package import load_module
+
+Bulk_Processor = load_module("Bulk_Processor")
+
+DOCUMENT = "<img><general_tags><artist>bob</artist><style>oil</style></general_tags></img>"
+
+
+def write_inputs(path, texts):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, text in enumerate(texts):
+            f.write(json.dumps({"id": f"item{i}", "text": text}, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {
+        "inputs": tmp_path / "inputs.jsonl",
+        "output": str(tmp_path / "out.jsonl"),
+        "manifest": str(tmp_path / "out.jsonl.manifest"),
+    }
+
+
+def run(paths, task, **kwargs):
+    items = Bulk_Processor.iter_inputs([str(paths["inputs"])])
+    return Bulk_Processor.run_bulk(task, items, paths["output"], paths["manifest"], **kwargs)
+
+
+def test_unchanged_inputs_are_skipped(paths):
+    texts = [f"header\n```xml\n<img><caption>{i}</caption></img>\n```" for i in range(5)]
+    write_inputs(paths["inputs"], texts)
+    task = Bulk_Processor.BulkTask("clean", header="H")
+
+    assert run(paths, task, chunk_size=2) == {"processed": 5, "skipped": 0, "errors": 0, "records": 5}
+    records = read_jsonl(paths["output"])
+    assert [record["id"] for record in records] == [f"item{i}" for i in range(5)]
+    assert all(record["status"] == "ok" and record["output"].startswith("H\n<img>") for record in records)
+
+    assert run(paths, task) == {"processed": 0, "skipped": 5, "errors": 0, "records": 0}
+    assert len(read_jsonl(paths["output"])) == 5
+
+    texts[3] = "header\n<img><caption>changed</caption></img>"
+    write_inputs(paths["inputs"], texts)
+    assert run(paths, task) == {"processed": 1, "skipped": 4, "errors": 0, "records": 1}
+    assert read_jsonl(paths["output"])[-1]["id"] == "item3"
+
+
+def test_changed_parameters_reprocess_everything(paths):
+    write_inputs(paths["inputs"], ["<img><caption>a</caption></img>", "<img><caption>b</caption></img>"])
+    run(paths, Bulk_Processor.BulkTask("clean", header="H"))
+    assert run(paths, Bulk_Processor.BulkTask("clean", header="other"))["processed"] == 2
+    assert run(paths, Bulk_Processor.BulkTask("clean", header="other"), force=True)["processed"] == 2
+
+
+def truncate_lines(path, keep):
+    """模拟中断：只保留前 keep 行，下一行只写了一半"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:keep])
+        f.write(lines[keep][:10])
+    return lines
+
+
+def test_resume_after_interruption(paths):
+    write_inputs(paths["inputs"], [f"<img><caption>{i}</caption></img>" for i in range(6)])
+    task = Bulk_Processor.BulkTask("repair")
+    run(paths, task, chunk_size=2)
+    expected = read_jsonl(paths["output"])
+
+    # 在写出第三块的过程中中断：输出与清单都停在第五行的中间
+    truncate_lines(paths["output"], 4)
+    lines = truncate_lines(paths["manifest"], 4)
+    assert Bulk_Processor.load_manifest(paths["manifest"]) == {
+        f"item{i}": json.loads(lines[i])["hash"] for i in range(4)}
+
+    assert run(paths, task, chunk_size=2) == {"processed": 2, "skipped": 4, "errors": 0, "records": 2}
+    assert read_jsonl(paths["output"]) == expected
+    assert run(paths, task)["skipped"] == 6
+
+
+def test_errors_are_retried(paths):
+    write_inputs(paths["inputs"], [DOCUMENT, "没有 XML"])
+    task = Bulk_Processor.BulkTask("inject", targets=[("good", "alice", "ink"), ("bad", "a\x01", "")])
+
+    assert run(paths, task) == {"processed": 2, "skipped": 0, "errors": 1, "records": 4}
+    records = read_jsonl(paths["output"])
+    assert [(record["id"], record["preset"], record["status"]) for record in records] == [
+        ("item0", "good", "ok"), ("item0", "bad", "error"), ("item1", "good", "no_img"), ("item1", "bad", "no_img")]
+    assert "<artist>alice</artist>" in records[0]["output"]
+    # 出错的输入不记入清单，下次运行重试
+    assert set(Bulk_Processor.load_manifest(paths["manifest"])) == {"item1"}
+    assert run(paths, task) == {"processed": 1, "skipped": 1, "errors": 1, "records": 2}
+
+
+def test_worker_processes_keep_input_order(paths, tmp_path):
+    write_inputs(paths["inputs"], [f"<img><artist>{i}</artist></img>" for i in range(20)])
+    task = Bulk_Processor.BulkTask("extract")
+    assert run(paths, task, jobs=2, chunk_size=3)["processed"] == 20
+    assert [record["artist"] for record in read_jsonl(paths["output"])] == [str(i) for i in range(20)]
+
+
+def test_iter_inputs(tmp_path):
+    directory = tmp_path / "prompts"
+    (directory / "b").mkdir(parents=True)
+    (directory / "a.txt").write_text("A", encoding='utf-8')
+    (directory / "b" / "c.xml").write_text("C", encoding='utf-8')
+    (directory / "skip.png").write_text("-", encoding='utf-8')
+    jsonl = tmp_path / "items.jsonl"
+    jsonl.write_text('{"id": "x", "prompt": "X"}\nnot json\n{"prompt": "Y"}\n{"text": "missing"}\n', encoding='utf-8')
+
+    assert [text for _, text in Bulk_Processor.iter_inputs([str(directory)])] == ["A", "C"]
+    assert list(Bulk_Processor.iter_inputs([str(jsonl)], field="prompt")) == [("x", "X"), (f"{jsonl}:3", "Y")]
+
+
+def test_main_injects_presets(env, paths, capsys):
+    config = env.Config_Store.config_store.snapshot()
+    env.Preset_Store.preset_store.save(config, "watercolor", "carol", "watercolor")
+    write_inputs(paths["inputs"], [DOCUMENT])
+    argv = ["inject", str(paths["inputs"]), "-o", paths["output"], "-j", "1",
+            "--config", env.config_path, "--presets-db", env.Preset_Store.preset_store.path,
+            "--preset", "watercolor", "--artist-add", "dave"]
+    assert Bulk_Processor.main(argv) == 0
+    (record,) = read_jsonl(paths["output"])
+    assert record["preset"] == "watercolor" and "<artist>dave, carol</artist>" in record["output"]
+
+    assert Bulk_Processor.main(argv) == 0
+    assert "跳过未变化的 1 条" in capsys.readouterr().err
@@ -0,0 +1,25 @@
+"""兼容旧版本的模块级接口：其他插件与脚本仍在导入"""
+from _package import load_module
+
+LLM_Node = load_module("LLM_Node")
+LLM_Style_Node = load_module("LLM_Style_Node")
+Config_Store = load_module("Config_Store")
+
+
+def test_load_api_config(env):
+    env.update_config(api_url="https://example.invalid/v1")
+    config = LLM_Node.load_api_config()
+    assert config["api_url"] == "https://example.invalid/v1"
+    config["api_url"] = "changed"
+    assert Config_Store.config_store.get()["api_url"] == "https://example.invalid/v1"
+
+
+def test_load_styles_from_config(env):
+    env.update_config(styles={"from_config": {"artist": "a", "style": ""}})
+    env.Preset_Store.preset_store.save(Config_Store.config_store.snapshot(), "from_library", "b", "")
+    styles = LLM_Style_Node.load_styles_from_config()
+    assert list(styles)[0] in Config_Store.DEFAULT_STYLES
+    assert styles["from_config"] == {"artist": "a", "style": ""}
+    assert styles["from_library"] == {"artist": "b", "style": ""}
+    styles.clear()
+    assert LLM_Style_Node.load_styles_from_config()
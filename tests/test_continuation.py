@@ -0,0 +1,74 @@
+"""截断检测与续写拼接（Continuation）"""
+from mock_server import MockServer, Scenario
+from _package import load_module
+
+Continuation = load_module("Continuation")
+LLM_Completion = load_module("LLM_Completion")
+CompletionResult = LLM_Completion.CompletionResult
+
+DOCUMENT = "<img>\n  <character_1>\n    <n>alice</n>\n  </character_1>\n  <caption>a girl</caption>\n</img>"
+
+
+def test_truncation_reason_finish_reason():
+    result = CompletionResult(content=f"```xml\n{DOCUMENT}\n```", finish_reason="length")
+    assert Continuation.truncation_reason(result) == "finish_reason 为 length"
+    assert Continuation.truncation_reason(result, structured=True) == "finish_reason 为 length"
+
+
+def test_truncation_reason_unclosed_img():
+    result = CompletionResult(content=f"```xml\n{DOCUMENT[:40]}", finish_reason="stop")
+    assert Continuation.truncation_reason(result) == "<img> 未闭合"
+    # 结构化输出的正文是 JSON，只看 finish_reason
+    assert Continuation.truncation_reason(result, structured=True) is None
+
+
+def test_truncation_reason_complete_or_stopped():
+    assert Continuation.truncation_reason(CompletionResult(content=f"```xml\n{DOCUMENT}\n```", finish_reason="stop")) is None
+    assert Continuation.truncation_reason(CompletionResult(content="没有 XML 的回复", finish_reason="stop")) is None
+    # 主动停止读取（例如对冲请求落败）不算截断
+    stopped = CompletionResult(content=DOCUMENT[:40], finish_reason="length", stopped_early=True)
+    assert Continuation.truncation_reason(stopped) is None
+
+
+def test_stitch_appends_continuation():
+    partial = f"```xml\n{DOCUMENT[:50]}"
+    assert Continuation.stitch(partial, DOCUMENT[50:] + "\n```") == f"```xml\n{DOCUMENT}\n```"
+
+
+def test_stitch_removes_overlap():
+    partial = f"```xml\n{DOCUMENT[:60]}"
+    # 模型重复了已输出的最后 20 个字符
+    assert Continuation.stitch(partial, DOCUMENT[40:] + "\n```") == f"```xml\n{DOCUMENT}\n```"
+
+
+def test_stitch_keeps_short_overlap():
+    # 8 个字符以内的重合可能是正常的重复内容，不去掉
+    assert Continuation.stitch("<img><a>abc", "abc</a></img>") == "<img><a>abcabc</a></img>"
+
+
+def test_stitch_drops_repeated_fence():
+    partial = f"```xml\n{DOCUMENT[:50]}"
+    assert Continuation.stitch(partial, "```xml\n" + DOCUMENT[50:] + "\n```") == f"```xml\n{DOCUMENT}\n```"
+
+
+def test_stitch_restarted_document_replaces_partial():
+    partial = f"前言\n```xml\n{DOCUMENT[:50]}"
+    restarted = f"好的，重新输出：\n```xml\n{DOCUMENT}\n```"
+    assert Continuation.stitch(partial, restarted) == f"```xml\n{DOCUMENT}\n```"
+    assert Continuation.stitch(partial, DOCUMENT) == DOCUMENT
+
+
+def test_truncated_reply_is_continued(env):
+    formatter = load_module("LLM_Node").LLM_Prompt_Formatter()
+    with MockServer(scenario=Scenario(truncate=True)) as server:
+        xml_out, text_out, _ = formatter.process_text("sk", server.base_url, "m", "1girl", False, bypass_cache=True)
+        assert "<caption>" in xml_out and xml_out.rstrip().endswith("</img>")
+        assert len(server.requests) == 2
+        # 本地服务器不支持预填充：截断的回复作为 assistant 消息，再追加续写指令
+        messages = server.requests[-1]["messages"]
+        assert messages[-2]["role"] == "assistant"
+        assert messages[-1] == {"role": "user", "content": Continuation.CONTINUE_INSTRUCTION}
+
+        env.update_config(continuation={"enabled": False})
+        xml_out, _, _ = formatter.process_text("sk", server.base_url, "m", "1girl", False, bypass_cache=True)
+        assert len(server.requests) == 3
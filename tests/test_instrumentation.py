@@ -0,0 +1,35 @@
+"""运行指标（Instrumentation）：默认不写文件，开启后写入 JSONL 与 Prometheus 快照"""
+import os
+import json
+
+from _package import load_module
+
+Instrumentation = load_module("Instrumentation")
+
+
+def recorder(directory):
+    return Instrumentation.MetricsRecorder(os.path.join(directory, "logs", "metrics.jsonl"),
+                                           os.path.join(directory, "logs", "metrics.prom"))
+
+
+def test_metrics_are_off_by_default(tmp_path):
+    metrics = recorder(str(tmp_path))
+    assert metrics.configure({})["metrics"] is False
+    metrics.finish(metrics.start("Node"), "ok")
+    metrics.flush()
+    assert not os.path.exists(tmp_path / "logs")
+
+
+def test_enabled_metrics_write_both_files(tmp_path):
+    metrics = recorder(str(tmp_path))
+    metrics.configure({"logging": {"metrics": True}})
+    run = metrics.start("Node")
+    run.add_stage("parse", 0.002)
+    metrics.finish(run, "ok")
+    metrics.flush()
+    with open(tmp_path / "logs" / "metrics.jsonl", 'r', encoding='utf-8') as f:
+        record = json.loads(f.readline())
+    assert record["node"] == "Node" and record["status"] == "ok"
+    with open(tmp_path / "logs" / "metrics.prom", 'r', encoding='utf-8') as f:
+        assert 'lpf_runs_total{node="Node",status="ok"} 1' in f.read()
+    metrics.configure({"logging": {"metrics": False}})
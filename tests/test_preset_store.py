@@ -0,0 +1,137 @@
+"""预设库（Preset_Store）：从配置文件迁移、保存、以预设库为准"""
+import os
+
+import pytest
+
+from _package import load_module
+
+Config_Store = load_module("Config_Store")
+Preset_Store = load_module("Preset_Store")
+Preset_Routes = load_module("Preset_Routes")
+DEFAULT_NAME = next(iter(Config_Store.DEFAULT_STYLES))
+
+CONFIG_STYLES = {
+    "imported": {"artist": "alice", "style": "oil"},
+    "second": {"artist": "bob", "style": ""},
+}
+
+
+@pytest.fixture
+def store(env):
+    env.update_config(styles=CONFIG_STYLES)
+    return env.Preset_Store.preset_store
+
+
+def config():
+    return Config_Store.config_store.snapshot()
+
+
+def test_migration_imports_config_styles(store):
+    snapshot = store.snapshot(config())
+    assert snapshot.style_keys == [DEFAULT_NAME, "imported", "second"]
+    assert store.lookup(config(), "imported") == CONFIG_STYLES["imported"]
+    assert store.lookup(config(), DEFAULT_NAME) == Config_Store.DEFAULT_STYLES[DEFAULT_NAME]
+    assert store.lookup(config(), "missing") is None
+
+
+def test_database_wins_over_changed_config_styles(env, store, caplog):
+    store.snapshot(config())
+    env.update_config(styles={"imported": {"artist": "changed", "style": ""}})
+    assert store.lookup(config(), "imported") == CONFIG_STYLES["imported"]
+    # 从配置文件中删去的预设仍在预设库中
+    assert store.snapshot(config()).style_keys == [DEFAULT_NAME, "imported", "second"]
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+    assert len(warnings) == 1 and "imported" in warnings[0]
+
+    # 同样的差异只提示一次
+    env.update_config(styles={"imported": {"artist": "changed", "style": ""}}, temperature=0.5)
+    store.snapshot(config())
+    assert len([record for record in caplog.records if record.levelname == "WARNING"]) == 1
+
+
+def test_config_styles_added_after_migration_are_merged(env, store):
+    store.snapshot(config())
+    env.update_config(styles=dict(CONFIG_STYLES, added_later={"artist": "x", "style": ""}, broken="not a preset"))
+    assert store.lookup(config(), "added_later") == {"artist": "x", "style": ""}
+    assert store.lookup(config(), "broken") is None
+    assert store.snapshot(config()).style_keys == [DEFAULT_NAME, "imported", "second", "added_later"]
+
+    # 保存到预设库后以预设库为准
+    assert store.upsert(config(), "added_later", "y", "") is True
+    assert store.lookup(config(), "added_later") == {"artist": "y", "style": ""}
+
+
+def test_migration_runs_once_per_database(env, store):
+    store.snapshot(config())
+    other = Preset_Store.PresetStore(store.path)
+    env.update_config(styles={"added_later": {"artist": "x", "style": ""}})
+    assert other.lookup(config(), "second") == CONFIG_STYLES["second"]
+    conn = other._connect()
+    assert conn.execute("SELECT count(*) FROM presets WHERE name = 'added_later'").fetchone()[0] == 0
+
+
+def test_broken_config_postpones_migration(env, store):
+    with open(env.config_path, 'w', encoding='utf-8') as f:
+        f.write("{ broken")
+    Config_Store.config_store.invalidate()
+    assert store.lookup(config(), "imported") is None
+
+    env.write_config()
+    Config_Store.config_store.invalidate()
+    assert store.lookup(config(), "imported") == CONFIG_STYLES["imported"]
+
+
+def test_save_inserts_new_presets_only(store):
+    first = store.snapshot(config())
+    assert store.save(config(), "new", "carol", "ink")
+    assert not store.save(config(), "new", "dave", "pencil")
+    assert not store.save(config(), "imported", "dave", "pencil")
+    assert store.lookup(config(), "new") == {"artist": "carol", "style": "ink"}
+
+    snapshot = store.snapshot(config())
+    assert snapshot is not first
+    assert snapshot.style_keys[-1] == "new"
+    assert store.snapshot(config()) is snapshot
+
+
+def test_snapshot_sees_writes_from_other_processes(store):
+    first = store.snapshot(config())
+    other = Preset_Store.PresetStore(store.path)
+    assert other.save(config(), "from_other", "eve", "")
+    snapshot = store.snapshot(config())
+    assert snapshot is not first and "from_other" in snapshot.styles
+
+
+def test_database_preset_overrides_default_style(store):
+    # 默认样式不在预设库中，保存同名预设视为新增
+    assert store.upsert(config(), DEFAULT_NAME, "frank", "") is True
+    assert store.lookup(config(), DEFAULT_NAME) == {"artist": "frank", "style": ""}
+    snapshot = store.snapshot(config())
+    assert snapshot.style_keys[0] == DEFAULT_NAME
+    assert snapshot.styles[DEFAULT_NAME]["artist"] == "frank"
+
+
+def test_upsert_edits_imported_presets(store):
+    assert store.upsert(config(), "imported", "grace", "watercolor") is False
+    assert store.lookup(config(), "imported") == {"artist": "grace", "style": "watercolor"}
+    assert store.upsert(config(), "brand_new", "heidi", "") is True
+    assert store.snapshot(config()).styles["imported"]["artist"] == "grace"
+
+    assert Preset_Routes.upsert_preset({"name": " imported ", "artist": " ivan ", "style": ""}) == {"name": "imported", "created": False}
+    assert Preset_Routes.lookup_preset("imported") == {"name": "imported", "artist": "ivan", "style": ""}
+    with pytest.raises(ValueError):
+        Preset_Routes.upsert_preset({"name": "  "})
+
+
+def test_unreadable_database_falls_back_to_config(env, store):
+    store.snapshot(config())
+    path = store.path
+    store.path = env.tmp_dir
+    try:
+        assert store.lookup(config(), "imported") == CONFIG_STYLES["imported"]
+        assert store.snapshot(config()).style_keys == list(config().styles)
+    finally:
+        store.path = path
+    # 恢复后重新打开原来的预设库
+    assert store.save(config(), "after_recovery", "judy", "")
+    assert os.path.exists(path)
@@ -0,0 +1,145 @@
+"""提示词历史（Prompt_History）：MinHash/LSH 查找与标签差异的本地修补"""
+import random
+
+import pytest
+
+from _package import load_module
+
+Prompt_History = load_module("Prompt_History")
+Tag_Formatter = load_module("Tag_Formatter")
+LPFXmlDocument = load_module("Xml_Document").LPFXmlDocument
+
+SETTINGS = Prompt_History.resolve_history_settings({"prompt_history": {"enabled": True}})
+
+BASE = "1girl, solo, long hair, blue eyes, (smile:1.2), simple background, white shirt, skirt, standing, looking at viewer"
+
+XML = """gemma header
+<img>
+ <character_1>
+ <n>A</n>
+ <gender>1girl</gender>
+ <appearance>long_hair, blue_eyes</appearance>
+ <expression>(smile:1.2)</expression>
+ </character_1>
+
+ <general_tags>
+ <count>solo</count>
+ <background>simple_background</background>
+ </general_tags>
+
+ <caption>A girl.</caption>
+</img>"""
+
+TWO_CHARACTERS = XML.replace("</character_1>", "</character_1>\n <character_2>\n <n>B</n>\n </character_2>")
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = Prompt_History.PromptHistory(str(tmp_path))
+    history.put("scope", BASE, (XML, "译文"), SETTINGS)
+    yield history
+    if history._conn is not None:
+        history._conn.close()
+
+
+@pytest.fixture(scope="module")
+def index():
+    return Tag_Formatter.load_tag_index(Tag_Formatter.resolve_tag_formatter_settings({}))
+
+
+def patch(history, index, user_text, xml=XML):
+    match = history.lookup("scope", user_text, SETTINGS)
+    assert match is not None
+    return match, Prompt_History.patch_document(LPFXmlDocument.from_string(xml), match, index)
+
+
+def test_normalize_tags():
+    assert Prompt_History.normalize_tags("Long  Hair, blue_eyes , (smile:1.2), artist:foo, solo\\(x\\)") == {
+        "long_hair", "blue_eyes", "(smile:1.2)", "artist:foo", "solo\\(x\\)"}
+    assert Prompt_History.normalize_tags(" , ") == frozenset()
+
+
+def test_minhash_is_stable():
+    tags = Prompt_History.normalize_tags(BASE)
+    signature = Prompt_History.minhash(tags)
+    assert len(signature) == Prompt_History.NUM_PERM
+    # 与标签顺序无关，不同进程也相同（不依赖 Python 内置的 hash）
+    assert (Prompt_History.minhash(frozenset(sorted(tags, reverse=True))) == signature).all()
+    assert len(Prompt_History.band_buckets("scope", signature)) == Prompt_History.BANDS
+    assert Prompt_History.band_buckets("scope", signature) != Prompt_History.band_buckets("other", signature)
+
+
+def test_exact_lookup_ignores_order_and_spelling(history):
+    match = history.lookup("scope", "solo, 1girl, Long_Hair, blue eyes, (smile:1.2), simple background, "
+                                    "white shirt, skirt, standing, looking at viewer", SETTINGS)
+    assert match.similarity == 1.0 and match.changes == 0
+    assert (match.xml_out, match.text_out) == (XML, "译文")
+    assert history.stats["exact_hits"] == 1
+
+
+def test_similar_lookup_reports_differences(history):
+    match = history.lookup("scope", BASE.replace("blue eyes", "green eyes"), SETTINGS)
+    assert match.similarity == pytest.approx(9 / 11)
+    assert match.added == {"green_eyes"} and match.removed == {"blue_eyes"}
+    assert history.stats["similar_hits"] == 1
+
+
+def test_lookup_misses(history):
+    assert history.lookup("scope", "1girl, cat ears", SETTINGS) is None
+    assert history.lookup("other", BASE, SETTINGS) is None
+    # 相似度 0.75，低于阈值 0.8
+    assert history.lookup("scope", BASE.replace("blue eyes, (smile:1.2)", "green eyes, frown"), SETTINGS) is None
+    assert history.lookup("scope", "", SETTINGS) is None
+
+
+def test_lookup_prefers_most_similar_among_many(history):
+    rng = random.Random(0)
+    vocabulary = [f"tag_{i}" for i in range(500)]
+    for i in range(300):
+        history.put("scope", ", ".join(rng.sample(vocabulary, 10)), (f"<img>{i}</img>", ""), SETTINGS)
+    closer = BASE + ", red ribbon"
+    history.put("scope", closer, ("<img>closer</img>", ""), SETTINGS)
+    match = history.lookup("scope", closer + ", hat", SETTINGS)
+    assert match.xml_out == "<img>closer</img>"
+    assert match.added == {"hat"} and not match.removed
+
+
+def test_put_replaces_same_tag_set(history):
+    history.put("scope", BASE.upper(), ("<img>new</img>", "新"), SETTINGS)
+    assert history.lookup("scope", BASE, SETTINGS).xml_out == "<img>new</img>"
+    assert history._connect().execute("SELECT count(*) FROM entries").fetchone()[0] == 1
+
+
+def test_patch_adds_tag_to_its_section(history, index):
+    _, (doc, reason) = patch(history, index, BASE + ", red ribbon")
+    assert reason is None
+    text = doc.to_string()
+    assert " <appearance>long_hair, blue_eyes</appearance>\n <clothing>red_ribbon</clothing>\n <expression>" in text
+    assert text.startswith("gemma header\n<img>")
+
+
+def test_patch_replaces_in_place(history, index):
+    _, (doc, reason) = patch(history, index, BASE.replace("blue eyes", "green eyes"))
+    assert reason is None and "<appearance>long_hair, green_eyes</appearance>" in doc.to_string()
+
+    _, (doc, reason) = patch(history, index, BASE.replace("(smile:1.2)", "smile"))
+    assert reason is None and "<expression>smile</expression>" in doc.to_string()
+
+
+def test_patch_keeps_history_document(history, index):
+    source = LPFXmlDocument.from_string(XML)
+    match = history.lookup("scope", BASE + ", red ribbon", SETTINGS)
+    Prompt_History.patch_document(source, match, index)
+    assert source.to_string() == XML and "red_ribbon" not in source.to_string()
+
+
+@pytest.mark.parametrize("user_text, xml, reason", [
+    (BASE + ", 2girls", XML, "会改变角色构成"),
+    (BASE.replace("solo", "multiple girls"), XML, "会改变角色构成"),
+    (BASE + ", lpf_not_a_real_tag", XML, "词表中没有"),
+    (BASE + ", red ribbon", TWO_CHARACTERS, "属于哪个角色"),
+    (BASE + ", red ribbon", "没有 XML", "没有 <img>"),
+])
+def test_patch_falls_back_to_llm(history, index, user_text, xml, reason):
+    _, (doc, message) = patch(history, index, user_text, xml)
+    assert doc is None and reason in message
@@ -0,0 +1,111 @@
+"""单遍扫描器（Response_Parser）与旧版正则级联 + repair_xml_custom 的输出对比"""
+import io
+import contextlib
+
+import pytest
+from lxml import etree
+
+import bench_response_parsing as legacy
+from _package import load_module
+
+Response_Parser = load_module("Response_Parser")
+LLM_Node = load_module("LLM_Node")
+LLM_Completion = load_module("LLM_Completion")
+
+CORPUS = legacy.build_corpus()
+# 需要修复的回复，修复结果同样应与旧版逐字节一致
+REPAIRED = {"malformed_fenced", "malformed_bare", "truncated"}
+
+
+def legacy_parse(response):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return legacy.legacy_parse(response, legacy.HEADER)
+
+
+def current_parse(response):
+    result = LLM_Completion.CompletionResult(content=response)
+    return LLM_Node.LLM_Prompt_Formatter().parse_completion(result, False, legacy.HEADER)
+
+
+def canonical(xml_string):
+    """去掉标签之间的空白后重新序列化"""
+    root = etree.fromstring(xml_string.encode('utf-8'), etree.XMLParser(remove_blank_text=True))
+    return etree.tostring(root, encoding='unicode')
+
+
+def split_header(xml_out):
+    header, _, xml_part = xml_out.partition("<img>")
+    return header, "<img>" + xml_part
+
+
+@pytest.mark.parametrize("case", sorted(CORPUS))
+def test_text_out_matches_legacy(case):
+    assert current_parse(CORPUS[case])[1] == legacy_parse(CORPUS[case])[1].strip()
+
+
+@pytest.mark.parametrize("case", sorted(CORPUS))
+def test_xml_out_matches_legacy(case):
+    assert current_parse(CORPUS[case])[0] == legacy_parse(CORPUS[case])[0]
+
+
+@pytest.mark.parametrize("case", sorted(REPAIRED))
+def test_repaired_tree_matches_repaired_text(case):
+    xml_out, _, doc = current_parse(CORPUS[case])
+    _, xml_part = split_header(xml_out)
+    assert canonical(xml_part) == etree.tostring(doc.root, encoding='unicode')
+
+
+@pytest.mark.parametrize("case", sorted(set(CORPUS) - {"missing"}))
+def test_document_root_is_parsed_once(case):
+    xml_out, _, doc = current_parse(CORPUS[case])
+    assert doc.root is not None and doc.root.tag == "img"
+    assert doc.to_string() == xml_out
+
+
+def test_scan_statuses():
+    assert Response_Parser.scan_response(CORPUS["fenced"]).status == "fenced"
+    assert Response_Parser.scan_response(CORPUS["bare"]).status == "bare"
+    assert Response_Parser.scan_response(CORPUS["truncated"]).status == "truncated"
+    assert Response_Parser.scan_response(CORPUS["missing"]).status == "missing"
+
+
+def test_scan_separates_think_blocks():
+    scanned = Response_Parser.scan_response("<think>a</think>```xml\n<img><x/></img>\n```\n译文<think>b</think>")
+    assert scanned.think_blocks == ["a", "b"]
+    assert scanned.xml_content == "<img><x/></img>"
+    assert scanned.img_document == "<img><x/></img>"
+    assert scanned.text_content == "译文"
+
+
+def test_scan_keeps_unclosed_think_as_text():
+    scanned = Response_Parser.scan_response("<think>未闭合 <img><x/></img> 译文")
+    assert scanned.think_blocks == []
+    assert scanned.status == "bare"
+    assert scanned.text_content == "<think>未闭合  译文"
+
+
+def test_scan_img_tags_are_case_insensitive():
+    scanned = Response_Parser.scan_response("<IMG><x/></IMG>\n译文")
+    assert scanned.status == "bare"
+    assert scanned.img_document == "<IMG><x/></IMG>"
+
+
+def test_parse_document_matches_repair_xml_custom():
+    valid = legacy.IMG_DOCUMENT
+    assert Response_Parser.parse_document(valid)[0] == valid
+    assert LLM_Node.repair_xml_custom(valid) == valid
+
+    broken = valid.replace("</expression>", "", 1)
+    repaired, root = Response_Parser.parse_document(broken)
+    assert root is not None
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert repaired == legacy.legacy_repair_xml_custom(broken)
+    assert LLM_Node.repair_xml_custom(broken) == repaired
+
+
+def test_parse_document_unrecoverable_returns_input():
+    assert Response_Parser.parse_document("   ") == ("   ", None)
+    text, root = Response_Parser.parse_document("完全不是 XML")
+    assert (text, root) == ("完全不是 XML", None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert legacy.legacy_repair_xml_custom("完全不是 XML") == text
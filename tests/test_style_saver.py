@@ -0,0 +1,47 @@
+"""风格预设保存（Style_Saver_Node）：字符串与 LPF_XML 两个节点"""
+import inspect
+
+import pytest
+
+from _package import load_module
+
+Style_Saver_Node = load_module("Style_Saver_Node")
+LPFXmlDocument = load_module("Xml_Document").LPFXmlDocument
+
+XML = "<img><character_1><artist>bob, alice</artist></character_1><general_tags><artist>alice</artist><style>oil</style></general_tags></img>"
+EXTRACTED = "<artist>bob, alice</artist>\n<style>oil</style>"
+
+
+def test_string_node_keeps_baseline_inputs():
+    inputs = Style_Saver_Node.LLM_Style_Saver.INPUT_TYPES()
+    assert list(inputs["required"]) == ["text_input", "preset_name", "save_trigger"]
+    assert "optional" not in inputs
+    assert list(inspect.signature(Style_Saver_Node.LLM_Style_Saver.save_preset_logic).parameters) == [
+        "self", "text_input", "preset_name", "save_trigger"]
+
+
+def test_string_node_saves(env):
+    saver = Style_Saver_Node.LLM_Style_Saver()
+    assert saver.save_preset_logic(XML, "saved", False) == (EXTRACTED,)
+    assert env.Preset_Store.preset_store.lookup(env.Config_Store.config_store.snapshot(), "saved") is None
+    assert saver.save_preset_logic(XML, " saved ", True) == (EXTRACTED,)
+    assert env.Preset_Store.preset_store.lookup(env.Config_Store.config_store.snapshot(), "saved") == {
+        "artist": "bob, alice", "style": "oil"}
+
+
+def test_document_node_saves(env):
+    inputs = Style_Saver_Node.LLM_Style_Saver_Doc.INPUT_TYPES()
+    assert list(inputs["required"]) == ["xml_doc", "preset_name", "save_trigger"]
+    saver = Style_Saver_Node.LLM_Style_Saver_Doc()
+    assert getattr(saver, saver.FUNCTION)(LPFXmlDocument.from_string(XML), "from_doc", True) == (EXTRACTED,)
+    assert env.Preset_Store.preset_store.lookup(env.Config_Store.config_store.snapshot(), "from_doc") == {
+        "artist": "bob, alice", "style": "oil"}
+    # 没有 <img> 的文档按字符串提取
+    assert saver.save_preset_doc(LPFXmlDocument.from_string("<style>ink</style>"), "", False) == (
+        "<artist></artist>\n<style>ink</style>",)
+
+
+def test_extract_requires_an_input():
+    with pytest.raises(ValueError):
+        Style_Saver_Node.extract_tags()
+    assert Style_Saver_Node.extract_tags("") == ("", "")
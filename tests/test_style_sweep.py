@@ -0,0 +1,88 @@
+"""风格预设扫描（StyleSweep）的输出与逐个使用 XML Style Injector 相同"""
+import pytest
+from lxml import etree
+
+from _package import load_module
+
+LLM_Style_Node = load_module("LLM_Style_Node")
+LPFXmlDocument = LLM_Style_Node.LPFXmlDocument
+
+DOCUMENTS = {
+    "full": "gemma header\n<img><general_tags><style>oil</style><artist>bob</artist></general_tags><caption>c</caption></img>",
+    "no_artist": "<img><general_tags><style>oil</style></general_tags></img>",
+    "no_general_tags": "<img><caption>c</caption></img>",
+    "repeated": "<img><character_1><artist>a</artist></character_1><general_tags><artist/><style/></general_tags></img>",
+    "no_img": "plain text",
+}
+
+PRESETS = {
+    "escaped": ("a&1 <x>", "watercolor\r"),
+    "artist_only": ("artist_1, x", ""),
+    "style_only": ("", "style_2"),
+    "empty": ("", ""),
+    "invalid": ("a\x01", "s"),
+}
+
+ADDITIONS = [("", ""), ("extra", ""), ("", "s&")]
+
+
+@pytest.fixture
+def presets(env):
+    config = env.Config_Store.config_store.snapshot()
+    for name, (artist, style) in PRESETS.items():
+        env.Preset_Store.preset_store.save(config, name, artist, style)
+    return "\n".join(PRESETS)
+
+
+def tree(doc):
+    # header 在首次访问 root 时才确定
+    root = doc.root
+    return doc.header.strip(), etree.tostring(root)
+
+
+@pytest.mark.parametrize("document", sorted(DOCUMENTS))
+@pytest.mark.parametrize("artist_add, style_add", ADDITIONS)
+def test_sweep_matches_injector(presets, document, artist_add, style_add):
+    xml_input = DOCUMENTS[document]
+    texts, docs, names = LLM_Style_Node.LLM_Xml_Style_Sweep().sweep(
+        presets, "", 100, xml_input=xml_input, artist_add=artist_add, style_add=style_add)
+    assert names == list(PRESETS)
+
+    injector = LLM_Style_Node.LLM_Xml_Style_Injector()
+    doc_injector = LLM_Style_Node.LLM_Xml_Style_Injector_Doc()
+    for text, doc, name in zip(texts, docs, names):
+        (expected_text,) = injector.inject_style(xml_input, name, artist_add, style_add)
+        assert text == expected_text
+        _, expected_doc = doc_injector.inject_doc(LPFXmlDocument.from_string(xml_input), name, artist_add, style_add)
+        if expected_doc.root is not None:
+            assert tree(doc) == tree(expected_doc)
+
+
+def test_render_reuses_templates_and_keeps_source():
+    source = LPFXmlDocument.from_string(DOCUMENTS["full"])
+    original = source.to_string()
+    sweep = LLM_Style_Node.StyleSweep(source)
+    first = sweep.render("alice", "ink")
+    second = sweep.render("carol & dave", "pencil")
+    assert len(sweep._templates) == 1
+    assert "<artist>alice</artist>" in first.to_string() and "<style>ink</style>" in first.to_string()
+    assert "<artist>carol &amp; dave</artist>" in second.to_string()
+    assert source.to_string() == original
+
+    # 输出的文档可以单独修改，不影响模板与其他输出
+    second.root.find(".//artist").text = "changed"
+    assert sweep.render("alice", "ink").to_string() == first.to_string()
+
+
+def test_render_text_containing_marker_like_content():
+    source = LPFXmlDocument.from_string(DOCUMENTS["full"])
+    marker = LLM_Style_Node._SWEEP_MARKERS["style"]
+    doc = LLM_Style_Node.StyleSweep(source).render(marker, "")
+    assert doc.to_string() == LLM_Style_Node.LLM_Xml_Style_Injector_Doc().inject_doc(
+        LPFXmlDocument.from_string(DOCUMENTS["full"]), "__missing__", marker, "")[1].to_string()
+
+
+def test_render_rejects_invalid_characters():
+    sweep = LLM_Style_Node.StyleSweep(LPFXmlDocument.from_string(DOCUMENTS["full"]))
+    with pytest.raises(ValueError):
+        sweep.render("a\x01", "")
@@ -0,0 +1,140 @@
+"""标签词典（Tag_Dictionary）：索引构建、近似查找与文档校验"""
+import os
+
+import pytest
+
+from _package import load_module
+
+Tag_Dictionary = load_module("Tag_Dictionary")
+LPFXmlDocument = load_module("Xml_Document").LPFXmlDocument
+
+TABLE = """tag,category,post_count,aliases
+long_hair,appearance,900,"longhair,long_hairs"
+blue_eyes,appearance,800,
+blue_eye,appearance,5,
+white_shirt,clothing,700,
+white_skirt,clothing,100,
+smile,expression,600,
+kitagawa_marin,character,50,
+sono_bisque_doll_wa_koi_wo_suru,copyright,40,
+wlop,artist,30,
+"""
+
+
+def write_table(directory, text=TABLE, name="user_tags.csv"):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def dictionary(tmp_path):
+    path = str(tmp_path / "tags.idx")
+    Tag_Dictionary.build_index([write_table(str(tmp_path))], path, 2)
+    dictionary = Tag_Dictionary.TagDictionary(path)
+    yield dictionary
+    dictionary.close()
+
+
+def settings(mode="correct", tables=("user_tags.csv",)):
+    return Tag_Dictionary.resolve_tag_validation_settings(
+        {"tag_validation": {"enabled": True, "mode": mode, "tables": list(tables)}})
+
+
+def test_edit_distance():
+    assert Tag_Dictionary.edit_distance("long_hair", "long_hair", 2) == 0
+    assert Tag_Dictionary.edit_distance("long_hiar", "long_hair", 2) == 1
+    assert Tag_Dictionary.edit_distance("lnog_hiar", "long_hair", 2) == 2
+    assert Tag_Dictionary.edit_distance("short_hair", "long_hair", 2) == 3
+    assert Tag_Dictionary.edit_distance("a", "abcdef", 2) == 3
+
+
+def test_exact_and_alias_lookup(dictionary):
+    assert dictionary.count == 11
+    assert dictionary.lookup("Long Hair") == ("long_hair", 0)
+    assert dictionary.lookup("longhair") == ("long_hair", 0)
+    assert dictionary.lookup("long hairs") == ("long_hair", 0)
+    assert dictionary.lookup("blue_eye") == ("blue_eye", 0)
+
+
+def test_near_miss_lookup(dictionary):
+    assert dictionary.lookup("long_hiar") == ("long_hair", 1)
+    assert dictionary.lookup("whte_shirt") == ("white_shirt", 1)
+    assert dictionary.lookup("kitagwa_mrin") == ("kitagawa_marin", 2)
+    # 距离相同时取使用次数更多的标签
+    assert dictionary.lookup("blue_eyez") == ("blue_eyes", 1)
+    assert dictionary.lookup("kitagwa_mrin", max_distance=1) == (None, None)
+    assert dictionary.lookup("completely_unrelated") == (None, None)
+
+
+def test_short_tags_are_not_corrected(dictionary):
+    # 3 个字符以内不修正，8 个字符以内最多改 1 处
+    assert dictionary.lookup("wlp") == (None, None)
+    assert dictionary.lookup("smlie") == ("smile", 1)
+    assert dictionary.lookup("smlei") == (None, None)
+    # 查询结果缓存后不变
+    assert dictionary.lookup("smlie") == ("smile", 1)
+
+
+def test_resolve_settings_without_user_tables_only_flags():
+    assert settings(tables=())["mode"] == "flag"
+    assert settings()["mode"] == "correct"
+    assert Tag_Dictionary.resolve_tag_validation_settings({"tag_validation": {"max_distance": 9}})["max_distance"] == 3
+
+
+def test_store_builds_index_once(tmp_path):
+    table = write_table(str(tmp_path))
+    store = Tag_Dictionary.TagDictionaryStore(str(tmp_path / "index"))
+    first = store.get(settings(tables=[table]))
+    assert store.get(settings(tables=[table])) is first
+    assert first.lookup("long_hiar") == ("long_hair", 1)
+    # 自带词表排在用户词表之前
+    assert first.lookup("1girl") == ("1girl", 0)
+
+    write_table(str(tmp_path), TABLE + "cat_ears,appearance,10,\n")
+    second = store.get(settings(tables=[table]))
+    assert second is not first and second.lookup("cat_ear") == ("cat_ears", 1)
+    assert len(os.listdir(tmp_path / "index")) == 1
+
+
+def test_store_skips_missing_tables(tmp_path):
+    store = Tag_Dictionary.TagDictionaryStore(str(tmp_path / "index"))
+    assert store.get(settings(tables=[str(tmp_path / "missing.csv")])).lookup("1girl") == ("1girl", 0)
+
+
+XML = """<img>
+<character_1>
+<n>long hiar</n>
+<appearance>long hiar, (blue_eyez:1.2), longhair</appearance>
+<clothing>white_shirt, not_in_table_at_all</clothing>
+</character_1>
+<general_tags>
+<artist>artist:wlop, artist:wlpo_x</artist>
+</general_tags>
+<caption>long hiar</caption>
+</img>"""
+
+
+def test_validate_document_corrects(dictionary):
+    source = LPFXmlDocument.from_string(XML)
+    doc, corrections, unknown = Tag_Dictionary.validate_document(source, dictionary, settings())
+    assert corrections == [("long hiar", "long_hair"), ("(blue_eyez:1.2)", "(blue_eyes:1.2)"), ("longhair", "long_hair")]
+    assert unknown == ["not_in_table_at_all", "artist:wlpo_x"]
+    text = doc.to_string()
+    assert "<appearance>long_hair, (blue_eyes:1.2), long_hair</appearance>" in text
+    # <n> 与 <caption> 不是标签列表
+    assert "<n>long hiar</n>" in text and "<caption>long hiar</caption>" in text
+    assert source.to_string() == XML
+
+
+def test_validate_document_flag_mode_keeps_document(dictionary):
+    source = LPFXmlDocument.from_string(XML)
+    doc, corrections, unknown = Tag_Dictionary.validate_document(source, dictionary, settings(mode="flag"))
+    assert doc is source
+    assert len(corrections) == 3 and len(unknown) == 2
+
+
+def test_validate_document_without_img(dictionary):
+    source = LPFXmlDocument.from_string("没有 XML")
+    assert Tag_Dictionary.validate_document(source, dictionary, settings()) == (source, [], [])
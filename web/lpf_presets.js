@@ -0,0 +1,201 @@
+import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
+
+// XML Style Injector（包括 LPF_XML 版本）的预设检索与编辑：下拉框只列出前 dropdown_limit 个预设，
+// 其余预设通过 /lpf/presets 分页检索后按需加入下拉框。
+
+const INJECTOR_NODES = ["LLM_Xml_Style_Injector", "LLM_Xml_Style_Injector_Doc"];
+const PAGE_SIZE = 50;
+const SEARCH_DELAY = 250;
+
+async function fetchPresets(query, offset, limit) {
+    const params = new URLSearchParams({ q: query, offset: String(offset), limit: String(limit) });
+    const response = await api.fetchApi(`/lpf/presets?${params}`);
+    if (!response.ok) {
+        throw new Error(`检索预设失败：HTTP ${response.status}`);
+    }
+    return await response.json();
+}
+
+async function savePreset(name, artist, style) {
+    const response = await api.fetchApi("/lpf/presets", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ name, artist, style }),
+    });
+    const result = await response.json();
+    if (!response.ok) {
+        throw new Error(result.error || `保存预设失败：HTTP ${response.status}`);
+    }
+    return result;
+}
+
+function debounce(fn, delay) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), delay);
+    };
+}
+
+function addLocalWidget(node, widget) {
+    // 检索框与按钮只在前端使用，不写入工作流
+    widget.serialize = false;
+    widget.options = widget.options || {};
+    widget.options.serialize = false;
+    return widget;
+}
+
+function el(tag, props = {}, children = []) {
+    const element = Object.assign(document.createElement(tag), props);
+    for (const child of children) {
+        element.append(child);
+    }
+    return element;
+}
+
+function openEditor(node, presetWidget) {
+    const overlay = el("div", {
+        style: "position:fixed;inset:0;background:rgba(0,0,0,0.5);z-index:10000;display:flex;align-items:center;justify-content:center;",
+    });
+    const dialog = el("div", {
+        style: "background:var(--comfy-menu-bg,#222);color:var(--fg-color,#ddd);padding:16px;border-radius:8px;width:640px;max-height:80vh;display:flex;flex-direction:column;gap:8px;font-size:13px;",
+    });
+    const search = el("input", { type: "text", placeholder: "按名称或标签检索", style: "width:100%;" });
+    const summary = el("div", { style: "opacity:0.7;" });
+    const list = el("div", { style: "flex:1;overflow:auto;min-height:160px;border:1px solid #555;" });
+    const more = el("button", { textContent: "加载更多" });
+    const nameInput = el("input", { type: "text", placeholder: "预设名称", style: "width:100%;" });
+    const artistInput = el("textarea", { placeholder: "artist", rows: 2, style: "width:100%;" });
+    const styleInput = el("textarea", { placeholder: "style", rows: 3, style: "width:100%;" });
+    const status = el("div", { style: "min-height:1em;" });
+    const save = el("button", { textContent: "保存" });
+    const close = el("button", { textContent: "关闭" });
+
+    let query = "";
+    let loaded = 0;
+    let total = 0;
+    let generation = 0;
+
+    function select(item) {
+        nameInput.value = item.name;
+        artistInput.value = item.artist;
+        styleInput.value = item.style;
+        status.textContent = "";
+    }
+
+    async function load(reset) {
+        const current = reset ? ++generation : generation;
+        if (reset) {
+            loaded = 0;
+            list.replaceChildren();
+        }
+        try {
+            const page = await fetchPresets(query, loaded, PAGE_SIZE);
+            if (current !== generation) {
+                return;
+            }
+            total = page.total;
+            loaded += page.items.length;
+            for (const item of page.items) {
+                const row = el("div", {
+                    textContent: item.name,
+                    title: `${item.artist}\n${item.style}`,
+                    style: "padding:2px 6px;cursor:pointer;",
+                });
+                row.addEventListener("click", () => select(item));
+                list.append(row);
+            }
+            summary.textContent = `共 ${total} 个预设，已显示 ${loaded} 个`;
+            more.disabled = loaded >= total;
+        } catch (error) {
+            summary.textContent = error.message;
+        }
+    }
+
+    search.addEventListener("input", debounce(() => {
+        query = search.value.trim();
+        load(true);
+    }, SEARCH_DELAY));
+    more.addEventListener("click", () => load(false));
+    save.addEventListener("click", async () => {
+        const name = nameInput.value.trim();
+        if (!name) {
+            status.textContent = "请填写预设名称";
+            return;
+        }
+        try {
+            const result = await savePreset(name, artistInput.value, styleInput.value);
+            status.textContent = result.created ? `已新增预设 '${result.name}'` : `已更新预设 '${result.name}'`;
+            const values = presetWidget.options.values;
+            if (!values.includes(result.name)) {
+                values.push(result.name);
+            }
+            load(true);
+        } catch (error) {
+            status.textContent = error.message;
+        }
+    });
+    close.addEventListener("click", () => overlay.remove());
+    overlay.addEventListener("click", (event) => {
+        if (event.target === overlay) {
+            overlay.remove();
+        }
+    });
+
+    dialog.append(
+        search, summary, list, more,
+        nameInput, artistInput, styleInput, status,
+        el("div", { style: "display:flex;gap:8px;justify-content:flex-end;" }, [save, close]),
+    );
+    overlay.append(dialog);
+    document.body.append(overlay);
+    search.focus();
+    load(true);
+}
+
+app.registerExtension({
+    name: "LPF.PresetCatalog",
+    async beforeRegisterNodeDef(nodeType, nodeData) {
+        if (!INJECTOR_NODES.includes(nodeData.name)) {
+            return;
+        }
+        const onNodeCreated = nodeType.prototype.onNodeCreated;
+        nodeType.prototype.onNodeCreated = function () {
+            const result = onNodeCreated?.apply(this, arguments);
+            const presetWidget = this.widgets?.find((w) => w.name === "preset");
+            if (!presetWidget) {
+                return result;
+            }
+            const initialValues = [...presetWidget.options.values];
+            let generation = 0;
+
+            const runSearch = debounce(async (value) => {
+                const query = value.trim();
+                const current = ++generation;
+                if (!query) {
+                    presetWidget.options.values = [...initialValues];
+                    return;
+                }
+                try {
+                    const page = await fetchPresets(query, 0, PAGE_SIZE);
+                    if (current !== generation) {
+                        return;
+                    }
+                    const names = page.items.map((item) => item.name);
+                    // 保留当前选中的预设，避免检索后值不在下拉框中
+                    if (!names.includes(presetWidget.value)) {
+                        names.unshift(presetWidget.value);
+                    }
+                    presetWidget.options.values = names;
+                } catch (error) {
+                    console.warn("[LPF]", error);
+                }
+            }, SEARCH_DELAY);
+
+            addLocalWidget(this, this.addWidget("text", "preset_search", "", runSearch));
+            addLocalWidget(this, this.addWidget("button", "编辑预设", null, () => openEditor(this, presetWidget)));
+            return result;
+        };
+    },
+});